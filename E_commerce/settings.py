@@ -12,6 +12,10 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,7 +46,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'catalog.middleware.QueryStatsMiddleware',
+    'catalog.middleware.TemplateProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'catalog.middleware.StaticFilesMiddleware',
+    'catalog.middleware.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -57,13 +65,21 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compiled templates are kept per process. With DEBUG the cache
+            # is cleared whenever the autoreloader sees a template change.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.context_processors.cart_summary',
             ],
         },
     },
@@ -74,14 +90,115 @@ WSGI_APPLICATION = 'E_commerce.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-
-DATABASES = {
+# Read from the environment or a .env file (python-decouple). DB_ENGINE
+# picks the profile:
+#
+#   sqlite    (default) SQLITE_PATH, SQLITE_BUSY_TIMEOUT (milliseconds),
+#             SQLITE_SYNCHRONOUS
+#   postgres  DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, plus either
+#             DB_POOL=true to pool connections in each process (needs
+#             psycopg[pool]; DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE) or
+#             DB_PGBOUNCER=true when connecting through PgBouncer in
+#             transaction pooling mode
+#
+# DB_CONN_MAX_AGE keeps each thread's connection open for that many seconds
+# across requests (0 reconnects on every request); DB_POOL replaces it.
+# ``manage.py benchmark_db`` compares concurrent checkout throughput of a
+# bare SQLite database with the SQLite profile below.
+
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
+if DB_ENGINE == 'sqlite':
+    SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)
+    SQLITE_SYNCHRONOUS = config('SQLITE_SYNCHRONOUS', default='NORMAL')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # WAL lets pages keep reading while a checkout writes, and
+                # synchronous=NORMAL only syncs at checkpoints in WAL mode.
+                # Transactions take the write lock up front (BEGIN IMMEDIATE),
+                # where busy_timeout makes them queue for it; a deferred
+                # transaction that read first fails with "database is locked"
+                # when it tries to write while another writer holds the lock.
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT};'
+                    f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+elif DB_ENGINE == 'postgres':
+    DB_POOL = config('DB_POOL', default=False, cast=bool)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='shophub'),
+            'USER': config('DB_USER', default='shophub'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            # Django's pool refuses persistent connections on top of it
+            'CONN_MAX_AGE': 0 if DB_POOL else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': not DB_POOL,
+            # Server-side cursors (QuerySet.iterator()) do not survive
+            # PgBouncer handing the connection to another client between
+            # transactions
+            'DISABLE_SERVER_SIDE_CURSORS': config('DB_PGBOUNCER', default=False, cast=bool),
+            'OPTIONS': {},
+        }
+    }
+    if DB_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': 10,
+        }
+else:
+    raise ImproperlyConfigured(f"DB_ENGINE must be 'sqlite' or 'postgres', not {DB_ENGINE!r}")
+
+# Read replicas, added as aliases replica1, replica2, ...: SQLITE_REPLICA_PATHS
+# (comma separated files; ``manage.py sync_sqlite_replicas`` copies the
+# primary into them) or DB_REPLICA_HOSTS (servers sharing the primary's
+# database name and credentials). catalog.routers.ReplicaRouter sends the
+# catalog reads of the browsing views there.
+if DB_ENGINE == 'sqlite':
+    DB_REPLICAS = [
+        {**DATABASES['default'], 'NAME': name} for name in config('SQLITE_REPLICA_PATHS', default='', cast=Csv())
+    ]
+else:
+    DB_REPLICAS = [
+        {**DATABASES['default'], 'HOST': host} for host in config('DB_REPLICA_HOSTS', default='', cast=Csv())
+    ]
+for number, replica in enumerate(DB_REPLICAS, 1):
+    # Tests read the replicas' data from the test database
+    DATABASES[f'replica{number}'] = {**replica, 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Catalog pages and fragments are cached here (see catalog/caching.py). For
+# multi-process deployments point this at a shared backend, e.g.
+# 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION
+# directory, or 'django.core.cache.backends.redis.RedisCache' with
+# LOCATION 'redis://127.0.0.1:6379'.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shophub',
     }
 }
 
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -123,6 +240,24 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# ``manage.py build_static`` downloads the vendored assets (catalog.assets)
+# and runs collectstatic. Outside DEBUG, collectstatic stores content-hashed
+# names with gzip/brotli copies, and catalog.middleware.StaticFilesMiddleware
+# serves STATIC_ROOT with immutable cache headers for the hashed names and
+# STATIC_MAX_AGE seconds for the rest.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'catalog.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+STATIC_MAX_AGE = 60
+
 # Media files (User uploaded content)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -132,6 +267,80 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Per-request SQL statistics (catalog.middleware.QueryStatsMiddleware).
+# Requests over the threshold, or repeating a query, are logged to
+# ``catalog.querystats`` at WARNING; set QUERY_STATS_LOG_LEVEL=ERROR to
+# silence them. The test suite checks query counts itself, so it does.
+QUERY_STATS_HEADERS = DEBUG
+QUERY_STATS_LOG_THRESHOLD = 20
+TESTING = sys.argv[1:2] == ['test']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {
+        'catalog.querystats': {
+            'handlers': ['console'],
+            'level': 'ERROR' if TESTING else config('QUERY_STATS_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Template profiling (catalog.middleware.TemplateProfileMiddleware): time
+# every template, block and include per request, reported in a
+# Server-Timing header and on the console. Set CATALOG_TEMPLATE_PROFILE=1.
+CATALOG_TEMPLATE_PROFILE = config('CATALOG_TEMPLATE_PROFILE', default=False, cast=bool)
+CATALOG_TEMPLATE_PROFILE_TOP = 10
+
+if CATALOG_TEMPLATE_PROFILE:
+    LOGGING['loggers']['catalog.templateprofile'] = {'handlers': ['console'], 'level': 'INFO'}
+
+# Product search
+# Dotted path to a catalog.search backend class. When unset, the backend is
+# picked from the database vendor (SQLite FTS5, PostgreSQL tsvector).
+CATALOG_SEARCH_BACKEND = None
+
+# Product image renditions (catalog.images): size of the background thread
+# pool that resizes uploads. 0 builds renditions inline, in the request.
+CATALOG_IMAGE_WORKERS = 2
+
+# Let the async storefront views run independent queries on separate
+# threads and connections (catalog.concurrency), kept open per
+# DB_CONN_MAX_AGE or taken from the DB_POOL pool.
+CATALOG_CONCURRENT_QUERIES = True
+
+# Read replicas (catalog.routers): aliases the browsing views read the
+# catalog from, 'round_robin' or 'least_loaded' selection, and how long a
+# browser reads from the primary after writing.
+CATALOG_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+CATALOG_REPLICA_SELECTION = config('CATALOG_REPLICA_SELECTION', default='round_robin')
+CATALOG_REPLICA_STICKY_SECONDS = 10
+
+# Stock holds (catalog.reservations): seconds units stay reserved for a cart
+# after its last change. Run ``manage.py sweep_reservations --interval 60``
+# alongside the web workers to hand expired holds back.
+CATALOG_RESERVATION_TTL = 15 * 60
+
+# Anonymous visitors' carts are kept in this signed cookie (catalog.cart.GuestCart)
+# and merged into their account's cart when they log in.
+CATALOG_GUEST_CART_COOKIE = 'guest_cart'
+
+# Order numbers (catalog.ordernumbers). Give every worker process generating
+# orders its own node id (0-65535); a random one is picked when unset.
+CATALOG_NODE_ID = config('CATALOG_NODE_ID', default='', cast=lambda value: int(value) if value else None)
+
+# Background jobs (catalog.jobs, ``manage.py run_jobs``). Eager mode runs
+# each job in-process as soon as its transaction commits, without a worker.
+CATALOG_JOBS_EAGER = False
+CATALOG_LOW_STOCK_THRESHOLD = 5
+CATALOG_CONTACT_EMAIL = config('CATALOG_CONTACT_EMAIL', default='support@shophub.example')
+
+# Print outgoing mail to the console in development
+if DEBUG:
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
 # Login/Logout URLs
 LOGIN_URL = 'catalog:login'
 LOGIN_REDIRECT_URL = 'catalog:home'
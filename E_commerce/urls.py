@@ -21,6 +21,7 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/v1/', include('catalog.api_urls')),
     path('', include('catalog.urls')),
 ]
 
@@ -1,5 +1,31 @@
 from django.contrib import admin
-from .models import Category, Product, Cart, CartItem, Order, OrderItem
+from django.core.exceptions import PermissionDenied
+from django.db.models import F
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+
+from . import analytics, transfer
+from .models import Category, Product, Cart, CartItem, Job, Order, OrderItem, StockReservation
+from .pagination import EstimatedCountPaginator
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow without bound: no full COUNT(*) per page"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+class ExportActionsMixin:
+    """Admin actions streaming the selected rows as a catalog.transfer export"""
+    export_dataset = None
+    actions = ['export_csv', 'export_jsonl']
+    
+    @admin.action(description='Export selected rows as CSV')
+    def export_csv(self, request, queryset):
+        return transfer.export_response(self.export_dataset, 'csv', queryset)
+    
+    @admin.action(description='Export selected rows as JSON Lines')
+    def export_jsonl(self, request, queryset):
+        return transfer.export_response(self.export_dataset, 'jsonl', queryset)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -8,35 +34,135 @@ class CategoryAdmin(admin.ModelAdmin):
     list_filter = ['created_at']
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'stock', 'is_active', 'created_at']
+class ProductAdmin(ExportActionsMixin, admin.ModelAdmin):
+    list_display = ['name', 'category', 'price', 'stock', 'reserved', 'is_active', 'created_at']
     list_filter = ['category', 'is_active', 'created_at']
     search_fields = ['name', 'description']
     list_editable = ['price', 'stock', 'is_active']
+    list_select_related = ['category']
     prepopulated_fields = {'description': ('name',)}
+    export_dataset = 'products'
 
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
+    # item_count and subtotal are stored on the cart (Cart.update_totals), so
+    # the list needs neither the cart lines nor an aggregate over them
     list_display = ['user', 'item_count', 'total_price', 'created_at']
     list_filter = ['created_at']
+    list_select_related = ['user']
     search_fields = ['user__username']
+    
+    @admin.display(description='Total price', ordering='subtotal')
+    def total_price(self, obj):
+        return obj.subtotal
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display = ['cart', 'product', 'quantity', 'total_price']
     list_filter = ['created_at']
+    list_select_related = ['cart__user', 'product']
     search_fields = ['product__name', 'cart__user__username']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            line_total=F('product__price') * F('quantity'),
+        )
+    
+    @admin.display(description='Total price', ordering='line_total')
+    def total_price(self, obj):
+        return obj.line_total
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.cart.update_totals()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.cart.update_totals()
+    
+    def delete_queryset(self, request, queryset):
+        cart_ids = list(queryset.values_list('cart_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        Cart.objects.filter(id__in=cart_ids).update_totals()
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ExportActionsMixin, LargeTableAdmin):
     list_display = ['order_number', 'user', 'status', 'total_amount', 'created_at']
     list_filter = ['status', 'created_at']
+    list_select_related = ['user']
     search_fields = ['order_number', 'user__username']
     list_editable = ['status']
     readonly_fields = ['order_number', 'created_at', 'updated_at']
+    change_list_template = 'admin/catalog/order/change_list.html'
+    export_dataset = 'orders'
+    
+    DASHBOARD_RANGES = [7, 30, 90, 365]
+    
+    def get_urls(self):
+        return [
+            path('sales/', self.admin_site.admin_view(self.sales_dashboard), name='catalog_order_sales'),
+        ] + super().get_urls()
+    
+    def sales_dashboard(self, request):
+        """Revenue by day, top products and categories, read from the sales rollups"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        days = request.GET.get('days', '')
+        days = int(days) if days.isdigit() and int(days) in self.DASHBOARD_RANGES else 30
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Sales dashboard',
+            'opts': self.model._meta,
+            'days': days,
+            'ranges': self.DASHBOARD_RANGES,
+            **analytics.dashboard(days),
+        }
+        return TemplateResponse(request, 'admin/catalog/order/sales_dashboard.html', context)
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(ExportActionsMixin, LargeTableAdmin):
     list_display = ['order', 'product_name', 'price', 'quantity', 'total_price']
     list_filter = ['order__status']
+    list_select_related = ['order']
     search_fields = ['product_name', 'order__order_number']
+    export_dataset = 'order_items'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            line_total=F('price') * F('quantity'),
+        )
+    
+    @admin.display(description='Total price', ordering='line_total')
+    def total_price(self, obj):
+        return obj.line_total
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    # Holds are managed by catalog.reservations; editing them here would
+    # put the products' reserved counters out of step
+    list_display = ['product', 'cart', 'quantity', 'expires_at']
+    list_select_related = ['product', 'cart__user']
+    search_fields = ['product__name', 'cart__user__username']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ['task', 'status', 'attempts', 'run_after', 'created_at', 'updated_at']
+    list_filter = ['status', 'task']
+    readonly_fields = ['task', 'payload', 'attempts', 'locked_by', 'locked_at', 'last_error', 'created_at', 'updated_at']
+    actions = ['retry_jobs']
+    
+    @admin.action(description='Retry selected jobs now')
+    def retry_jobs(self, request, queryset):
+        count = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_after=timezone.now(), last_error='',
+        )
+        self.message_user(request, f'{count} job(s) queued again.')
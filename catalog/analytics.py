@@ -0,0 +1,175 @@
+"""
+Daily sales rollups: orders, units and revenue per day, overall and by
+category and product, kept in SalesRollup so reports never scan OrderItem.
+
+Rollups are maintained incrementally. Every saved order queues a
+``sync_order`` job (catalog.jobs) that adds the order's lines to the rollups
+of its day, or takes them out again once it is cancelled. Each order records
+whether it is currently counted (``Order.in_sales_rollups``), so running the
+job twice, or after another status change, never counts an order twice. The
+additions are a single ``INSERT ... ON CONFLICT DO UPDATE SET n = n +
+excluded.n``, so concurrent orders on the same day cannot lose updates.
+
+``rebuild()`` (``manage.py rebuild_sales_rollups``) recomputes a date range
+from the orders, a chunk of days per transaction, e.g. after importing old
+orders. Run it while no job worker is processing orders of those days.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .jobs import task
+from .models import Category, Order, OrderItem, Product, SalesRollup
+
+ROLLUP_COLUMNS = ['date', 'dimension', 'key', 'orders', 'units', 'revenue']
+
+
+def order_rows(order, sign=1):
+    """Return ``(date, dimension, key, orders, units, revenue)`` tuples adding ``sign`` times ``order``"""
+    totals = {}
+    for product_id, category_id, quantity, price in order.items.values_list(
+        'product_id', 'product__category_id', 'quantity', 'price',
+    ):
+        for dimension_key in (('all', 0), ('category', category_id), ('product', product_id)):
+            units, revenue = totals.get(dimension_key, (0, Decimal('0')))
+            totals[dimension_key] = (units + quantity, revenue + price * quantity)
+    day = timezone.localdate(order.created_at)
+    return [
+        (day, dimension, key, sign, sign * units, sign * revenue)
+        for (dimension, key), (units, revenue) in totals.items()
+    ]
+
+
+def add_to_rollups(rows):
+    """Add the rows' counts to SalesRollup, creating missing rows, in one statement"""
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    table = quote(SalesRollup._meta.db_table)
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows))
+    sql = (
+        f'INSERT INTO {table} ({", ".join(quote(column) for column in ROLLUP_COLUMNS)}) VALUES {values} '
+        f'ON CONFLICT ({quote("date")}, {quote("dimension")}, {quote("key")}) DO UPDATE SET '
+        + ', '.join(
+            f'{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}'
+            for column in ('orders', 'units', 'revenue')
+        )
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+@task
+def sync_order(order_id):
+    """Add the order to its day's rollups, or take it out once cancelled"""
+    with transaction.atomic():
+        order = (
+            Order.objects.select_for_update().filter(pk=order_id)
+            .only('id', 'status', 'created_at', 'in_sales_rollups').first()
+        )
+        if order is None:
+            return
+        counted = order.status != 'cancelled'
+        if counted == order.in_sales_rollups:
+            return
+        add_to_rollups(order_rows(order, 1 if counted else -1))
+        Order.objects.filter(pk=order.pk).update(in_sales_rollups=counted)
+
+
+def day_bounds(first, last):
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(first, time.min), tz),
+        timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min), tz),
+    )
+
+
+def rebuild_days(first, last):
+    """Recompute the rollups of ``first`` to ``last`` (inclusive) from their orders"""
+    since, until = day_bounds(first, last)
+    items = (
+        OrderItem.objects.filter(order__created_at__gte=since, order__created_at__lt=until)
+        .exclude(order__status='cancelled')
+        .annotate(day=TruncDate('order__created_at', tzinfo=timezone.get_current_timezone()))
+        .order_by()
+    )
+    rollups = []
+    for dimension, field in (('all', None), ('category', 'product__category_id'), ('product', 'product_id')):
+        rows = items.values('day', *([field] if field else [])).annotate(
+            order_count=Count('order_id', distinct=True),
+            unit_count=Sum('quantity'),
+            revenue_total=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+        rollups.extend(
+            SalesRollup(
+                date=row['day'], dimension=dimension, key=row[field] if field else 0,
+                orders=row['order_count'], units=row['unit_count'], revenue=row['revenue_total'],
+            )
+            for row in rows
+        )
+    with transaction.atomic():
+        SalesRollup.objects.filter(date__gte=first, date__lte=last).delete()
+        SalesRollup.objects.bulk_create(rollups, batch_size=1000)
+        Order.objects.filter(created_at__gte=since, created_at__lt=until).update(
+            in_sales_rollups=Case(When(status='cancelled', then=Value(False)), default=Value(True)),
+        )
+    return len(rollups)
+
+
+def rebuild(first, last, chunk_days=7):
+    """Rebuild ``first`` to ``last`` a chunk at a time, yielding ``(chunk_first, chunk_last, rows)``"""
+    while first <= last:
+        chunk_last = min(first + timedelta(days=chunk_days - 1), last)
+        yield first, chunk_last, rebuild_days(first, chunk_last)
+        first = chunk_last + timedelta(days=1)
+
+
+def summarize(rows, names):
+    return [
+        {'id': row['key'], 'name': names.get(row['key'], f'#{row["key"]} (deleted)'),
+         'orders': row['orders'], 'units': row['units'], 'revenue': row['revenue']}
+        for row in rows
+    ]
+
+
+def dashboard(days=30, top=10, today=None):
+    """Sales of the last ``days`` days: daily series, totals, top products and categories"""
+    today = today or timezone.localdate()
+    since = today - timedelta(days=days - 1)
+    rollups = SalesRollup.objects.filter(date__gte=since, date__lte=today)
+    per_key = {'orders': Sum('orders'), 'units': Sum('units'), 'revenue': Sum('revenue')}
+
+    daily = {row.date: row for row in rollups.filter(dimension='all')}
+    series = [
+        {
+            'date': day,
+            'orders': daily[day].orders if day in daily else 0,
+            'units': daily[day].units if day in daily else 0,
+            'revenue': daily[day].revenue if day in daily else Decimal('0'),
+        }
+        for day in (since + timedelta(days=offset) for offset in range(days))
+    ]
+    products = list(rollups.filter(dimension='product').values('key').annotate(**per_key).order_by('-revenue')[:top])
+    categories = list(rollups.filter(dimension='category').values('key').annotate(**per_key).order_by('-revenue'))
+
+    product_names = dict(Product.objects.filter(id__in=[row['key'] for row in products]).values_list('id', 'name'))
+    category_names = dict(Category.objects.filter(id__in=[row['key'] for row in categories]).values_list('id', 'name'))
+    peak = max((day['revenue'] for day in series), default=0) or 1
+    for day in series:
+        day['percent'] = int(day['revenue'] * 100 / peak)
+    return {
+        'since': since,
+        'until': today,
+        'series': series,
+        'totals': {
+            'orders': sum(day['orders'] for day in series),
+            'units': sum(day['units'] for day in series),
+            'revenue': sum((day['revenue'] for day in series), Decimal('0')),
+        },
+        'top_products': summarize(products, product_names),
+        'categories': summarize(categories, category_names),
+    }
@@ -0,0 +1,377 @@
+"""
+Versioned JSON API (``/api/v1/``) for products, categories, the cart and orders.
+
+Serializers are plain functions over querysets limited with ``only()`` to
+the columns they emit. Payloads are compact (no whitespace, short keys,
+stable key order) and gzipped when the client accepts it.
+
+Read endpoints send an ``ETag`` (and ``Last-Modified`` where a single
+``updated_at`` covers the resource) built from the rows' ``updated_at``, and
+answer ``304 Not Modified`` when the client already has the current version.
+The cart and order endpoints use the session login; writes need the usual
+``X-CSRFToken`` header.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_http_methods
+
+from . import images
+from .cart import (
+    InvalidCartOperations, add_item, apply_cart_operations, clean_operations, remove_item, set_item_quantity,
+    store_cart_summary,
+)
+from .forms import CartItemForm, ProductFilterForm
+from .models import Cart, CartItem, Category, Order, Product
+from .pagination import KeysetPaginator
+from .search import search_products
+from .services import OutOfStockError
+
+PAGE_SIZE = 24
+ORDER_PAGE_SIZE = 20
+MAX_BATCH_OPERATIONS = 100
+
+PRODUCT_LIST_FIELDS = [
+    'id', 'name', 'price', 'stock', 'reserved', 'category_id', 'image', 'image_renditions', 'created_at', 'updated_at',
+]
+
+
+def api_response(data, status=200):
+    return JsonResponse(
+        data, status=status, encoder=DjangoJSONEncoder, safe=False,
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False},
+    )
+
+
+def api_error(message, status, **extra):
+    return api_response({'error': message, **extra}, status=status)
+
+
+def out_of_stock_error(exc):
+    return api_error(str(exc), 409, products=[product.id for product in exc.products])
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def conditional_response(request, build, etag, last_modified=None):
+    """
+    Return 304 if the client's validators match, else the JSON from ``build()``.
+
+    ``last_modified`` is a datetime; only pass it when it changes whenever the
+    resource does (a list losing a row can move it backwards).
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = api_response(build())
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    # Clients may keep the response but must revalidate it before reuse
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def api_login_required(view_func):
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return api_error('Authentication required', 401)
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def read_json(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def page_links(page):
+    return {'next': page.next_cursor, 'previous': page.previous_cursor}
+
+
+# Serializers
+
+def serialize_image(product):
+    if not product.image:
+        return None
+    if not images.is_current(product):
+        images.schedule(product)
+        return {'src': product.image.url}
+    renditions = product.image_renditions
+    return {
+        'src': images.rendition_url(product, renditions['widths'][-1], 'jpeg'),
+        'srcset': images.srcset(product, 'jpeg'),
+        'srcset_webp': images.srcset(product, 'webp'),
+        'width': renditions['width'],
+        'height': renditions['height'],
+    }
+
+
+def serialize_product_summary(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'available': product.available,
+        'category': product.category_id,
+        'image': serialize_image(product),
+    }
+
+
+def serialize_product(product):
+    return {
+        **serialize_product_summary(product),
+        'description': product.description,
+        'category': {'id': product.category_id, 'name': product.category.name},
+        'created_at': product.created_at,
+        'updated_at': product.updated_at,
+    }
+
+
+def serialize_cart(cart, cart_items):
+    return {
+        'item_count': cart.item_count if cart else 0,
+        'subtotal': cart.subtotal if cart else '0.00',
+        'items': [
+            {
+                'id': item.id,
+                'product': item.product_id,
+                'name': item.product.name,
+                'price': item.product.price,
+                'quantity': item.quantity,
+                'total': item.product.price * item.quantity,
+            }
+            for item in cart_items
+        ],
+    }
+
+
+def serialize_order_summary(order):
+    return {
+        'id': order.id,
+        'number': order.order_number,
+        'status': order.status,
+        'total': order.total_amount,
+        'created_at': order.created_at,
+        'updated_at': order.updated_at,
+    }
+
+
+def serialize_order(order):
+    return {
+        **serialize_order_summary(order),
+        'shipping': {
+            'address': order.shipping_address,
+            'city': order.shipping_city,
+            'state': order.shipping_state,
+            'zip_code': order.shipping_zip_code,
+            'country': order.shipping_country,
+        },
+        'phone_number': order.phone_number,
+        'items': [
+            {
+                'product': item.product_id,
+                'name': item.product_name,
+                'price': item.price,
+                'quantity': item.quantity,
+            }
+            for item in order.items.all()
+        ],
+    }
+
+
+# Catalog
+
+@gzip_page
+@require_GET
+def category_list(request):
+    categories = list(Category.objects.only('id', 'name', 'description'))
+    data = [{'id': category.id, 'name': category.name, 'description': category.description} for category in categories]
+    # Categories carry no timestamp, so the ETag covers their content
+    return conditional_response(request, lambda: {'results': data}, make_etag(json.dumps(data)))
+
+
+@gzip_page
+@require_GET
+def product_list(request):
+    """Active products, newest first or by relevance when ``q`` is given"""
+    form = ProductFilterForm(request.GET)
+    if not form.is_valid():
+        return api_error('Invalid filters', 400, fields=form.errors)
+    filters = form.cleaned_data
+
+    products = Product.objects.filter(is_active=True).only(*PRODUCT_LIST_FIELDS)
+    if filters['q']:
+        products = search_products(products, filters['q'])
+    if filters['category']:
+        products = products.filter(category_id=filters['category'])
+    if filters['min_price'] is not None:
+        products = products.filter(price__gte=filters['min_price'])
+    if filters['max_price'] is not None:
+        products = products.filter(price__lte=filters['max_price'])
+    if filters['in_stock']:
+        products = products.filter(stock__gt=F('reserved'))
+
+    page = KeysetPaginator(products, PAGE_SIZE, count=False).get_page(request.GET.get('cursor'))
+    etag = make_etag(
+        request.GET.urlencode(), page.has_next(),
+        *(f'{product.id}@{product.updated_at.isoformat()}/{product.available}' for product in page),
+    )
+    return conditional_response(
+        request,
+        lambda: {'results': [serialize_product_summary(product) for product in page], **page_links(page)},
+        etag,
+    )
+
+
+@gzip_page
+@require_GET
+def product_detail(request, product_id):
+    product = (
+        Product.objects.filter(id=product_id, is_active=True)
+        .select_related('category').only(*PRODUCT_LIST_FIELDS, 'description', 'category__name')
+        .first()
+    )
+    if product is None:
+        return api_error('Product not found', 404)
+    # Holds change availability without touching updated_at, so no Last-Modified
+    etag = make_etag(product.id, product.updated_at.isoformat(), product.category.name, product.available)
+    return conditional_response(request, lambda: serialize_product(product), etag)
+
+
+# Cart
+
+def cart_response(request, cart, status=200):
+    cart_items = []
+    if cart is not None:
+        cart_items = cart.items.select_related('product').only(
+            'id', 'cart_id', 'quantity', 'product_id', 'product__name', 'product__price',
+        ).order_by('id')
+    store_cart_summary(request, cart)
+    return api_response(serialize_cart(cart, cart_items), status=status)
+
+
+@gzip_page
+@api_login_required
+@require_GET
+def cart_detail(request):
+    cart = Cart.objects.filter(user=request.user).first()
+    return cart_response(request, cart)
+
+
+@api_login_required
+@require_http_methods(['POST'])
+def cart_items(request):
+    """Add a product to the cart: ``{"product": id, "quantity": n}``"""
+    data = read_json(request)
+    if data is None:
+        return api_error('Expected a JSON object', 400)
+    form = CartItemForm({'quantity': data.get('quantity', 1)})
+    if not form.is_valid():
+        return api_error('Invalid quantity', 400, fields=form.errors)
+    product_id = data.get('product')
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        return api_error('Expected {"product": <product id>}', 400)
+    product = Product.objects.filter(id=product_id, is_active=True).only('id').first()
+    if product is None:
+        return api_error('Product not found', 404)
+    try:
+        cart = add_item(request.user, product, form.cleaned_data['quantity'])
+    except OutOfStockError as exc:
+        return out_of_stock_error(exc)
+    return cart_response(request, cart, status=201)
+
+
+@api_login_required
+@require_http_methods(['PATCH', 'DELETE'])
+def cart_item(request, item_id):
+    """Change a line's quantity (``{"quantity": n}``, 0 removes it) or delete it"""
+    item = CartItem.objects.select_related('cart').filter(id=item_id, cart__user=request.user).first()
+    if item is None:
+        return api_error('Cart item not found', 404)
+    if request.method == 'DELETE':
+        return cart_response(request, remove_item(item))
+
+    data = read_json(request)
+    quantity = data.get('quantity') if data else None
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+        return api_error('Expected {"quantity": <non-negative integer>}', 400)
+    try:
+        cart = set_item_quantity(item, quantity)
+    except OutOfStockError as exc:
+        return out_of_stock_error(exc)
+    return cart_response(request, cart)
+
+
+@api_login_required
+@require_http_methods(['POST'])
+def cart_batch(request):
+    """
+    Apply many cart changes at once and return the new cart::
+
+        {"operations": [{"op": "add", "product": 1, "quantity": 2},
+                        {"op": "set", "product": 2, "quantity": 5},
+                        {"op": "remove", "product": 3}]}
+
+    The whole batch is rejected if any operation is invalid (400) or asks for
+    more than is in stock (409).
+    """
+    data = read_json(request)
+    operations = data.get('operations') if data else None
+    if not isinstance(operations, list) or not operations:
+        return api_error('Expected {"operations": [...]}', 400)
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return api_error(f'At most {MAX_BATCH_OPERATIONS} operations per batch', 400)
+    try:
+        cart, _ = apply_cart_operations(request.user, clean_operations(operations))
+    except InvalidCartOperations as exc:
+        return api_error('Invalid operations', 400, operations=exc.errors)
+    except OutOfStockError as exc:
+        return out_of_stock_error(exc)
+    return cart_response(request, cart)
+
+
+# Orders
+
+@gzip_page
+@api_login_required
+@require_GET
+def order_list(request):
+    orders = Order.objects.filter(user=request.user).only(
+        'id', 'order_number', 'status', 'total_amount', 'created_at', 'updated_at',
+    ).order_by('-created_at')
+    page = KeysetPaginator(orders, ORDER_PAGE_SIZE, count=False).get_page(request.GET.get('cursor'))
+    etag = make_etag(
+        request.GET.urlencode(), page.has_next(),
+        *(f'{order.id}@{order.updated_at.isoformat()}' for order in page),
+    )
+    return conditional_response(
+        request,
+        lambda: {'results': [serialize_order_summary(order) for order in page], **page_links(page)},
+        etag,
+    )
+
+
+@gzip_page
+@api_login_required
+@require_GET
+def order_detail(request, order_id):
+    """An order and its lines; the lines are only fetched when the client's copy is stale"""
+    order = Order.objects.filter(id=order_id, user=request.user).first()
+    if order is None:
+        return api_error('Order not found', 404)
+    etag = make_etag(order.id, order.updated_at.isoformat())
+    return conditional_response(request, lambda: serialize_order(order), etag, order.updated_at)
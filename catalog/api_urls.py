@@ -0,0 +1,22 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+# Mounted under /api/v1/ by the project urls
+urlpatterns = [
+    # Catalog
+    path('categories/', api.category_list, name='category_list'),
+    path('products/', api.product_list, name='product_list'),
+    path('products/<int:product_id>/', api.product_detail, name='product_detail'),
+    
+    # Cart
+    path('cart/', api.cart_detail, name='cart'),
+    path('cart/items/', api.cart_items, name='cart_items'),
+    path('cart/items/<int:item_id>/', api.cart_item, name='cart_item'),
+    path('cart/batch/', api.cart_batch, name='cart_batch'),
+    
+    # Orders
+    path('orders/', api.order_list, name='order_list'),
+    path('orders/<int:order_id>/', api.order_detail, name='order_detail'),
+]
@@ -0,0 +1,113 @@
+"""
+Self-hosted static assets.
+
+The third-party CSS, fonts and JS the storefront uses (Bootstrap and
+Bootstrap Icons) are pinned in VENDOR_ASSETS. ``manage.py build_static``
+downloads them once into ``static/vendor/`` and then runs collectstatic,
+which (with DEBUG off) stores every file under a content-hashed name with
+gzip and brotli copies beside it (catalog.storage). StaticFilesMiddleware
+serves those from the app process with far-future immutable cache headers,
+so a page needs no third-party round trips.
+
+``{% vendor_asset %}`` falls back to the pinned CDN URL for any asset that
+has not been downloaded yet, so a fresh checkout renders as before.
+"""
+import base64
+import hashlib
+import json
+import re
+import urllib.request
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+
+BOOTSTRAP = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist'
+BOOTSTRAP_ICONS = 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font'
+
+# Name -> (pinned CDN URL, path under the static directory)
+VENDOR_ASSETS = {
+    'bootstrap.css': (f'{BOOTSTRAP}/css/bootstrap.min.css', 'vendor/bootstrap/bootstrap.min.css'),
+    'bootstrap.js': (f'{BOOTSTRAP}/js/bootstrap.bundle.min.js', 'vendor/bootstrap/bootstrap.bundle.min.js'),
+    'bootstrap-icons.css': (f'{BOOTSTRAP_ICONS}/bootstrap-icons.css', 'vendor/bootstrap-icons/bootstrap-icons.css'),
+    # Referenced from bootstrap-icons.css as ./fonts/...
+    'bootstrap-icons.woff2': (
+        f'{BOOTSTRAP_ICONS}/fonts/bootstrap-icons.woff2', 'vendor/bootstrap-icons/fonts/bootstrap-icons.woff2',
+    ),
+    'bootstrap-icons.woff': (
+        f'{BOOTSTRAP_ICONS}/fonts/bootstrap-icons.woff', 'vendor/bootstrap-icons/fonts/bootstrap-icons.woff',
+    ),
+}
+
+# sha384 of each download, recorded the first time it is fetched and checked
+# on every later fetch
+LOCK_FILE = 'vendor/vendor.lock.json'
+
+# Source maps are not vendored; the manifest storage would fail on the reference
+_SOURCE_MAP_RE = re.compile(rb'\s*/[*/]# sourceMappingURL=[^\n]*?(?: \*/)?\s*$')
+
+
+class VendorError(Exception):
+    pass
+
+
+def static_dir():
+    return Path(settings.STATICFILES_DIRS[0])
+
+
+def integrity(data):
+    """Subresource-integrity style digest of ``data``"""
+    return 'sha384-' + base64.b64encode(hashlib.sha384(data).digest()).decode()
+
+
+def fetch(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def strip_source_map(data):
+    return _SOURCE_MAP_RE.sub(b'\n', data)
+
+
+def vendor(refresh=False, fetch=fetch, log=None):
+    """
+    Download the VENDOR_ASSETS missing from the static directory (all of them
+    with ``refresh``). Returns the names downloaded; raises VendorError when a
+    download does not match its locked digest.
+    """
+    root = static_dir()
+    lock_path = root / LOCK_FILE
+    lock = json.loads(lock_path.read_text()) if lock_path.exists() else {}
+
+    downloaded = []
+    for name, (url, path) in VENDOR_ASSETS.items():
+        target = root / path
+        if target.exists() and not refresh:
+            continue
+        data = fetch(url)
+        digest = integrity(data)
+        if lock.get(path, digest) != digest:
+            raise VendorError(f'{url} does not match {lock[path]} in {LOCK_FILE}')
+        lock[path] = digest
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(strip_source_map(data) if path.endswith(('.css', '.js')) else data)
+        downloaded.append(name)
+        if log:
+            log(f'{name}: {url} -> {path}')
+
+    if downloaded:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path.write_text(json.dumps(lock, indent=2, sort_keys=True) + '\n')
+    asset_url.cache_clear()
+    return downloaded
+
+
+@lru_cache(maxsize=None)
+def asset_url(name):
+    """URL of a vendored asset: its static URL once downloaded, else the pinned CDN URL"""
+    url, path = VENDOR_ASSETS[name]
+    if finders.find(path) is None:
+        return url
+    return static(path)
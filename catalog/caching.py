@@ -0,0 +1,233 @@
+"""
+Versioned caching for catalog pages and template fragments.
+
+Cached entries are keyed by the current version token of one or more scopes
+(``products``, ``categories``, ``category:<id>``, ``product:<id>``). Product and Category
+signals bump the relevant tokens, which orphans every entry built from the
+old data; nothing has to be deleted explicitly. Tokens are random rather than
+counters so an evicted token can never bring a stale entry back. The
+``cart:<user id>`` scope versions the session copies of a user's cart summary.
+
+Works with any Django cache backend (local memory, file based, Redis).
+Hit and miss counters are kept in the same cache; see ``manage.py cache_stats``.
+"""
+import hashlib
+import re
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .routers import STICKY_COOKIE, primary_reads
+
+KEY_PREFIX = 'catalog'
+STATS_NAMES_KEY = f'{KEY_PREFIX}:stats:names'
+
+CSRF_INPUT_RE = re.compile(r'(<input type="hidden" name="csrfmiddlewaretoken" value=")[^"]*(">)')
+CSRF_PLACEHOLDER = '__CATALOG_CSRF_TOKEN__'
+
+# Fragment name -> scopes it depends on, given the fragment's vary-on values.
+FRAGMENT_SCOPES = {
+    'product_card': lambda *vary_on: ['categories'],
+    'category_grid': lambda: ['categories'],
+    'related_products': lambda product_id, category_id: ['categories', f'category:{category_id}'],
+}
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 600)
+
+
+def _version_key(scope):
+    return f'{KEY_PREFIX}:version:{scope}'
+
+
+def get_versions(scopes):
+    """Return the current version token of each scope, creating missing ones"""
+    cache = get_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, uuid.uuid4().hex, None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """Invalidate everything cached under the given scopes"""
+    get_cache().set_many({_version_key(scope): uuid.uuid4().hex for scope in scopes}, None)
+
+
+def bump_for_products(category_ids):
+    """Invalidate the all-product listings and those of the given categories"""
+    bump('products', *{f'category:{category_id}' for category_id in category_ids})
+
+
+def bump_product_pages(product_ids):
+    """Invalidate only the products' own pages, e.g. when just their stock counts changed"""
+    bump(*{f'product:{product_id}' for product_id in product_ids})
+
+
+def bump_carts(user_ids):
+    """Make sessions holding a copy of these users' cart summaries reload it (catalog.cart)"""
+    bump(*{f'cart:{user_id}' for user_id in user_ids})
+
+
+def _product_category_key(product_id):
+    return f'{KEY_PREFIX}:product-category:{product_id}'
+
+
+def product_category(product_id):
+    """The product's category id, remembered in the cache so cached product pages cost no query"""
+    from .models import Product
+
+    cache = get_cache()
+    key = _product_category_key(product_id)
+    category_id = cache.get(key)
+    if category_id is None:
+        category_id = Product.objects.filter(id=product_id).values_list('category_id', flat=True).first()
+        cache.set(key, category_id, None)
+    return category_id
+
+
+def forget_product_category(product_id):
+    get_cache().delete(_product_category_key(product_id))
+
+
+def make_key(kind, name, vary_on, scopes, versions=None):
+    """``versions`` may pass in get_versions(scopes) when making many keys at once"""
+    raw = ':'.join(str(part) for part in [*vary_on, *(versions or get_versions(scopes))])
+    return f'{KEY_PREFIX}:{kind}:{name}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def record(name, hit, count=1):
+    """Count ``count`` hits or misses for ``name``"""
+    if not count:
+        return
+    cache = get_cache()
+    key = f'{KEY_PREFIX}:stats:{name}:{"hit" if hit else "miss"}'
+    if cache.add(key, count, None):
+        names = cache.get(STATS_NAMES_KEY) or set()
+        if name not in names:
+            cache.set(STATS_NAMES_KEY, names | {name}, None)
+    else:
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.add(key, count, None)
+
+
+def get_stats():
+    """Return ``{name: (hits, misses)}`` for every cache recorded so far"""
+    cache = get_cache()
+    names = sorted(cache.get(STATS_NAMES_KEY) or ())
+    keys = [f'{KEY_PREFIX}:stats:{name}:{kind}' for name in names for kind in ('hit', 'miss')]
+    values = cache.get_many(keys)
+    return {
+        name: (values.get(f'{KEY_PREFIX}:stats:{name}:hit', 0), values.get(f'{KEY_PREFIX}:stats:{name}:miss', 0))
+        for name in names
+    }
+
+
+def reset_stats():
+    cache = get_cache()
+    names = cache.get(STATS_NAMES_KEY) or ()
+    cache.delete_many([f'{KEY_PREFIX}:stats:{name}:{kind}' for name in names for kind in ('hit', 'miss')])
+    cache.delete(STATS_NAMES_KEY)
+
+
+def strip_csrf(content):
+    """Replace per-request CSRF tokens so cached HTML can be shared"""
+    return CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', content)
+
+
+def restore_csrf(content, request, token=None):
+    """Put a CSRF token back; pass ``token`` to reuse one across many fragments of a page"""
+    if CSRF_PLACEHOLDER not in content:
+        return content
+    return content.replace(CSRF_PLACEHOLDER, token or get_token(request))
+
+
+def _cached_page(request, name, scopes, kwargs):
+    """Return ``(key, response)``; the response is None on a miss or when the page can't be cached"""
+    if (
+        request.method != 'GET' or request.user.is_authenticated or len(messages.get_messages(request))
+        # The navbar shows the guest cart's item count
+        or getattr(settings, 'CATALOG_GUEST_CART_COOKIE', 'guest_cart') in request.COOKIES
+        # Just wrote: must see the primary, not a page cached before the write
+        or STICKY_COOKIE in request.COOKIES
+    ):
+        return None, None
+
+    page_scopes = scopes(**kwargs) if callable(scopes) else scopes
+    key = make_key('page', name, [request.get_full_path()], page_scopes)
+    cached = get_cache().get(key)
+    if cached is None:
+        record(f'page:{name}', False)
+        return key, None
+
+    record(f'page:{name}', True)
+    content, content_type = cached
+    response = HttpResponse(restore_csrf(content, request), content_type=content_type)
+    response['X-Catalog-Cache'] = 'hit'
+    return key, response
+
+
+def _store_page(key, response, timeout):
+    if response.status_code == 200 and not response.streaming:
+        content = strip_csrf(response.content.decode(response.charset))
+        get_cache().set(key, (content, response['Content-Type']), timeout or get_timeout())
+        response['X-Catalog-Cache'] = 'miss'
+    return response
+
+
+def cache_anonymous_page(scopes, timeout=None):
+    """
+    Cache a view's HTML for anonymous GET requests.
+
+    ``scopes`` is a list of scope names, or a callable taking the view's
+    keyword arguments and returning one. Requests from logged-in users,
+    with pending flash messages, a guest cart or a recent write (see
+    catalog.routers) always render normally. Pages about to be cached are
+    rendered from the primary database, never a lagging read replica.
+    Works on sync and async views; for async views the session and cache
+    are read off the event loop.
+    """
+    def decorator(view_func):
+        name = view_func.__name__
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                key, response = await sync_to_async(_cached_page)(request, name, scopes, kwargs)
+                if response is not None:
+                    return response
+                if key is None:
+                    return await view_func(request, *args, **kwargs)
+                with primary_reads():
+                    response = await view_func(request, *args, **kwargs)
+                return await sync_to_async(_store_page)(key, response, timeout)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            key, response = _cached_page(request, name, scopes, kwargs)
+            if response is not None:
+                return response
+            if key is None:
+                return view_func(request, *args, **kwargs)
+            with primary_reads():
+                response = view_func(request, *args, **kwargs)
+            return _store_page(key, response, timeout)
+        return wrapper
+    return decorator
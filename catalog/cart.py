@@ -0,0 +1,331 @@
+"""
+Cart mutations and the per-session cart summary shown in the navbar.
+
+The summary is copied into the session whenever a view changes the cart, so
+rendering the badge never has to touch the cart tables. The copy records the
+version of the user's ``cart:<user id>`` cache scope (catalog.caching), which
+Cart.update_totals() and the Cart signals bump, so a change made on another
+device or in the admin is picked up on the next page. Every change also
+updates the cart's stock holds (catalog.reservations) and raises
+OutOfStockError, changing nothing, when the units cannot be held.
+
+Anonymous visitors get a GuestCart kept in a signed cookie instead, so
+browsing and filling a cart without an account never writes to the
+database; it is merged into the user's cart when they log in.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .caching import get_versions
+from .models import Cart, CartItem, Product
+from .reservations import hold
+from .services import OutOfStockError
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+
+CART_SUMMARY_SESSION_KEY = 'cart_summary'
+CART_VERSION_SESSION_KEY = 'cart_summary_version'
+
+
+def cart_version(user):
+    return get_versions([f'cart:{user.pk}'])[0]
+
+
+def store_cart_summary(request, cart, version=None):
+    """Save the cart's item count and subtotal in the session"""
+    summary = None
+    if cart is not None:
+        summary = {
+            'item_count': cart.item_count,
+            'subtotal': str(cart.subtotal),
+        }
+    version = version or cart_version(request.user)
+    # Only touch the session when something changed, so read-only views
+    # don't pay for a session write
+    if request.session.get(CART_SUMMARY_SESSION_KEY, ()) != summary:
+        request.session[CART_SUMMARY_SESSION_KEY] = summary
+    if request.session.get(CART_VERSION_SESSION_KEY) != version:
+        request.session[CART_VERSION_SESSION_KEY] = version
+
+
+def get_cart_summary(request):
+    """
+    Return the session's cart summary, or None when the user has no cart.
+
+    The stored totals are read from the Cart row on the first call in a
+    session and whenever the cart has changed since; other calls cost one
+    cache lookup.
+    """
+    if not request.user.is_authenticated:
+        guest_cart = GuestCart.from_request(request)
+        return {'item_count': guest_cart.item_count, 'subtotal': None} if guest_cart.lines else None
+    version = cart_version(request.user)
+    if CART_SUMMARY_SESSION_KEY not in request.session or request.session.get(CART_VERSION_SESSION_KEY) != version:
+        cart = Cart.objects.filter(user=request.user).only('item_count', 'subtotal').first()
+        store_cart_summary(request, cart, version)
+    return request.session[CART_SUMMARY_SESSION_KEY]
+
+
+def add_item(user, product, quantity):
+    """Add ``quantity`` of ``product`` to the user's cart, creating the cart if needed"""
+    with transaction.atomic():
+        cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+        cart_item, created = CartItem.objects.get_or_create(
+            cart=cart,
+            product=product,
+            defaults={'quantity': quantity},
+        )
+        if not created:
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + quantity)
+            quantity += cart_item.quantity
+        hold(cart, {product.pk: quantity})
+        cart.update_totals()
+    return cart
+
+
+def set_item_quantity(cart_item, quantity):
+    """Change a cart line's quantity; zero or less removes the line"""
+    with transaction.atomic():
+        if quantity > 0:
+            cart_item.quantity = quantity
+            cart_item.save(update_fields=['quantity'])
+        else:
+            cart_item.delete()
+        hold(cart_item.cart, {cart_item.product_id: max(quantity, 0)})
+        cart_item.cart.update_totals()
+    return cart_item.cart
+
+
+def remove_item(cart_item):
+    with transaction.atomic():
+        cart_item.delete()
+        hold(cart_item.cart, {cart_item.product_id: 0})
+        cart_item.cart.update_totals()
+    return cart_item.cart
+
+
+class InvalidCartOperations(Exception):
+    """Raised with a list of ``{'index': i, 'error': message}`` for rejected operations"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} invalid cart operation(s)')
+
+
+def clean_operations(operations):
+    """Validate ``[{'op', 'product', 'quantity'}]`` dicts and return ``(op, product_id, quantity)`` tuples"""
+    cleaned, errors = [], []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            errors.append({'index': index, 'error': 'Expected an object'})
+            continue
+        op = operation.get('op')
+        product_id = operation.get('product')
+        quantity = operation.get('quantity', 1 if op == 'add' else 0)
+        if op not in CART_OPERATIONS:
+            errors.append({'index': index, 'error': f'op must be one of {", ".join(CART_OPERATIONS)}'})
+        elif not isinstance(product_id, int) or isinstance(product_id, bool):
+            errors.append({'index': index, 'error': 'product must be a product id'})
+        elif not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < (1 if op == 'add' else 0):
+            errors.append({
+                'index': index,
+                'error': 'quantity must be a positive integer' if op == 'add' else 'quantity must be a non-negative integer',
+            })
+        else:
+            cleaned.append((op, product_id, quantity))
+    if errors:
+        raise InvalidCartOperations(errors)
+    return cleaned
+
+
+def apply_cart_operations(user, operations, skip_unavailable=False):
+    """
+    Apply many add/set/remove operations to the user's cart in one transaction.
+
+    ``operations`` are ``(op, product_id, quantity)`` tuples applied in order:
+    ``add`` increases a line, ``set`` replaces its quantity (0 removes it) and
+    ``remove`` deletes it. The final quantities are worked out in memory and
+    written with one upsert on the (cart, product) unique constraint and one
+    DELETE, so the query count does not grow with the number of operations.
+
+    Operations on missing or inactive products raise InvalidCartOperations,
+    or are dropped when ``skip_unavailable`` is true. Returns
+    ``(cart, skipped product ids)``.
+    """
+    with transaction.atomic():
+        # Locking the cart row serializes concurrent batches on the same cart
+        cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+
+        product_ids = {product_id for op, product_id, quantity in operations}
+        available = set(
+            Product.objects.filter(id__in=product_ids, is_active=True).values_list('id', flat=True)
+        )
+        unavailable = set()
+        for index, (op, product_id, quantity) in enumerate(operations):
+            if op != 'remove' and product_id not in available:
+                unavailable.add(product_id)
+        if unavailable and not skip_unavailable:
+            raise InvalidCartOperations([
+                {'index': index, 'error': 'Product not found'}
+                for index, (op, product_id, quantity) in enumerate(operations)
+                if product_id in unavailable and op != 'remove'
+            ])
+
+        existing = {
+            item.product_id: item
+            for item in CartItem.objects.filter(cart=cart, product_id__in=product_ids).only('id', 'product_id', 'quantity')
+        }
+        quantities = {product_id: item.quantity for product_id, item in existing.items()}
+        for op, product_id, quantity in operations:
+            if product_id in unavailable:
+                continue
+            if op == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            elif op == 'set':
+                quantities[product_id] = quantity
+            else:
+                quantities[product_id] = 0
+
+        upserts = [
+            CartItem(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+            if quantity > 0 and (product_id not in existing or existing[product_id].quantity != quantity)
+        ]
+        removed = [
+            existing[product_id].pk
+            for product_id, quantity in quantities.items()
+            if quantity == 0 and product_id in existing
+        ]
+        if upserts:
+            CartItem.objects.bulk_create(
+                upserts, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+            )
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        hold(cart, {
+            product_id: quantity for product_id, quantity in quantities.items()
+            if product_id in existing or quantity > 0
+        })
+        cart.update_totals()
+    return cart, sorted(unavailable)
+
+
+GUEST_CART_SALT = 'catalog.cart.guest'
+MAX_GUEST_CART_LINES = 50
+
+
+def guest_cart_cookie():
+    return getattr(settings, 'CATALOG_GUEST_CART_COOKIE', 'guest_cart')
+
+
+class GuestCart:
+    """
+    An anonymous visitor's cart, stored as ``{product_id: quantity}`` in a
+    signed cookie (``12:2,40:1``), so it costs no session or cart rows.
+
+    Units are not held for guests; quantities are checked against the
+    available stock when they change and again at checkout. The lines of
+    ``items()`` are unsaved CartItems whose ``id`` is the product id, which is
+    what the cart views take as the item id for anonymous visitors.
+    """
+
+    def __init__(self, lines=None):
+        self.lines = dict(lines or {})
+        self.changed = False
+        self.subtotal = Decimal('0.00')
+
+    @classmethod
+    def from_request(cls, request):
+        if not hasattr(request, '_guest_cart'):
+            value = request.get_signed_cookie(guest_cart_cookie(), default='', salt=GUEST_CART_SALT)
+            request._guest_cart = cls(cls.decode(value))
+        return request._guest_cart
+
+    @staticmethod
+    def decode(value):
+        lines = {}
+        for line in value.split(','):
+            product_id, _, quantity = line.partition(':')
+            if product_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+                lines[int(product_id)] = int(quantity)
+        return lines
+
+    def encode(self):
+        return ','.join(f'{product_id}:{quantity}' for product_id, quantity in self.lines.items())
+
+    @property
+    def item_count(self):
+        return sum(self.lines.values())
+
+    @property
+    def total_price(self):
+        return self.subtotal
+
+    def set(self, product, quantity):
+        """Set ``product``'s quantity (0 removes it); raises OutOfStockError past what is available"""
+        if quantity > 0:
+            if quantity > product.available or (
+                product.id not in self.lines and len(self.lines) >= MAX_GUEST_CART_LINES
+            ):
+                raise OutOfStockError([product])
+            self.lines[product.id] = quantity
+        else:
+            self.lines.pop(product.id, None)
+        self.changed = True
+
+    def add(self, product, quantity):
+        self.set(product, self.lines.get(product.id, 0) + quantity)
+
+    def items(self):
+        """Return the lines with their products, dropping products that are gone"""
+        products = Product.objects.filter(id__in=self.lines, is_active=True).select_related('category')
+        items = [CartItem(id=product.id, product=product, quantity=self.lines[product.id]) for product in products]
+        self.subtotal = sum((item.total_price for item in items), Decimal('0.00'))
+        return items
+
+    def save(self, response):
+        """Write the cookie to ``response`` if the cart changed"""
+        if not self.changed:
+            return
+        if self.lines:
+            response.set_signed_cookie(
+                guest_cart_cookie(), self.encode(), salt=GUEST_CART_SALT,
+                max_age=settings.SESSION_COOKIE_AGE, secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(guest_cart_cookie(), samesite='Lax')
+
+
+def merge_guest_cart(request, response):
+    """
+    Move the visitor's GuestCart into the logged-in user's cart with one
+    bulk upsert and clear the cookie. Returns the product ids left out
+    because they are gone or no longer in stock.
+    """
+    guest_cart = GuestCart.from_request(request)
+    if not guest_cart.lines:
+        return []
+    operations = [('add', product_id, quantity) for product_id, quantity in guest_cart.lines.items()]
+    short = set()
+    # Each retry drops at least one line, so this ends with at worst an empty merge
+    while True:
+        try:
+            cart, skipped = apply_cart_operations(
+                request.user, [operation for operation in operations if operation[1] not in short],
+                skip_unavailable=True,
+            )
+            break
+        except OutOfStockError as exc:
+            newly_short = {product.id for product in exc.products} - short
+            # Stock moved under us without naming a product: leave out the whole guest cart
+            short |= newly_short or set(guest_cart.lines)
+    skipped = sorted({*skipped, *short})
+    store_cart_summary(request, cart)
+    guest_cart.lines = {}
+    guest_cart.changed = True
+    guest_cart.save(response)
+    return skipped
@@ -0,0 +1,51 @@
+"""
+Run independent ORM work concurrently from async views.
+
+Django's async ORM sends every query of a request through one thread, so
+awaiting two querysets with asyncio.gather still runs them back to back.
+``run_concurrently`` instead gives each function its own worker thread and
+database connection. Connections are opened and closed like request
+connections, honouring CONN_MAX_AGE.
+
+Inside a transaction (tests, ATOMIC_REQUESTS) other connections cannot see
+its uncommitted rows, so the functions run one after another on the
+request's own connection instead.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+
+def _in_transaction():
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def _on_own_connection(func):
+    def run():
+        close_old_connections()
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return run
+
+
+async def run_concurrently(*funcs):
+    """
+    Call each blocking function and return their results in order.
+
+    Functions must not depend on each other and should fully evaluate any
+    queryset they build (return lists, not lazy querysets).
+    """
+    concurrent = (
+        len(funcs) > 1
+        and getattr(settings, 'CATALOG_CONCURRENT_QUERIES', True)
+        and not await sync_to_async(_in_transaction)()
+    )
+    if not concurrent:
+        return await sync_to_async(lambda: [func() for func in funcs])()
+    return await asyncio.gather(
+        *(sync_to_async(_on_own_connection(func), thread_sensitive=False)() for func in funcs)
+    )
@@ -0,0 +1,240 @@
+"""
+Synthetic catalog generator used by ``populate_data --scale``.
+
+Rows are written with bulk_create in fixed-size batches and generated lazily,
+so memory use stays flat however many products are requested. Only a compact
+array of product ids and prices is kept to build carts and orders.
+"""
+import random
+import secrets
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import analytics
+from .models import Cart, CartItem, Category, Order, OrderItem, Product
+from .orders import build_summary
+from .search import get_search_backend
+
+CATEGORY_NAMES = [
+    'Electronics', 'Clothing', 'Books', 'Home & Garden', 'Sports', 'Toys', 'Beauty',
+    'Grocery', 'Automotive', 'Office', 'Music', 'Movies', 'Health', 'Pet Supplies',
+    'Jewelry', 'Shoes', 'Tools', 'Baby', 'Outdoors', 'Garden',
+]
+ADJECTIVES = [
+    'Classic', 'Premium', 'Compact', 'Wireless', 'Organic', 'Smart', 'Vintage', 'Portable',
+    'Deluxe', 'Eco', 'Ultra', 'Essential', 'Pro', 'Handmade', 'Rugged', 'Lightweight',
+]
+NOUNS = [
+    'Headphones', 'Jacket', 'Novel', 'Lamp', 'Backpack', 'Blender', 'Sneakers', 'Watch',
+    'Notebook', 'Speaker', 'Mug', 'Chair', 'Camera', 'Bottle', 'Tent', 'Keyboard',
+]
+CITIES = [
+    ('Springfield', 'IL'), ('Portland', 'OR'), ('Austin', 'TX'), ('Denver', 'CO'),
+    ('Madison', 'WI'), ('Raleigh', 'NC'), ('Boise', 'ID'), ('Tampa', 'FL'),
+]
+STATUS_WEIGHTS = [('delivered', 60), ('shipped', 15), ('processing', 10), ('pending', 10), ('cancelled', 5)]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the created_at/updated_at values we generate"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class SyntheticDataGenerator:
+    """
+    Generate ``products`` products plus users, carts and orders.
+
+    Category sizes and product popularity follow a long-tailed distribution,
+    prices are log-normal and order timestamps are spread over ``days``.
+    """
+
+    def __init__(self, products, users, orders, carts, batch_size=5000, days=365, seed=None, log=None):
+        self.products = products
+        self.users = users
+        self.orders = orders
+        self.carts = carts
+        self.batch_size = batch_size
+        self.days = days
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+        self.run_tag = secrets.token_hex(2).upper()
+        self.product_ids = array('q')
+        self.product_prices = array('q')  # cents
+        self.user_ids = array('q')
+
+    def run(self):
+        categories = self.create_categories()
+        self.create_products(categories)
+        self.create_users()
+        self.create_carts()
+        self.create_orders()
+        self.rebuild_sales_rollups()
+        self.log('Rebuilding search index...')
+        get_search_backend().rebuild()
+
+    def rebuild_sales_rollups(self):
+        """bulk_create queues no sync_order jobs, so recompute the days the orders were spread over"""
+        if not self.orders:
+            return
+        first = timezone.localdate(self.now - timedelta(days=self.days))
+        for chunk_first, chunk_last, rows in analytics.rebuild(first, timezone.localdate(self.now)):
+            self.log(f'Sales rollups: {chunk_first} to {chunk_last}, {rows} rows')
+
+    def popular_index(self, size):
+        """Pick an index in range(size), skewed towards the front (popular items)"""
+        return min(int(size * self.random.random() ** 3), size - 1)
+
+    def timestamp(self):
+        return self.now - timedelta(seconds=self.random.randint(0, self.days * 86400))
+
+    def create_categories(self):
+        categories = []
+        for name in CATEGORY_NAMES:
+            category, created = Category.objects.get_or_create(
+                name=name, defaults={'description': f'Browse our {name.lower()} range'}
+            )
+            categories.append(category)
+        return categories
+
+    def product_name(self, n):
+        return f'{ADJECTIVES[n % len(ADJECTIVES)]} {NOUNS[(n // len(ADJECTIVES)) % len(NOUNS)]} {n}'
+
+    def generate_products(self, categories):
+        weights = [1 / (rank + 1) for rank in range(len(categories))]
+        for n in range(self.products):
+            category = self.random.choices(categories, weights)[0]
+            price = Decimal(min(round(self.random.lognormvariate(3.4, 0.9), 2), 99999)).quantize(Decimal('0.01'))
+            created = self.timestamp()
+            yield Product(
+                name=self.product_name(n),
+                category=category,
+                price=price,
+                description=(
+                    f'{self.product_name(n)} from our {category.name.lower()} collection. '
+                    f'{self.random.choice(ADJECTIVES)} build, {self.random.choice(ADJECTIVES).lower()} finish.'
+                ),
+                stock=self.random.choice([0, 5, 20, 50, 100, 250, 1000]),
+                is_active=self.random.random() > 0.03,
+                created_at=created,
+                updated_at=created,
+            )
+
+    def create_products(self, categories):
+        created = 0
+        with explicit_timestamps(Product):
+            for batch in batched(self.generate_products(categories), self.batch_size):
+                for product in Product.objects.bulk_create(batch):
+                    self.product_ids.append(product.pk)
+                    self.product_prices.append(int(product.price * 100))
+                created += len(batch)
+                self.log(f'Products: {created}/{self.products}')
+
+    def generate_users(self):
+        password = make_password('password123')
+        for n in range(self.users):
+            yield User(
+                username=f'user_{self.run_tag}_{n}',
+                email=f'user_{self.run_tag}_{n}@example.com',
+                password=password,
+            )
+
+    def create_users(self):
+        created = 0
+        for batch in batched(self.generate_users(), self.batch_size):
+            self.user_ids.extend(user.pk for user in User.objects.bulk_create(batch))
+            created += len(batch)
+            self.log(f'Users: {created}/{self.users}')
+
+    def pick_products(self, count):
+        indexes = {self.popular_index(len(self.product_ids)) for _ in range(count)}
+        return [(self.product_ids[i], self.product_prices[i], i) for i in indexes]
+
+    def create_carts(self):
+        owners = self.random.sample(range(len(self.user_ids)), min(self.carts, len(self.user_ids)))
+        for batch in batched(owners, self.batch_size):
+            carts = Cart.objects.bulk_create(Cart(user_id=self.user_ids[i]) for i in batch)
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, product_id=product_id, quantity=self.random.randint(1, 3))
+                for cart in carts
+                for product_id, price, index in self.pick_products(self.random.randint(1, 6))
+            )
+            Cart.objects.filter(id__in=[cart.pk for cart in carts]).update_totals()
+        self.log(f'Carts: {len(owners)}')
+
+    def generate_orders(self):
+        statuses, weights = zip(*STATUS_WEIGHTS)
+        for n in range(self.orders):
+            lines = [
+                (product_id, price, index, self.random.randint(1, 3))
+                for product_id, price, index in self.pick_products(max(1, int(self.random.expovariate(0.4))))
+            ]
+            city, state = self.random.choice(CITIES)
+            created = self.timestamp()
+            order = Order(
+                user_id=self.user_ids[self.popular_index(len(self.user_ids))],
+                order_number=f'S{self.run_tag}{n:011d}',
+                status=self.random.choices(statuses, weights)[0],
+                total_amount=Decimal(sum(price * quantity for _, price, _, quantity in lines)) / 100,
+                # Generated products have no images, so a bare instance is enough for the preview
+                items_summary=build_summary([
+                    (Product(pk=product_id), self.product_name(index), quantity)
+                    for product_id, price, index, quantity in lines
+                ]),
+                shipping_address=f'{self.random.randint(1, 9999)} Main St',
+                shipping_city=city,
+                shipping_state=state,
+                shipping_zip_code=f'{self.random.randint(10000, 99999)}',
+                shipping_country='US',
+                phone_number=f'555-{self.random.randint(1000, 9999)}',
+                created_at=created,
+                updated_at=created,
+            )
+            yield order, lines
+
+    def create_orders(self):
+        created = 0
+        with explicit_timestamps(Order):
+            for batch in batched(self.generate_orders(), self.batch_size):
+                orders = Order.objects.bulk_create(order for order, lines in batch)
+                OrderItem.objects.bulk_create(
+                    (
+                        OrderItem(
+                            order=order,
+                            product_id=product_id,
+                            product_name=self.product_name(index),
+                            price=Decimal(price) / 100,
+                            quantity=quantity,
+                        )
+                        for order, (_, lines) in zip(orders, batch)
+                        for product_id, price, index, quantity in lines
+                    ),
+                    batch_size=self.batch_size,
+                )
+                created += len(batch)
+                self.log(f'Orders: {created}/{self.orders}')
@@ -0,0 +1,123 @@
+"""
+Faceted navigation counts for the product listing.
+
+All facets come from one grouped query over the search results: rows are
+grouped by (category, price bucket, in stock) and rolled up in Python, so
+adding facets does not add queries. Results are cached under the catalog
+``products``/``categories`` versions and refreshed whenever a product or
+category changes.
+
+Category counts ignore the selected category (so other categories stay
+selectable); price and stock counts respect it.
+"""
+from decimal import Decimal
+
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, IntegerField, Q, Value, When
+
+from .caching import get_cache, get_timeout, make_key
+
+# Lower bounds of the price histogram buckets; the last bucket is open-ended.
+# A bucket holds prices from its bound up to, not including, the next one.
+PRICE_BUCKETS = [Decimal(bound) for bound in (0, 25, 50, 100, 250, 500, 1000)]
+
+# Smallest price step (Product.price has two decimal places)
+CENT = Decimal('0.01')
+
+
+class PriceBucket:
+    def __init__(self, min_price, max_price, count=0):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.count = count
+
+    @property
+    def max_filter_price(self):
+        """Inclusive ``max_price`` for the bucket's link, matching its exclusive upper bound"""
+        if self.max_price is None:
+            return None
+        return self.max_price - CENT
+
+    @property
+    def label(self):
+        if self.max_price is None:
+            return f'${self.min_price}+'
+        return f'${self.min_price} - ${self.max_filter_price}'
+
+
+class CategoryFacet:
+    def __init__(self, id, name, count):
+        self.id = id
+        self.name = name
+        self.count = count
+
+
+class Facets:
+    def __init__(self, price_buckets):
+        self.categories = []
+        self.price_buckets = price_buckets
+        self.in_stock = 0
+        self.total = 0
+
+
+def price_bucket_expression():
+    whens = [
+        When(price__lt=upper, then=Value(index))
+        for index, upper in enumerate(PRICE_BUCKETS[1:])
+    ]
+    return Case(*whens, default=Value(len(PRICE_BUCKETS) - 1), output_field=IntegerField())
+
+
+def facet_rows(queryset):
+    """Return ``(category_id, bucket, in_stock, count)`` rows for ``queryset`` in one query"""
+    return list(
+        queryset.order_by()
+        .values_list(
+            'category_id',
+            price_bucket_expression(),
+            ExpressionWrapper(Q(stock__gt=F('reserved')), output_field=BooleanField()),
+        )
+        .annotate(count=Count('id'))
+    )
+
+
+def compute_facets(queryset, categories, category_id=None, in_stock_only=False):
+    """
+    Build facet counts for ``queryset``.
+
+    ``queryset`` must already carry the search and price filters but not the
+    category or in-stock filters, which are applied here from the grouped
+    rows. ``categories`` is the list of Category objects to report on.
+    """
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    key = make_key('facets', 'products', [queryset.db, sql, params], ['products', 'categories'])
+    cache = get_cache()
+    rows = cache.get(key)
+    if rows is None:
+        rows = facet_rows(queryset)
+        cache.set(key, rows, get_timeout())
+
+    category_counts = {}
+    buckets = [
+        PriceBucket(lower, PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None)
+        for index, lower in enumerate(PRICE_BUCKETS)
+    ]
+    facets = Facets(price_buckets=buckets)
+
+    for row_category, bucket, available, count in rows:
+        if in_stock_only and not available:
+            continue
+        category_counts[row_category] = category_counts.get(row_category, 0) + count
+        if category_id is not None and row_category != category_id:
+            continue
+        buckets[bucket].count += count
+        facets.total += count
+
+    for row_category, bucket, available, count in rows:
+        if available and (category_id is None or row_category == category_id):
+            facets.in_stock += count
+
+    facets.categories = [
+        CategoryFacet(category.id, category.name, category_counts.get(category.id, 0))
+        for category in categories
+    ]
+    return facets
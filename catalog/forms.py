@@ -51,12 +51,18 @@ class ProductSearchForm(forms.Form):
         decimal_places=2,
         widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Max Price'})
     )
+    in_stock = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, categories=None, **kwargs):
         super().__init__(*args, **kwargs)
-        # Get unique categories for the dropdown
-        from .models import Category
-        categories = Category.objects.all()
+        # Get unique categories for the dropdown; callers that already
+        # loaded them can pass them in to save a query
+        if categories is None:
+            from .models import Category
+            categories = Category.objects.all()
         choices = [('', 'All Categories')] + [(cat.name, cat.name) for cat in categories]
         self.fields['category'].widget.choices = choices
 
@@ -71,5 +77,36 @@ class ContactForm(forms.Form):
     name = forms.CharField(max_length=100, widget=forms.TextInput(attrs={'class': 'form-control'}))
     email = forms.EmailField(widget=forms.EmailInput(attrs={'class': 'form-control'}))
     subject = forms.CharField(max_length=200, widget=forms.TextInput(attrs={'class': 'form-control'}))
-    message = forms.CharField(widget=forms.Textarea(attrs={'rows': 5, 'class': 'form-control'})) 
-    
\ No newline at end of file
+    message = forms.CharField(widget=forms.Textarea(attrs={'rows': 5, 'class': 'form-control'}))
+
+class ProductFilterForm(forms.Form):
+    """Query parameters accepted by the product list API"""
+    q = forms.CharField(max_length=100, required=False)
+    category = forms.IntegerField(min_value=1, required=False)
+    min_price = forms.DecimalField(min_value=0, decimal_places=2, required=False)
+    max_price = forms.DecimalField(min_value=0, decimal_places=2, required=False)
+    in_stock = forms.BooleanField(required=False)
+
+class ProductImportForm(forms.Form):
+    """One row of a product import (catalog.transfer); rows with an id update that product"""
+    BOOLEANS = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False}
+    
+    id = forms.IntegerField(min_value=1, required=False)
+    name = forms.CharField(max_length=200)
+    category = forms.CharField(max_length=100)
+    price = forms.DecimalField(min_value=0, max_digits=10, decimal_places=2)
+    description = forms.CharField(strip=False)
+    stock = forms.IntegerField(min_value=0, required=False)
+    is_active = forms.CharField(required=False)
+    
+    def clean_stock(self):
+        stock = self.cleaned_data['stock']
+        return 0 if stock is None else stock
+    
+    def clean_is_active(self):
+        value = self.cleaned_data['is_active'].strip().lower()
+        if not value:
+            return True
+        if value not in self.BOOLEANS:
+            raise forms.ValidationError('Enter true or false.')
+        return self.BOOLEANS[value]
@@ -0,0 +1,186 @@
+"""
+Resized renditions of product images.
+
+Every uploaded ``Product.image`` is turned into WebP and JPEG copies at a few
+fixed widths. Rendition filenames embed a hash of the source bytes and the
+rendition settings, so they never change content and can be served with
+far-future cache headers. What has been generated is recorded on
+``Product.image_renditions``; until then templates fall back to the original.
+
+Renditions are built off the request thread by a small thread pool, queued
+when a product is saved with a new image and, lazily, the first time a
+template asks for a product whose renditions are missing.
+``manage.py build_renditions`` backfills existing images.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('catalog.images')
+
+WIDTHS = (160, 320, 640, 960)
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+# Bump when WIDTHS or FORMATS change so new renditions get new names
+RENDITION_VERSION = 1
+
+SIZES = {
+    'card': '(min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw',
+    'detail': '(min-width: 992px) 50vw, 100vw',
+    'thumb': '80px',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_failed = set()
+_pending_lock = threading.Lock()
+
+
+def rendition_name(digest, width, fmt):
+    return f'renditions/{digest[:2]}/{digest}-{width}w.{fmt}'
+
+
+def source_digest(data):
+    """Hash of the source bytes and the rendition settings"""
+    hasher = hashlib.sha256(data)
+    hasher.update(f'v{RENDITION_VERSION}:{WIDTHS}:{sorted(FORMATS)}'.encode())
+    return hasher.hexdigest()[:20]
+
+
+def render(image, width, fmt):
+    """Return ``image`` scaled down to ``width`` and encoded as ``fmt``"""
+    options = dict(FORMATS[fmt])
+    copy = image.copy()
+    copy.thumbnail((width, width * 4), Image.LANCZOS)
+    if fmt == 'jpeg' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    elif copy.mode not in ('RGB', 'RGBA'):
+        copy = copy.convert('RGBA' if 'A' in copy.getbands() else 'RGB')
+    buffer = BytesIO()
+    copy.save(buffer, **options)
+    return buffer.getvalue()
+
+
+def build_renditions(product, storage=None):
+    """
+    Write every rendition of ``product.image`` and return the metadata to
+    store on ``Product.image_renditions``. Existing files are reused.
+    """
+    storage = storage or default_storage
+    with product.image.open('rb') as source:
+        data = source.read()
+    digest = source_digest(data)
+
+    with Image.open(BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    # Never upscale: keep the widths below the original plus the original width
+    widths = [width for width in WIDTHS if width < image.width] or [image.width]
+    if image.width < WIDTHS[-1] and image.width not in widths:
+        widths.append(image.width)
+
+    for width in widths:
+        for fmt in FORMATS:
+            name = rendition_name(digest, width, fmt)
+            if not storage.exists(name):
+                saved = storage.save(name, ContentFile(render(image, width, fmt)))
+                if saved != name:
+                    # Another worker wrote the same content first; drop our copy
+                    storage.delete(saved)
+
+    return {
+        'source': product.image.name,
+        'hash': digest,
+        'widths': widths,
+        'width': image.width,
+        'height': image.height,
+    }
+
+
+def is_current(product):
+    renditions = product.image_renditions or {}
+    return bool(product.image) and renditions.get('source') == product.image.name
+
+
+def process_product(product_id):
+    """Build renditions for one product and record them, without sending signals"""
+    from .caching import bump_for_products
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None or not product.image or is_current(product):
+        return False
+    renditions = build_renditions(product)
+    # Only record the result if the image was not replaced in the meantime.
+    # updated_at moves so cached product cards pick up the new markup.
+    updated = Product.objects.filter(pk=product.pk, image=product.image.name).update(
+        image_renditions=renditions, updated_at=timezone.now(),
+    )
+    if updated:
+        bump_for_products([product.category_id])
+    return bool(updated)
+
+
+def _run(product_id, source):
+    close_old_connections()
+    try:
+        process_product(product_id)
+    except Exception:
+        # Remember the failure so every page view does not retry a broken image
+        logger.exception('Building renditions for product %s failed', product_id)
+        with _pending_lock:
+            _failed.add((product_id, source))
+    finally:
+        with _pending_lock:
+            _pending.discard(product_id)
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'CATALOG_IMAGE_WORKERS', 2),
+                    thread_name_prefix='catalog-images',
+                )
+    return _executor
+
+
+def schedule(product):
+    """
+    Queue renditions for a product unless they are already queued or
+    previously failed for the same image. Runs inline when
+    CATALOG_IMAGE_WORKERS is 0.
+    """
+    if not getattr(settings, 'CATALOG_IMAGE_WORKERS', 2):
+        process_product(product.pk)
+        return
+    with _pending_lock:
+        if product.pk in _pending or (product.pk, product.image.name) in _failed:
+            return
+        _pending.add(product.pk)
+    get_executor().submit(_run, product.pk, product.image.name)
+
+
+def rendition_url(product, width, fmt):
+    return default_storage.url(rendition_name(product.image_renditions['hash'], width, fmt))
+
+
+def srcset(product, fmt):
+    return ', '.join(
+        f'{rendition_url(product, width, fmt)} {width}w' for width in product.image_renditions['widths']
+    )
@@ -0,0 +1,144 @@
+"""
+A small database-backed job queue for work that should not hold up a request.
+
+Tasks are plain functions registered with ``@task``. ``enqueue()`` inserts a
+Job row in the caller's transaction, so the job of an order that rolled back
+never runs, and ``manage.py run_jobs`` claims due jobs (``SELECT ... FOR
+UPDATE SKIP LOCKED`` where the database supports it) and runs them on a
+thread or process pool. A failing job is retried with exponential backoff
+until it has used ``max_attempts``; jobs left running by a crashed worker are
+requeued when their lease runs out.
+
+Payloads are JSON keyword arguments, so pass ids rather than objects. With
+``CATALOG_JOBS_EAGER`` jobs run in-process right after the enqueuing
+transaction commits, which needs no worker at all.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+BACKOFF_BASE = 10
+BACKOFF_MAX = 60 * 60
+
+
+def task(func=None, *, name=None, max_attempts=5):
+    """Register ``func`` as a task; ``@task`` or ``@task(max_attempts=3)``"""
+    def register(func):
+        func.task_name = name or f'{func.__module__}.{func.__name__}'
+        func.max_attempts = max_attempts
+        TASKS[func.task_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(func, delay=0, **payload):
+    """Queue ``func(**payload)`` to run after ``delay`` seconds; returns the Job"""
+    job = Job.objects.create(
+        task=func.task_name, payload=payload, max_attempts=func.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+    if getattr(settings, 'CATALOG_JOBS_EAGER', False):
+        transaction.on_commit(lambda: run_pending(job_ids=[job.pk]))
+    return job
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts``, with jitter so retries spread out"""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(1, 1.25)
+
+
+def claim(worker, limit=10, job_ids=None):
+    """Mark up to ``limit`` due jobs as running for ``worker`` and return their ids"""
+    now = timezone.now()
+    with transaction.atomic():
+        due = Job.objects.select_for_update(skip_locked=True).filter(status='queued', run_after__lte=now)
+        if job_ids is not None:
+            due = due.filter(pk__in=job_ids)
+        ids = list(due.order_by('run_after').values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        # Re-checking the status keeps two workers from taking the same job
+        # on databases without row locks
+        Job.objects.filter(pk__in=ids, status='queued').update(
+            status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1, updated_at=now,
+        )
+        return list(
+            Job.objects.filter(pk__in=ids, status='running', locked_by=worker, locked_at=now)
+            .order_by('run_after').values_list('pk', flat=True)
+        )
+
+
+def run_job(job_id):
+    """Run a claimed job and record the outcome; returns True if it succeeded"""
+    job = Job.objects.filter(pk=job_id, status='running').first()
+    if job is None:
+        return False
+    try:
+        func = TASKS.get(job.task)
+        if func is None:
+            raise LookupError(f'Unknown task {job.task!r}')
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        retry = job.attempts < job.max_attempts
+        logger.warning('Job %s (%s) failed on attempt %s%s', job.pk, job.task, job.attempts, '' if retry else ', giving up')
+        now = timezone.now()
+        Job.objects.filter(pk=job.pk).update(
+            status='queued' if retry else 'failed',
+            run_after=now + timedelta(seconds=backoff(job.attempts)) if retry else job.run_after,
+            locked_by='', locked_at=None, last_error=error[-4000:], updated_at=now,
+        )
+        return False
+    Job.objects.filter(pk=job.pk).update(status='done', locked_by='', locked_at=None, updated_at=timezone.now())
+    return True
+
+
+def run_pending(limit=None, job_ids=None):
+    """Run due jobs one after another in this process until none are left; returns ``(succeeded, failed)``"""
+    worker = worker_name()
+    succeeded = failed = 0
+    while limit is None or succeeded + failed < limit:
+        ids = claim(worker, 1, job_ids)
+        if not ids:
+            break
+        if run_job(ids[0]):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def requeue_stale(lease):
+    """Put jobs that have been running for more than ``lease`` seconds back in the queue"""
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=lease))
+    # A job that keeps killing its worker must not be retried forever
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_by='', locked_at=None, last_error='Worker lost while running the job', updated_at=now,
+    )
+    return stale.update(status='queued', locked_by='', locked_at=None, run_after=now, updated_at=now)
+
+
+def purge_done(days):
+    """Delete jobs that finished more than ``days`` days ago"""
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status='done', updated_at__lt=cutoff).delete()[0]
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from catalog.orders import backfill_summaries
+
+
+class Command(BaseCommand):
+    help = 'Store the items summary of orders placed before checkout started recording it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders summarised per query')
+
+    def handle(self, *args, **options):
+        total = 0
+        for total in backfill_summaries(max(1, options['batch_size'])):
+            self.stdout.write(f'{total} orders summarised')
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {total} order summaries.'))
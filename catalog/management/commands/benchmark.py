@@ -0,0 +1,209 @@
+import logging
+import math
+import random
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import closing, contextmanager, nullcontext
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog.datagen import ADJECTIVES, NOUNS
+from catalog.models import Category, Product
+
+DEFAULT_MIX = 'browse=60,search=20,cart=15,checkout=5'
+
+CHECKOUT_DATA = {
+    'shipping_address': '1 Benchmark Way',
+    'shipping_city': 'Springfield',
+    'shipping_state': 'IL',
+    'shipping_zip_code': '62701',
+    'shipping_country': 'US',
+    'phone_number': '555-0100',
+}
+
+
+@contextmanager
+def scratch_database(name, profile):
+    """
+    Point the default database at a scratch SQLite file with ``profile``'s
+    options. The settings dict is changed in place, as the test runner does
+    for its test database, so connections opened by other threads use it too.
+    """
+    connections.close_all()
+    settings_dict = connections['default'].settings_dict
+    saved = dict(settings_dict)
+    settings_dict.update(profile, NAME=name)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        settings_dict.clear()
+        settings_dict.update(saved)
+
+
+@contextmanager
+def scratch_copy():
+    """Run the block against a throwaway copy of the SQLite database"""
+    source = connections['default'].settings_dict['NAME']
+    with tempfile.TemporaryDirectory() as directory:
+        name = str(Path(directory) / 'benchmark.sqlite3')
+        # The backup API copies a consistent snapshot, as sync_sqlite_replicas does
+        with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(name)) as dst:
+            src.backup(dst)
+        with scratch_database(name, {}):
+            yield
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('browse', 'search', 'cart', 'checkout') or not weight.isdigit():
+            raise CommandError(f'Invalid mix entry: {part!r}')
+        mix[name] = int(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = 'Replay a browse/search/add-to-cart/checkout request mix and report latency per view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Number of scenarios to run')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Scenario weights (default: {DEFAULT_MIX})')
+        parser.add_argument('--users', type=int, default=20, help='Number of shoppers to spread carts over')
+        parser.add_argument('--warmup', type=int, default=20, help='Scenarios to run before measuring')
+        parser.add_argument('--seed', type=int, help='Random seed for a reproducible request sequence')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Run against the configured database and keep the carts, orders and users it creates '
+                 '(default: a scratch copy that is thrown away)',
+        )
+
+    def handle(self, *args, **options):
+        # Every request commits on its own, as in production, so the run needs
+        # a database whose new rows can simply be thrown away afterwards
+        if options['keep']:
+            scratch = nullcontext()
+        elif connections['default'].vendor == 'sqlite':
+            scratch = scratch_copy()
+        else:
+            raise CommandError('Without --keep the benchmark runs on a scratch copy, which needs SQLite. '
+                               'Use --keep against a disposable copy of this database.')
+        # Per-request query warnings would bury the report
+        querystats = logging.getLogger('catalog.querystats')
+        level = querystats.level
+        querystats.setLevel(logging.ERROR)
+        try:
+            with scratch:
+                timings, errors, elapsed = self.replay(options)
+        finally:
+            querystats.setLevel(level)
+        self.report(timings, errors, elapsed)
+
+    def replay(self, options):
+        self.random = random.Random(options['seed'])
+        mix = parse_mix(options['mix'])
+
+        self.product_ids = list(
+            Product.objects.filter(is_active=True, stock__gt=0).order_by('-created_at').values_list('id', flat=True)[:5000]
+        )
+        self.category_ids = list(Category.objects.values_list('id', flat=True))
+        if not self.product_ids:
+            raise CommandError('No products in stock. Run populate_data --scale N first.')
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+            clients = self.make_clients(options['users'])
+            scenarios = list(mix)
+            weights = [mix[name] for name in scenarios]
+
+            for _ in range(options['warmup']):
+                self.run_scenario(self.random.choices(scenarios, weights)[0], self.random.choice(clients), None)
+
+            timings = defaultdict(list)
+            errors = defaultdict(int)
+            self.errors = errors
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                self.run_scenario(self.random.choices(scenarios, weights)[0], self.random.choice(clients), timings)
+            elapsed = time.perf_counter() - started
+        return timings, errors, elapsed
+
+    def make_clients(self, count):
+        users = list(User.objects.filter(is_superuser=False, is_active=True)[:count])
+        for n in range(len(users), count):
+            users.append(User.objects.create_user(f'benchmark_{n}', password='benchmark-pass'))
+        clients = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        return clients
+
+    def request(self, client, timings, method, url, data=None):
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        duration = time.perf_counter() - start
+        if timings is not None:
+            name = response.resolver_match.url_name if response.resolver_match else url
+            timings[name].append(duration)
+            if response.status_code >= 400:
+                self.errors[name] += 1
+        return response
+
+    def run_scenario(self, scenario, client, timings):
+        product_id = self.random.choice(self.product_ids)
+        if scenario == 'browse':
+            choice = self.random.randrange(4)
+            if choice == 0:
+                self.request(client, timings, 'get', reverse('catalog:home'))
+            elif choice == 1:
+                self.request(client, timings, 'get', reverse('catalog:product_list'))
+            elif choice == 2:
+                self.request(client, timings, 'get', reverse('catalog:product_detail', args=[product_id]))
+            else:
+                category_id = self.random.choice(self.category_ids)
+                self.request(client, timings, 'get', reverse('catalog:category_products', args=[category_id]))
+        elif scenario == 'search':
+            query = f'{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)}'
+            self.request(client, timings, 'get', reverse('catalog:product_list'), {'search_query': query})
+        elif scenario == 'cart':
+            self.request(client, timings, 'post', reverse('catalog:add_to_cart', args=[product_id]), {'quantity': 1})
+            self.request(client, timings, 'get', reverse('catalog:cart'))
+        elif scenario == 'checkout':
+            self.request(client, timings, 'post', reverse('catalog:add_to_cart', args=[product_id]), {'quantity': 1})
+            self.request(client, timings, 'get', reverse('catalog:checkout'))
+            self.request(client, timings, 'post', reverse('catalog:checkout'), CHECKOUT_DATA)
+
+    def report(self, timings, errors, elapsed):
+        total = sum(len(values) for values in timings.values())
+        header = f'{"view":<22}{"count":>7}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name in sorted(timings, key=lambda n: -len(timings[n])):
+            values = sorted(timings[name])
+            self.stdout.write(
+                f'{name:<22}{len(values):>7}{errors[name]:>8}'
+                f'{percentile(values, 50) * 1000:>10.2f}'
+                f'{percentile(values, 95) * 1000:>10.2f}'
+                f'{percentile(values, 99) * 1000:>10.2f}'
+                f'{len(values) / elapsed:>10.1f}'
+            )
+        self.stdout.write('-' * len(header))
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} requests in {elapsed:.2f}s ({total / elapsed:.1f} req/s overall)'
+        ))
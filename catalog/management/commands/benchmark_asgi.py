@@ -0,0 +1,152 @@
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from catalog.datagen import ADJECTIVES, NOUNS
+from catalog.models import Category, Product
+
+from .benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay the same storefront read requests through the WSGI and the ASGI request handler at '
+        'the same concurrency and compare requests/sec and latency. WSGI serves concurrent requests '
+        'from a thread each; ASGI from one event loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+        parser.add_argument('--mode', choices=['both', 'wsgi', 'asgi'], default='both')
+        parser.add_argument('--warmup', type=int, default=50, help='Requests to run before measuring')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the request sequence')
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Browse anonymously, i.e. through the page cache, instead of as a logged-in user',
+        )
+
+    def handle(self, *args, **options):
+        product_ids = list(
+            Product.objects.filter(is_active=True).order_by('-created_at').values_list('id', flat=True)[:5000]
+        )
+        category_ids = list(Category.objects.values_list('id', flat=True))
+        if not product_ids:
+            raise CommandError('No products found. Run populate_data --scale N first.')
+
+        rng = random.Random(options['seed'])
+        urls = [
+            self.pick_url(rng, product_ids, category_ids)
+            for _ in range(options['warmup'] + options['requests'])
+        ]
+        warmup, measured = urls[:options['warmup']], urls[options['warmup']:]
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+            cookies = None if options['anonymous'] else self.login_cookies()
+            modes = ['wsgi', 'asgi'] if options['mode'] == 'both' else [options['mode']]
+            results = {}
+            for mode in modes:
+                run = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+                run(warmup, options['concurrency'], cookies)
+                results[mode] = run(measured, options['concurrency'], cookies)
+
+        self.report(results)
+
+    def pick_url(self, rng, product_ids, category_ids):
+        choice = rng.randrange(5)
+        if choice == 0:
+            return 'home', reverse('catalog:home'), None
+        if choice == 1:
+            return 'product_list', reverse('catalog:product_list'), None
+        if choice == 2:
+            return 'product_detail', reverse('catalog:product_detail', args=[rng.choice(product_ids)]), None
+        if choice == 3:
+            return 'category_products', reverse('catalog:category_products', args=[rng.choice(category_ids)]), None
+        query = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'
+        return 'search', reverse('catalog:product_list'), {'search_query': query}
+
+    def login_cookies(self):
+        user = User.objects.filter(is_active=True).first()
+        if user is None:
+            raise CommandError('No users found. Run populate_data --scale N first.')
+        client = Client()
+        client.force_login(user)
+        return client.cookies
+
+    def run_wsgi(self, urls, concurrency, cookies):
+        local = threading.local()
+        timings = defaultdict(list)
+        errors = defaultdict(int)
+
+        def fetch(item):
+            name, url, data = item
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                if cookies is not None:
+                    local.client.cookies = cookies
+            start = time.perf_counter()
+            response = local.client.get(url, data)
+            timings[name].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors[name] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(fetch, urls))
+        return timings, errors, time.perf_counter() - started
+
+    def run_asgi(self, urls, concurrency, cookies):
+        timings = defaultdict(list)
+        errors = defaultdict(int)
+
+        async def worker(queue):
+            client = AsyncClient()
+            if cookies is not None:
+                client.cookies = cookies
+            while not queue.empty():
+                name, url, data = queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.get(url, data)
+                timings[name].append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors[name] += 1
+
+        async def main():
+            queue = asyncio.Queue()
+            for item in urls:
+                queue.put_nowait(item)
+            await asyncio.gather(*(worker(queue) for _ in range(concurrency)))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        return timings, errors, time.perf_counter() - started
+
+    def report(self, results):
+        header = f'{"mode":<6}{"view":<20}{"count":>7}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for mode, (timings, errors, elapsed) in results.items():
+            rows = sorted(timings.items()) + [('all', [value for values in timings.values() for value in values])]
+            for name, values in rows:
+                values = sorted(values)
+                count = len(values)
+                error_count = sum(errors.values()) if name == 'all' else errors[name]
+                # Per-view rate is that view's share of the measured throughput
+                rate = count / elapsed
+                line = (
+                    f'{mode:<6}{name:<20}{count:>7}{error_count:>8}'
+                    f'{percentile(values, 50) * 1000:>10.2f}'
+                    f'{percentile(values, 95) * 1000:>10.2f}'
+                    f'{percentile(values, 99) * 1000:>10.2f}'
+                    f'{rate:>10.1f}'
+                )
+                self.stdout.write(self.style.SUCCESS(line) if name == 'all' else line)
+            self.stdout.write('-' * len(header))
@@ -0,0 +1,120 @@
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from catalog.cart import add_item
+from catalog.models import Category, Order, Product
+from catalog.services import place_order
+
+from .benchmark import CHECKOUT_DATA, percentile, scratch_database
+
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent checkout throughput of a bare SQLite database with the configured profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Shoppers checking out at the same time')
+        parser.add_argument('--seconds', type=float, default=5.0, help='How long each profile runs')
+        parser.add_argument('--products', type=int, default=50, help='Products the checkouts pick from')
+
+    def handle(self, *args, **options):
+        configured = settings.DATABASES['default']
+        if configured['ENGINE'] != SQLITE_ENGINE:
+            raise CommandError('benchmark_db compares SQLite profiles; run it with DB_ENGINE=sqlite.')
+
+        profiles = {
+            # Django's defaults: rollback journal, deferred transactions, a
+            # new connection per request
+            'bare': {'ENGINE': SQLITE_ENGINE, 'CONN_MAX_AGE': 0, 'OPTIONS': {}},
+            'configured': {
+                'ENGINE': SQLITE_ENGINE,
+                'CONN_MAX_AGE': configured['CONN_MAX_AGE'],
+                'OPTIONS': configured['OPTIONS'],
+            },
+        }
+        threads = max(1, options['threads'])
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name, profile in profiles.items():
+                self.stdout.write(f'{name}: {threads} threads for {options["seconds"]:.0f}s...')
+                with scratch_database(str(Path(directory) / f'{name}.sqlite3'), profile):
+                    call_command('migrate', verbosity=0)
+                    users, product_ids = self.seed(threads, options['products'])
+                    results[name] = self.run(users, product_ids, options['seconds'])
+        self.report(results)
+
+    def seed(self, threads, products):
+        category = Category.objects.create(name='Benchmark')
+        Product.objects.bulk_create(
+            Product(name=f'Benchmark product {i}', category=category, price=Decimal('9.99'), stock=10 ** 6)
+            for i in range(max(1, products))
+        )
+        users = [User.objects.create_user(f'benchmark_db_{n}') for n in range(threads)]
+        connections.close_all()
+        return users, list(Product.objects.values_list('id', flat=True))
+
+    def run(self, users, product_ids, seconds):
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users))
+
+        def shopper(user, offset):
+            own_latencies = []
+            own_errors = 0
+            try:
+                barrier.wait()
+                deadline = time.perf_counter() + seconds
+                n = offset
+                while time.perf_counter() < deadline:
+                    n += 1
+                    start = time.perf_counter()
+                    try:
+                        # Connections are opened and closed per "request" as
+                        # the request_started/finished signals would
+                        connections['default'].close_if_unusable_or_obsolete()
+                        product = Product(pk=product_ids[n % len(product_ids)])
+                        cart = add_item(user, product, 1)
+                        place_order(cart, Order(user=user, **CHECKOUT_DATA))
+                    except OperationalError:
+                        own_errors += 1
+                    else:
+                        own_latencies.append(time.perf_counter() - start)
+                    finally:
+                        connections['default'].close_if_unusable_or_obsolete()
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(own_latencies)
+                    errors.append(own_errors)
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=shopper, args=(user, i * 7)) for i, user in enumerate(users)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return sorted(latencies), sum(errors), time.perf_counter() - started
+
+    def report(self, results):
+        header = f'{"profile":<12}{"checkouts":>11}{"locked":>8}{"per sec":>10}{"p50 ms":>10}{"p95 ms":>10}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, (latencies, errors, elapsed) in results.items():
+            self.stdout.write(
+                f'{name:<12}{len(latencies):>11}{errors:>8}{len(latencies) / elapsed:>10.1f}'
+                f'{percentile(latencies, 50) * 1000:>10.2f}{percentile(latencies, 95) * 1000:>10.2f}'
+            )
+        bare, configured = (len(results[name][0]) / results[name][2] for name in ('bare', 'configured'))
+        if bare:
+            self.stdout.write(self.style.SUCCESS(f'Configured profile: {configured / bare:.1f}x the checkout throughput.'))
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from catalog.images import is_current, process_product
+from catalog.models import Product
+
+
+def build(product_id):
+    try:
+        return process_product(product_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Build resized WebP/JPEG renditions for product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of images resized in parallel')
+        parser.add_argument('--force', action='store_true', help='Rebuild renditions that already exist')
+        parser.add_argument('--product', type=int, action='append', help='Only this product id (repeatable)')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if options['product']:
+            products = products.filter(pk__in=options['product'])
+        if options['force']:
+            products.update(image_renditions={})
+
+        pending = [
+            product.pk for product in products.only('id', 'image', 'image_renditions').iterator(chunk_size=2000)
+            if not is_current(product)
+        ]
+        self.stdout.write(f'Building renditions for {len(pending)} products...')
+
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = {executor.submit(build, product_id): product_id for product_id in pending}
+            for future in as_completed(futures):
+                try:
+                    built += bool(future.result())
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'Product {futures[future]}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(f'Built renditions for {built} products ({failed} failed).'))
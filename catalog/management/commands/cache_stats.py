@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from catalog.caching import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Show hit rates of the catalog page and fragment caches. The counters live in the '
+        'cache itself, so this needs a shared backend (file based or Redis) to see other processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        if not stats:
+            self.stdout.write('No cache activity recorded yet.')
+        else:
+            header = f'{"cache":<34}{"hits":>10}{"misses":>10}{"hit rate":>10}'
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+            for name, (hits, misses) in stats.items():
+                total = hits + misses
+                rate = hits / total * 100 if total else 0
+                self.stdout.write(f'{name:<34}{hits:>10}{misses:>10}{rate:>9.1f}%')
+
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
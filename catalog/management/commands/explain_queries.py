@@ -0,0 +1,156 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog import urls as catalog_urls
+from catalog.middleware import QueryStats, fingerprint
+from catalog.models import CartItem, Order, Product
+from catalog.pagination import KeysetPaginator
+
+# Tables small enough that scanning them is cheaper than an index lookup.
+DEFAULT_ALLOWED_SCANS = ['catalog_category', 'django_content_type', 'django_site']
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)\b(?! USING)(?! VIRTUAL TABLE)')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+# Reading a whole index in order: fine for a first page, but a cursor page doing
+# it walks every row before the cursor
+SQLITE_INDEX_WALK_RE = re.compile(r'^SCAN (\w+) USING (?:COVERING )?INDEX\b')
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN on every query issued by the catalog views and fail if any of them '
+        'does a full table scan. Run it against a large seeded database (populate_data --scale N).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--allow-scan', action='append', default=[],
+            help='Table that may be fully scanned (repeatable); small lookup tables are allowed by default',
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Also check queries that only run on a cold cache (e.g. whole-catalog facet counts)',
+        )
+        parser.add_argument('--analyze', action='store_true', help='Refresh planner statistics first')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the plan of every query')
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'EXPLAIN parsing is not implemented for {connection.vendor}.')
+        self.connection = connection
+        allowed = set(DEFAULT_ALLOWED_SCANS) | set(options['allow_scan'])
+
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        failures = []
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False), transaction.atomic():
+            client = self.make_client()
+            for name, method, url, data in self.requests():
+                if not options['cold']:
+                    # Warm the caches so only steady-state queries are checked
+                    getattr(client, method)(url, data)
+                with QueryStats(using='default') as stats:
+                    getattr(client, method)(url, data)
+
+                seen = set()
+                for (sql, _), params in zip(stats.queries, stats.params):
+                    key = fingerprint(sql)
+                    if not sql.lstrip().upper().startswith('SELECT') or key in seen:
+                        continue
+                    seen.add(key)
+                    plan = self.explain(sql, params)
+                    scans = [table for table in self.full_scans(plan) if table not in allowed]
+                    if name.endswith(':next'):
+                        scans += [f'{table} (index walked up to the cursor)' for table in self.index_walks(plan)]
+                    if options['verbose_plans'] or scans:
+                        self.stdout.write(f'\n[{name}] {sql}')
+                        for line in plan:
+                            self.stdout.write(f'    {line}')
+                    for table in scans:
+                        failures.append(f'{name}: full scan of {table}')
+                self.stdout.write(f'{name:<22}{stats.count:>4} queries checked')
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('Full table scans found:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('No full table scans found.'))
+
+    def make_client(self):
+        user = User.objects.filter(order__isnull=False, cart__items__isnull=False).first()
+        user = user or User.objects.filter(order__isnull=False).first()
+        if user is None:
+            raise CommandError('No users with orders found. Run populate_data --scale N first.')
+        client = Client()
+        client.force_login(user)
+        self.user = user
+        return client
+
+    def requests(self):
+        """Yield ``(url name, method, url, data)`` for every catalog URL"""
+        product = Product.objects.filter(is_active=True, stock__gt=0).order_by('-created_at').first()
+        order = Order.objects.filter(user=self.user).order_by('-created_at').first()
+        cart_item = CartItem.objects.filter(cart__user=self.user).first()
+        kwargs = {
+            'product_detail': {'product_id': product.id},
+            'add_to_cart': {'product_id': product.id},
+            'category_products': {'category_id': product.category_id},
+            'order_confirmation': {'order_id': order.id},
+            'order_detail': {'order_id': order.id},
+            'reorder': {'order_id': order.id},
+            'update_cart_item': {'item_id': cart_item.id} if cart_item else None,
+            'remove_from_cart': {'item_id': cart_item.id} if cart_item else None,
+        }
+        posts = {'add_to_cart', 'update_cart_item', 'remove_from_cart', 'reorder'}
+        skip = {'logout', 'remove_from_cart'}
+        for pattern in catalog_urls.urlpatterns:
+            name = pattern.name
+            if name in skip or kwargs.get(name, {}) is None:
+                continue
+            url = reverse(f'catalog:{name}', kwargs=kwargs.get(name, {}))
+            yield name, 'post' if name in posts else 'get', url, {'quantity': 1} if name in posts else None
+        yield 'product_list:search', 'get', reverse('catalog:product_list'), {'search_query': product.name.split()[0]}
+
+        # Later pages continue from a cursor; their queries must seek to it, not walk the index up to it
+        listings = {
+            'product_list': (reverse('catalog:product_list'), Product.objects.filter(is_active=True)),
+            'category_products': (
+                reverse('catalog:category_products', kwargs=kwargs['category_products']),
+                Product.objects.filter(is_active=True, category_id=product.category_id),
+            ),
+        }
+        for name, (url, products) in listings.items():
+            cursor = KeysetPaginator(products, 12, count=False).get_page().next_cursor
+            if cursor:
+                yield f'{name}:next', 'get', url, {'cursor': cursor}
+
+    def explain(self, sql, params):
+        prefix = 'EXPLAIN QUERY PLAN ' if self.connection.vendor == 'sqlite' else 'EXPLAIN '
+        with self.connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        if self.connection.vendor == 'sqlite':
+            return [row[-1] for row in rows]
+        return [row[0] for row in rows]
+
+    def index_walks(self, plan):
+        if self.connection.vendor != 'sqlite':
+            return
+        for line in plan:
+            match = SQLITE_INDEX_WALK_RE.search(line.strip())
+            if match and match.group(1) not in DEFAULT_ALLOWED_SCANS:
+                yield match.group(1)
+
+    def full_scans(self, plan):
+        pattern = SQLITE_SCAN_RE if self.connection.vendor == 'sqlite' else POSTGRES_SCAN_RE
+        for line in plan:
+            match = pattern.search(line.strip())
+            if match:
+                yield match.group(1)
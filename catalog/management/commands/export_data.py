@@ -0,0 +1,27 @@
+
+from django.core.management.base import BaseCommand
+
+from catalog.transfer import EXPORTS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream products, orders or order items to a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', default='-', help="File to write; '-' for standard output")
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['dataset'], options['format'], chunk_size=max(1, options['chunk_size']))
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        rows = -1 if options['format'] == 'csv' else 0
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for line in lines:
+                output.write(line)
+                rows += 1
+        self.stderr.write(f'Wrote {max(rows, 0)} {options["dataset"]} to {options["output"]}.')
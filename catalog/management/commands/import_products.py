@@ -0,0 +1,47 @@
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.transfer import import_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or update products from a CSV or JSON Lines file (columns as written by export_data products). '
+        'Rows with an id update that product; rows without one create a product.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON Lines file; '-' for standard input")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension, else csv')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows validated and written per transaction')
+        parser.add_argument('--max-errors', type=int, default=100, help='Invalid rows to list at the end')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        def progress(report):
+            self.stdout.write(f'{report.processed} rows: {report.created} created, {report.updated} updated, {report.invalid} invalid')
+
+        try:
+            # Standard input is not ours to close
+            opened = nullcontext(sys.stdin) if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+        with opened as file:
+            report = import_products(
+                file, format, batch_size=max(1, options['batch_size']), progress=progress,
+                max_errors=options['max_errors'],
+            )
+
+        for line_number, message in report.errors:
+            self.stderr.write(f'Line {line_number}: {message}')
+        if report.invalid > len(report.errors):
+            self.stderr.write(f'... and {report.invalid - len(report.errors)} more invalid rows')
+        style = self.style.WARNING if report.invalid else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Imported {report.created + report.updated} products '
+            f'({report.created} created, {report.updated} updated, {report.invalid} invalid).'
+        ))
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.db import transaction
+from catalog.datagen import SyntheticDataGenerator
 from catalog.models import Category, Product
 from decimal import Decimal
 
@@ -7,7 +9,43 @@ from decimal import Decimal
 class Command(BaseCommand):
     help = 'Populate the database with sample categories and products'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=int,
+            help='Generate this many synthetic products, plus users, carts and orders in proportion',
+        )
+        parser.add_argument('--users', type=int, help='Number of users (default: scale / 100, at least 10)')
+        parser.add_argument('--orders', type=int, help='Number of orders (default: scale / 2)')
+        parser.add_argument('--carts', type=int, help='Number of open carts (default: users / 4)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--days', type=int, default=365, help='Spread timestamps over this many days')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible data')
+
     def handle(self, *args, **options):
+        if options['scale']:
+            self.create_synthetic_data(options)
+        else:
+            self.create_sample_data()
+
+    def create_synthetic_data(self, options):
+        scale = options['scale']
+        users = options['users'] or max(10, scale // 100)
+        generator = SyntheticDataGenerator(
+            products=scale,
+            users=users,
+            orders=options['orders'] if options['orders'] is not None else scale // 2,
+            carts=options['carts'] if options['carts'] is not None else users // 4,
+            batch_size=options['batch_size'],
+            days=options['days'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f'Generating synthetic data for {scale} products...')
+        with transaction.atomic():
+            generator.run()
+        self.stdout.write(self.style.SUCCESS('Synthetic data created successfully!'))
+
+    def create_sample_data(self):
         self.stdout.write('Creating sample data...')
         
         # Create categories
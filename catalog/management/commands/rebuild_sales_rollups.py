@@ -0,0 +1,37 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from catalog.analytics import rebuild
+from catalog.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the daily sales rollups from the orders, a chunk of days per transaction. '
+        'Run it while no job worker is processing orders of the same days.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First day (YYYY-MM-DD); default: first order')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last day (YYYY-MM-DD); default: today')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        bounds = Order.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        if bounds['first'] is None and not options['since']:
+            self.stdout.write('No orders to roll up.')
+            return
+        first = options['since'] or timezone.localdate(bounds['first'])
+        last = options['until'] or timezone.localdate()
+        if first > last:
+            raise CommandError('--since is after --until.')
+
+        total = 0
+        for chunk_first, chunk_last, rows in rebuild(first, last, max(1, options['chunk_days'])):
+            total += rows
+            self.stdout.write(f'{chunk_first} .. {chunk_last}: {rows} rollup rows')
+        days = (last - first + timedelta(days=1)).days
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} days of sales rollups ({total} rows).'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from catalog.models import Product
+from catalog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias whose index should be rebuilt',
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        backend = get_search_backend(using)
+        self.stdout.write(f'Rebuilding search index with {backend.__class__.__name__}...')
+
+        with transaction.atomic(using=using):
+            backend.rebuild()
+
+        count = Product.objects.using(using).count()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products.'))
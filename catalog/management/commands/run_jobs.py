@@ -0,0 +1,76 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from catalog.jobs import claim, purge_done, requeue_stale, run_job, worker_name
+
+PURGE_INTERVAL = 60 * 60
+
+
+def forget_inherited_connections():
+    """
+    Process pool initializer: drop the database connections a forked worker
+    inherited from the parent, without closing them, since closing would
+    also end the parent's session. Each worker then opens its own.
+    """
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+
+
+def execute(job_id):
+    try:
+        return run_job(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (catalog.jobs) on a thread or process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Jobs run in parallel')
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed at a time (default: 2 per worker)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--lease', type=int, default=300, help='Seconds before a running job counts as abandoned')
+        parser.add_argument('--keep-days', type=int, default=7, help='Days to keep finished jobs')
+        parser.add_argument('--once', action='store_true', help='Exit when no jobs are due instead of polling')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = options['batch_size'] or workers * 2
+        worker = worker_name()
+        if options['pool'] == 'process':
+            # Workers fork on the first map(), when the parent has long since
+            # reconnected, so each one forgets the connections it inherits
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                initializer=forget_inherited_connections,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        succeeded = failed = 0
+        purged_at = 0
+        try:
+            with executor:
+                while True:
+                    if time.monotonic() - purged_at > PURGE_INTERVAL:
+                        purge_done(options['keep_days'])
+                        purged_at = time.monotonic()
+                    requeue_stale(options['lease'])
+                    job_ids = claim(worker, batch_size)
+                    if not job_ids:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+                    results = list(executor.map(execute, job_ids))
+                    succeeded += results.count(True)
+                    failed += results.count(False)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the jobs in progress...')
+        self.stdout.write(self.style.SUCCESS(f'Ran {succeeded + failed} jobs ({failed} failed).'))
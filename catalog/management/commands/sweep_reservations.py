@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.reservations import release_all_expired
+
+
+class Command(BaseCommand):
+    help = 'Hand expired cart stock holds back to the available stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Holds released per transaction')
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running and sweep every N seconds instead of once',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_all_expired(max(1, options['batch_size']))
+            if released or not options['interval']:
+                self.stdout.write(f'Released {released} expired holds.')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
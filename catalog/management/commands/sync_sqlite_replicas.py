@@ -0,0 +1,35 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the SQLITE_REPLICA_PATHS files standing in for read replicas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep copying every this many seconds, like a lagging replica (default: copy once)',
+        )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        replicas = {alias: settings.DATABASES[alias] for alias in settings.CATALOG_READ_REPLICAS}
+        if primary['ENGINE'] != 'django.db.backends.sqlite3' or not replicas:
+            raise CommandError('No SQLite replicas configured; set SQLITE_REPLICA_PATHS.')
+
+        while True:
+            for alias, replica in replicas.items():
+                self.copy(primary['NAME'], replica['NAME'])
+                self.stdout.write(f'{alias}: {replica["NAME"]} is up to date')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def copy(self, source, target):
+        # The backup API copies a consistent snapshot while the site keeps writing
+        with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+            src.backup(dst)
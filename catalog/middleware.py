@@ -0,0 +1,342 @@
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .routers import STICKY_COOKIE, get_replicas
+from .templateprofile import TemplateProfile
+
+logger = logging.getLogger('catalog.querystats')
+template_logger = logging.getLogger('catalog.templateprofile')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+
+
+def fingerprint(sql):
+    """Normalize a SQL statement so queries differing only in parameters compare equal"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+# QueryStats blocks active in the current context. A ContextVar (rather than
+# per-connection wrappers) follows the request into sync_to_async threads, so
+# queries an async view runs on other threads are counted too.
+_active_stats = ContextVar('catalog_query_stats', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    active = _active_stats.get()
+    if not active:
+        return execute(sql, params, many, context)
+    alias = context['connection'].alias
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for stats in active:
+            if stats.using in (None, alias):
+                stats._record(sql, params, elapsed)
+
+
+def install_query_hook(connection):
+    """Route every statement run on ``connection`` through active QueryStats blocks"""
+    if _dispatch not in connection.execute_wrappers:
+        # First in the list, so a temporary execute_wrapper() popping its own
+        # wrapper off the end never removes this one
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+class QueryStats:
+    """
+    Record every SQL statement run while the block is active, on any database
+    (or only ``using``) and any thread the current context is handed to.
+
+    Usable as a context manager in tests and by QueryStatsMiddleware::
+
+        with QueryStats() as stats:
+            client.get('/')
+        stats.count, stats.duration, stats.duplicates
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries = []
+        self.params = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self):
+        for connection in connections.all(initialized_only=True):
+            install_query_hook(connection)
+        self._token = _active_stats.set((*_active_stats.get(), self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_stats.reset(self._token)
+
+    def _record(self, sql, params, elapsed):
+        with self._lock:
+            self.queries.append((sql, elapsed))
+            self.params.append(params)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        """Total time spent in the database, in seconds"""
+        return sum(elapsed for sql, elapsed in self.queries)
+
+    @property
+    def duplicates(self):
+        """Map of fingerprint to repeat count for statements run more than once"""
+        counts = Counter(fingerprint(sql) for sql, elapsed in self.queries)
+        return {sql: count for sql, count in counts.items() if count > 1}
+
+
+class QueryStatsMiddleware:
+    """
+    Report per-request SQL count, database time and duplicated queries.
+
+    Stats are sent as X-DB-* response headers when QUERY_STATS_HEADERS is
+    true, and logged to ``catalog.querystats`` as a warning once a request
+    runs more than QUERY_STATS_LOG_THRESHOLD queries or repeats a query.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.send_headers = getattr(settings, 'QUERY_STATS_HEADERS', settings.DEBUG)
+        self.log_threshold = getattr(settings, 'QUERY_STATS_LOG_THRESHOLD', 20)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryStats() as stats:
+            response = self.get_response(request)
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        with QueryStats() as stats:
+            response = await self.get_response(request)
+        return self.report(request, response, stats)
+
+    def report(self, request, response, stats):
+        duplicates = stats.duplicates
+        duplicate_count = sum(count - 1 for count in duplicates.values())
+
+        if self.send_headers:
+            response['X-DB-Query-Count'] = str(stats.count)
+            response['X-DB-Time-Ms'] = f'{stats.duration * 1000:.2f}'
+            response['X-DB-Duplicate-Queries'] = str(duplicate_count)
+
+        if stats.count > self.log_threshold or duplicates:
+            logger.warning(
+                '%s %s ran %d queries in %.2f ms (%d duplicated)',
+                request.method, request.path, stats.count, stats.duration * 1000, duplicate_count,
+                extra={'query_duplicates': duplicates},
+            )
+        return response
+
+
+class TemplateProfileMiddleware:
+    """
+    Time template rendering per template, block and include for each request.
+
+    Only active when CATALOG_TEMPLATE_PROFILE is true. The total and the
+    CATALOG_TEMPLATE_PROFILE_TOP entries with the most own time are sent in a
+    Server-Timing header (shown in the browser's network panel) and logged to
+    ``catalog.templateprofile`` at INFO level.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CATALOG_TEMPLATE_PROFILE', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.top = getattr(settings, 'CATALOG_TEMPLATE_PROFILE_TOP', 10)
+
+    def __call__(self, request):
+        with TemplateProfile() as profile:
+            response = self.get_response(request)
+        if not profile.entries:
+            return response
+
+        rows = profile.rows[:self.top]
+        timings = [f'tpl;desc="templates";dur={profile.duration * 1000:.2f}'] + [
+            f'tpl{position};desc="{kind} {name} x{calls}";dur={own * 1000:.2f}'
+            for position, (kind, name, calls, total, own) in enumerate(rows, 1)
+        ]
+        response['Server-Timing'] = ', '.join(timing for timing in [response.get('Server-Timing'), *timings] if timing)
+        template_logger.info(
+            '%s %s rendered templates in %.2f ms\n%s',
+            request.method, request.path, profile.duration * 1000,
+            '\n'.join(
+                f'  {own * 1000:8.2f} own {total * 1000:8.2f} total {calls:5d}x  {kind} {name}'
+                for kind, name, calls, total, own in rows
+            ),
+        )
+        return response
+
+
+class StaticFilesMiddleware:
+    """
+    Serve the collected files in STATIC_ROOT from the app process.
+
+    STATIC_ROOT is indexed once at startup, so only files collectstatic wrote
+    can be served and no request path reaches the filesystem. Names listed in
+    collectstatic's manifest are content-hashed and sent with
+    ``Cache-Control: public, max-age=31536000, immutable``; anything else gets
+    STATIC_MAX_AGE and Last-Modified revalidation. The ``.br`` or ``.gz`` copy
+    written by catalog.storage is sent when the client accepts it. Not used
+    with DEBUG, where django.contrib.staticfiles serves the source files.
+    """
+
+    immutable_cache_control = 'public, max-age=31536000, immutable'
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DEBUG or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.max_age = getattr(settings, 'STATIC_MAX_AGE', 60)
+        self.files = self.index(str(settings.STATIC_ROOT))
+        if not self.files:
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def index(self, root):
+        """Map request paths to ``(path, content_type, {encoding: path}, immutable)``"""
+        try:
+            with open(os.path.join(root, 'staticfiles.json')) as f:
+                hashed = set(json.load(f)['paths'].values())
+        except (OSError, ValueError, KeyError):
+            hashed = set()
+
+        files = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                if content_type.startswith('text/') or content_type in ('application/javascript', 'image/svg+xml'):
+                    content_type += '; charset=utf-8'
+                encodings = {
+                    encoding: path + suffix
+                    for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                    if os.path.exists(path + suffix)
+                }
+                files[self.prefix + name] = (path, content_type, encodings, name in hashed)
+        return files
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        entry = self.lookup(request)
+        if entry:
+            return self.serve(request, *entry)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        entry = self.lookup(request)
+        if entry:
+            return self.serve(request, *entry)
+        return await self.get_response(request)
+
+    def lookup(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            return self.files.get(request.path)
+        return None
+
+    def serve(self, request, path, content_type, encodings, immutable):
+        stat = os.stat(path)
+        if not immutable and not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+            return HttpResponseNotModified()
+
+        accepted = {
+            token.split(';')[0].strip() for token in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')
+            if not token.replace(' ', '').endswith(';q=0')
+        }
+        encoding = next((encoding for encoding in encodings if encoding in accepted), None)
+        if encoding:
+            path = encodings[encoding]
+            stat = os.stat(path)
+
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(stat.st_size)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if encodings:
+            response['Vary'] = 'Accept-Encoding'
+        if immutable:
+            response['Cache-Control'] = self.immutable_cache_control
+        else:
+            response['Cache-Control'] = f'public, max-age={self.max_age}'
+            response['Last-Modified'] = http_date(stat.st_mtime)
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Keep a browser's catalog reads on the primary for a short while after it
+    writes, until the read replicas (catalog.routers) have caught up.
+
+    Any POST or other unsafe request sets a cookie lasting
+    CATALOG_REPLICA_STICKY_SECONDS; ``@replica_reads`` views skip the
+    replicas while it is present. Not used without CATALOG_READ_REPLICAS.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.max_age = getattr(settings, 'CATALOG_REPLICA_STICKY_SECONDS', 10)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.stick(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.stick(request, await self.get_response(request))
+
+    def stick(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.max_age, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE catalog_product_fts USING fts5("
+    "name, description, category, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO catalog_product_fts (rowid, name, description, category) "
+    "SELECT p.id, p.name, p.description, c.name "
+    "FROM catalog_product p JOIN catalog_category c ON c.id = p.category_id",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS catalog_product_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE catalog_product_search ("
+    "product_id bigint PRIMARY KEY REFERENCES catalog_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX catalog_product_search_document_gin ON catalog_product_search USING gin (document)",
+    "INSERT INTO catalog_product_search (product_id, document) "
+    "SELECT p.id, "
+    "setweight(to_tsvector('english', coalesce(p.name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(c.name, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(p.description, '')), 'D') "
+    "FROM catalog_product p JOIN catalog_category c ON c.id = p.category_id",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP TABLE IF EXISTS catalog_product_search",
+]
+
+
+def run_statements(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_statements({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
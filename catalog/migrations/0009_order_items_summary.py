@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_summary',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,6 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import bump_carts
+from .ordernumbers import next_order_number
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -18,38 +24,99 @@ class Product(models.Model):
     name = models.CharField(max_length=200)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     image = models.ImageField(upload_to='products/', null=True, blank=True)
+    # Resized copies of ``image``, filled in by catalog.images
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     description = models.TextField()
     stock = models.PositiveIntegerField(default=0)
+    # Units held by carts (catalog.reservations); only ever changed by UPDATE
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Storefront listings only ever show active products, newest first
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(is_active=True),
+                name='product_active_created_idx',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], condition=models.Q(is_active=True),
+                name='product_active_cat_idx',
+            ),
+            models.Index(
+                fields=['price'], condition=models.Q(is_active=True),
+                name='product_active_price_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        # A full save must not write back a stale copy of the hold counter
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reserved'
+            ]
+        super().save(*args, **kwargs)
+    
+    @property
+    def available(self):
+        """Units that can still be added to a cart"""
+        return max(self.stock - self.reserved, 0)
+    
     @property
     def is_in_stock(self):
-        return self.stock > 0
+        return self.available > 0
+
+class CartQuerySet(models.QuerySet):
+    def update_totals(self):
+        """Recompute the stored item count and subtotal in a single UPDATE"""
+        carts = dict(self.values_list('pk', 'user_id'))
+        if not carts:
+            return 0
+        # Sessions keep a copy of the totals (catalog.cart.get_cart_summary)
+        transaction.on_commit(lambda: bump_carts(carts.values()), using=self.db)
+        return Cart.objects.using(self.db).filter(pk__in=carts)._set_totals()
+
+    def _set_totals(self):
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        quantity = items.annotate(total=Sum('quantity')).values('total')
+        subtotal = items.annotate(
+            total=Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        ).values('total')
+        return self.update(
+            item_count=Coalesce(Subquery(quantity), Value(0)),
+            subtotal=Coalesce(Subquery(subtotal), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            updated_at=timezone.now(),
+        )
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Maintained by update_totals() whenever the cart's items change
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartQuerySet.as_manager()
+    
     def __str__(self):
         return f"Cart for {self.user.username}"
     
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.subtotal
     
-    @property
-    def item_count(self):
-        return sum(item.quantity for item in self.items.all())
+    def update_totals(self):
+        Cart.objects.filter(pk=self.pk)._set_totals()
+        transaction.on_commit(lambda: bump_carts([self.user_id]))
+        self.refresh_from_db(fields=['item_count', 'subtotal', 'updated_at'])
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -66,6 +133,29 @@ class CartItem(models.Model):
     @property
     def total_price(self):
         return self.product.price * self.quantity
+    
+    @property
+    def max_quantity(self):
+        """The most this line can be raised to: its own hold plus what is still free"""
+        return self.quantity + self.product.available
+
+class StockReservation(models.Model):
+    """Units of a product held for a cart until ``expires_at`` (see catalog.reservations)"""
+    # Kept when the cart is deleted so the sweeper still hands the units back
+    cart = models.ForeignKey(Cart, on_delete=models.SET_NULL, null=True, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['cart', 'product']
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -93,18 +183,31 @@ class Order(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Whether the order is currently added into SalesRollup (catalog.analytics)
+    in_sales_rollups = models.BooleanField(default=False, editable=False)
+    # Line count, units and the first few lines, stored at checkout so order
+    # lists never read OrderItem (catalog.orders)
+    items_summary = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_number}"
     
     def save(self, *args, **kwargs):
         if not self.order_number:
-            import random
-            import string
-            self.order_number = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+            self.order_number = next_order_number()
+        # The rollup flag is only changed by catalog.analytics; don't write back a stale copy
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'in_sales_rollups'
+            ]
         super().save(*args, **kwargs)
 
 class OrderItem(models.Model):
@@ -119,4 +222,64 @@ class OrderItem(models.Model):
     
     @property
     def total_price(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+class Job(models.Model):
+    """A queued call of a catalog.jobs task, run by ``manage.py run_jobs``"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Workers only ever look for due jobs
+            models.Index(fields=['run_after'], condition=models.Q(status='queued'), name='job_queued_idx'),
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='job_running_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+class SalesRollup(models.Model):
+    """
+    Orders, units and revenue of one day, overall or for one category or
+    product. Maintained by catalog.analytics; cancelled orders are left out.
+    """
+    DIMENSION_CHOICES = [
+        ('all', 'All sales'),
+        ('category', 'Category'),
+        ('product', 'Product'),
+    ]
+    
+    date = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    # Category or product id; 0 for the 'all' rows
+    key = models.BigIntegerField(default=0)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['date', 'dimension', 'key']
+        indexes = [
+            models.Index(fields=['dimension', 'date'], name='rollup_dimension_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.dimension}:{self.key}"
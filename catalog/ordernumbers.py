@@ -0,0 +1,124 @@
+"""
+Time-ordered, collision-free order numbers.
+
+Numbers are Snowflake style: a millisecond timestamp, a node id and a
+per-millisecond sequence packed into 72 bits and written as 15 Crockford
+base32 characters. They are generated in-process without touching the
+database, sort in creation order (so inserts land at the right-hand edge of
+the unique index), and cannot collide as long as every process generating
+them has a distinct node id.
+
+Set CATALOG_NODE_ID (0-65535) per worker process in multi-process
+deployments. When it is unset each process picks a random node id at start
+up and again after a fork, which makes a clash unlikely but not impossible.
+"""
+import os
+import secrets
+import threading
+import time
+
+from django.conf import settings
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+LENGTH = 15
+
+# 2024-01-01T00:00:00Z; 44 timestamp bits last until the year 2581
+EPOCH_MS = 1704067200000
+TIMESTAMP_BITS = 44
+NODE_BITS = 16
+SEQUENCE_BITS = 12
+
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def encode(value):
+    chars = []
+    for _ in range(LENGTH):
+        value, index = divmod(value, 32)
+        chars.append(ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def decode(number):
+    value = 0
+    for char in number.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+class OrderNumberGenerator:
+    """Thread-safe generator of unique, monotonically increasing order numbers"""
+
+    def __init__(self, node_id, clock=None):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f'Node id must be between 0 and {MAX_NODE_ID}, got {node_id}')
+        self.node_id = node_id
+        self.clock = clock or (lambda: time.time_ns() // 1_000_000)
+        self.last_ms = 0
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            now = self.clock() - EPOCH_MS
+            if now > self.last_ms:
+                self.last_ms = now
+                self.sequence = 0
+            elif self.sequence < MAX_SEQUENCE:
+                # Same millisecond, or the clock stepped backwards: keep counting
+                # from the last timestamp so numbers never repeat or go down.
+                self.sequence += 1
+            else:
+                # Sequence exhausted: borrow the next millisecond
+                self.last_ms += 1
+                self.sequence = 0
+            return (
+                (self.last_ms << (NODE_BITS + SEQUENCE_BITS))
+                | (self.node_id << SEQUENCE_BITS)
+                | self.sequence
+            )
+
+    def next_number(self):
+        return encode(self.next_id())
+
+
+def parse(number):
+    """Return ``(timestamp in ms since the Unix epoch, node id, sequence)`` for an order number"""
+    value = decode(number)
+    return (
+        (value >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_MS,
+        (value >> SEQUENCE_BITS) & MAX_NODE_ID,
+        value & MAX_SEQUENCE,
+    )
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _generator, _generator_lock
+    _generator = None
+    _generator_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    # A forked worker must not share its parent's random node id or sequence
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_generator():
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                node_id = getattr(settings, 'CATALOG_NODE_ID', None)
+                if node_id is None:
+                    node_id = secrets.randbelow(MAX_NODE_ID + 1)
+                _generator = OrderNumberGenerator(int(node_id))
+    return _generator
+
+
+def next_order_number():
+    return get_generator().next_number()
@@ -0,0 +1,101 @@
+"""
+Read paths for a shopper's orders.
+
+Order lists show each order's line count and a thumbnail preview of its first
+lines. Both come from ``Order.items_summary``, written by checkout
+(catalog.services.place_order), so the order history page reads only the
+Order table. Orders placed before the summary existed are summarised on the
+fly from one prefetch per page; ``manage.py backfill_order_summaries`` stores
+their summaries for good.
+
+The order detail page prefetches its lines with just the columns it renders,
+plus each product's image fields for the thumbnails.
+"""
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch, prefetch_related_objects
+
+from .images import is_current, rendition_name
+from .models import Order, OrderItem
+
+PREVIEW_LINES = 3
+
+ITEM_COLUMNS = [
+    'id', 'order_id', 'product_id', 'product_name', 'price', 'quantity',
+    'product__id', 'product__name', 'product__image', 'product__image_renditions',
+]
+
+
+def thumbnail_name(product):
+    """Storage name of the product's smallest image, or '' if it has none"""
+    if not product.image:
+        return ''
+    if is_current(product):
+        renditions = product.image_renditions
+        return rendition_name(renditions['hash'], renditions['widths'][0], 'jpeg')
+    return product.image.name
+
+
+def build_summary(lines):
+    """``items_summary`` for ``(product, name, quantity)`` lines"""
+    return {
+        'lines': len(lines),
+        'units': sum(quantity for product, name, quantity in lines),
+        'preview': [
+            {'product_id': product.pk, 'name': name, 'quantity': quantity, 'thumbnail': thumbnail_name(product)}
+            for product, name, quantity in lines[:PREVIEW_LINES]
+        ],
+    }
+
+
+def preview(order):
+    """The summary's preview lines with their thumbnail URLs resolved"""
+    return [
+        {**line, 'thumbnail_url': default_storage.url(line['thumbnail']) if line['thumbnail'] else ''}
+        for line in order.items_summary.get('preview', [])
+    ]
+
+
+def items_prefetch():
+    return Prefetch(
+        'items',
+        queryset=OrderItem.objects.select_related('product').only(*ITEM_COLUMNS).order_by('id'),
+    )
+
+
+def summarize_items(order):
+    return build_summary([(item.product, item.product_name, item.quantity) for item in order.items.all()])
+
+
+def fill_summaries(orders):
+    """Summarise, in memory and with one query, the orders placed before summaries were stored"""
+    missing = [order for order in orders if not order.items_summary]
+    if missing:
+        prefetch_related_objects(missing, items_prefetch())
+        for order in missing:
+            order.items_summary = summarize_items(order)
+    for order in orders:
+        order.preview = preview(order)
+        order.more_lines = order.items_summary['lines'] - len(order.preview)
+    return orders
+
+
+def with_items(orders):
+    """``orders`` with their lines prefetched for the order detail page"""
+    return orders.prefetch_related(items_prefetch())
+
+
+def backfill_summaries(batch_size=500):
+    """Store summaries for orders that lack one, a batch at a time; yields the running total"""
+    total = 0
+    while True:
+        orders = list(
+            Order.objects.filter(items_summary={}).order_by('id')
+            .only('id', 'items_summary').prefetch_related(items_prefetch())[:batch_size]
+        )
+        if not orders:
+            return
+        for order in orders:
+            order.items_summary = summarize_items(order)
+        Order.objects.bulk_update(orders, ['items_summary'])
+        total += len(orders)
+        yield total
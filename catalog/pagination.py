@@ -0,0 +1,265 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` each page is fetched with a ``WHERE`` clause that
+continues from the last row of the previous page, so page 1000 costs the same
+as page 1. Pages are addressed by opaque cursor tokens rather than numbers;
+the ``?page=N`` links of the old numbered pagination are not understood and
+show the first page. Cursors come back from the browser, so each value is
+checked against the field (or annotation) it continues from before it
+reaches the query.
+
+EstimatedCountPaginator is a numbered Paginator for admin changelists of
+tables too large to ``COUNT(*)`` on every page view.
+"""
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+COUNT_CACHE_TIMEOUT = 60
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(json.JSONEncoder):
+    # Unlike DjangoJSONEncoder, keep full microsecond precision so the
+    # boundary row compares equal when the cursor is decoded
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        return super().default(o)
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, cls=CursorEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(data, dict) or not isinstance(data.get('v'), list):
+        raise InvalidCursor(token)
+    return data
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, start, has_next, has_previous, first_values, last_values):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.start = start
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._first_values = first_values
+        self._last_values = last_values
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def start_index(self):
+        return self.start + 1 if self.object_list else 0
+
+    def end_index(self):
+        return self.start + len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return encode_cursor({'d': 'n', 'v': self._last_values, 'i': self.end_index()})
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return encode_cursor({'d': 'p', 'v': self._first_values, 'i': self.start})
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` by its ordering columns.
+
+    The ordering defaults to the queryset's (or the model's Meta.ordering),
+    with ``-id`` appended as a tie-breaker so the key is unique. Set
+    ``count=False`` to skip the total row count entirely, or pass an int
+    when the caller already knows it; otherwise it is computed once and
+    cached for COUNT_CACHE_TIMEOUT seconds.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None, count=True):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.with_count = count is not False
+        if not isinstance(count, bool):
+            self._count = count
+        ordering = list(ordering or queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('-id')
+        self.ordering = ordering
+
+    @property
+    def count(self):
+        if not self.with_count:
+            return None
+        if not hasattr(self, '_count'):
+            query = self.queryset.order_by().values('pk')
+            sql, params = query.query.sql_with_params()
+            key = 'keyset-count:' + hashlib.md5(f'{query.db}:{sql}:{params}'.encode()).hexdigest()
+            self._count = cache.get(key)
+            if self._count is None:
+                self._count = self.queryset.count()
+                cache.set(key, self._count, COUNT_CACHE_TIMEOUT)
+        return self._count
+
+    @count.setter
+    def count(self, value):
+        """Supply a total the caller computed separately (e.g. concurrently with the page)"""
+        self.with_count = True
+        self._count = value
+
+    def _fields(self):
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    def _key_field(self, name):
+        """The model field or annotation output field ordering column ``name`` holds"""
+        try:
+            return self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            pass
+        annotation = self.queryset.query.annotations.get(name)
+        try:
+            return annotation.output_field if annotation is not None else None
+        except FieldError:
+            return None
+
+    def _to_python(self, name, value):
+        field = self._key_field(name)
+        if field is None or value is None or not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise InvalidCursor(value)
+        try:
+            return field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(value)
+
+    def _decode(self, cursor):
+        """``(direction, values, position)`` of a cursor made for this ordering"""
+        data = decode_cursor(cursor)
+        position = data.get('i', 0)
+        if len(data['v']) != len(self.ordering) or not isinstance(position, int) or isinstance(position, bool):
+            raise InvalidCursor(cursor)
+        values = [self._to_python(name, value) for (name, _), value in zip(self._fields(), data['v'])]
+        return data.get('d'), values, max(position, 0)
+
+    def _key_of(self, obj):
+        return [getattr(obj, name) for name, descending in self._fields()]
+
+    def _after(self, values, backwards):
+        """Filter selecting rows strictly after ``values`` in the (possibly reversed) ordering"""
+        condition = Q()
+        fields = self._fields()
+        for position, (name, descending) in enumerate(fields):
+            going_down = descending != backwards
+            step = Q(**{f'{name}__{"lt" if going_down else "gt"}': values[position]})
+            for earlier, (earlier_name, _) in enumerate(fields[:position]):
+                step &= Q(**{earlier_name: values[earlier]})
+            condition |= step
+        # The OR chain alone makes the database walk the index from its start;
+        # a range on the first column lets it seek straight to the cursor
+        first_name, first_descending = fields[0]
+        going_down = first_descending != backwards
+        return Q(**{f'{first_name}__{"lte" if going_down else "gte"}': values[0]}) & condition
+
+    def get_page(self, cursor=None):
+        """Return the page addressed by ``cursor``; bad or missing cursors give the first page"""
+        try:
+            direction, values, position = self._decode(cursor) if cursor else (None, None, 0)
+        except InvalidCursor:
+            values = None
+
+        if values is None:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            return self._page(rows, 0, has_next, False)
+
+        if direction == 'p':
+            reverse = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+            rows = list(self.queryset.filter(self._after(values, True)).order_by(*reverse)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return self._page(rows, max(position - len(rows), 0) if has_previous else 0, True, has_previous)
+
+        rows = list(self.queryset.filter(self._after(values, False)).order_by(*self.ordering)[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return self._page(rows, position, has_next, True)
+
+    def _page(self, rows, start, has_next, has_previous):
+        first = self._key_of(rows[0]) if rows else None
+        last = self._key_of(rows[-1]) if rows else None
+        return KeysetPage(rows, self, start, has_next, has_previous, first, last)
+
+
+def estimate_rows(queryset):
+    """Roughly how many rows the queryset's table has, without scanning it"""
+    model = queryset.model
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 or 0 until the table has been analyzed
+        if row and row[0] > 0:
+            return int(row[0])
+    return model._default_manager.using(queryset.db).aggregate(top=Max('pk'))['top'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that never counts more than ``exact_limit + 1`` rows.
+
+    Smaller results are counted exactly. Past the limit an unfiltered list
+    reports the table's estimated size (Postgres statistics, elsewhere the
+    highest id), while a filtered one reports ``exact_limit + 1`` rows, so
+    its later pages are reached by narrowing the filter.
+    """
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        exact = queryset.order_by().values('pk')[:self.exact_limit + 1].count()
+        if exact <= self.exact_limit or queryset.query.where:
+            return exact
+        return max(estimate_rows(queryset), exact)
@@ -0,0 +1,155 @@
+"""
+Time-limited stock holds for cart lines.
+
+Putting units in a cart holds them for ``CATALOG_RESERVATION_TTL`` seconds so
+they cannot be sold to someone else while the shopper checks out. Each
+product keeps a running ``reserved`` counter next to ``stock``, and a hold is
+taken with one conditional UPDATE of that product's row
+(``reserved + n <= stock``): shoppers only contend on the SKUs they are
+buying, never on a store-wide lock, and availability (``stock - reserved``)
+comes from the product row that listings and carts already load.
+
+Expired holds are handed back in batches by ``release_expired()``
+(``manage.py sweep_reservations``); checkout turns a cart's holds into a
+stock decrement (catalog.services.place_order). Cached pages are only
+invalidated when a product sells out or comes back, so their "N available"
+counts may lag by up to the cache timeout.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, PositiveIntegerField, Q, Subquery, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .caching import bump_for_products
+from .models import Product, StockReservation
+from .services import OutOfStockError
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, 'CATALOG_RESERVATION_TTL', 900))
+
+
+def adjust_reserved(deltas):
+    """
+    Add ``{product_id: delta}`` to the products' reserved counters in one UPDATE.
+
+    Increases only apply to active products with enough unreserved stock;
+    returns the number of products changed.
+    """
+    return Product.objects.filter(
+        Q(*[
+            Q(id=pid, is_active=True, stock__gte=F('reserved') + delta) if delta > 0 else Q(id=pid)
+            for pid, delta in deltas.items()
+        ], _connector=Q.OR),
+    ).update(
+        reserved=Case(
+            *[When(id=pid, then=Greatest(F('reserved') + delta, Value(0))) for pid, delta in deltas.items()],
+            default=F('reserved'),
+            output_field=PositiveIntegerField(),
+        ),
+    )
+
+
+def bump_sold_out_changes(before, deltas):
+    """
+    Invalidate cached pages of products that ``deltas`` sells out or brings back.
+
+    ``before`` is what read_counters() returned before the change.
+    """
+    category_ids = {
+        category_id for pid, (stock, reserved, category_id, held) in before.items()
+        if pid in deltas and (stock <= reserved) != (stock <= reserved + deltas[pid])
+    }
+    if category_ids:
+        transaction.on_commit(lambda: bump_for_products(category_ids))
+
+
+def read_counters(product_ids, cart=None):
+    """
+    Return ``{product_id: (stock, reserved, category_id, held)}``, ``held``
+    being what ``cart`` already holds of the product.
+    """
+    held = StockReservation.objects.filter(cart=cart, product=OuterRef('pk')).values('quantity')
+    return {
+        pid: (stock, reserved, category_id, held or 0)
+        for pid, stock, reserved, category_id, held in Product.objects.filter(id__in=product_ids)
+        .order_by().values_list('id', 'stock', 'reserved', 'category_id', Subquery(held))
+    }
+
+
+def hold(cart, quantities):
+    """
+    Make the cart's holds match ``{product_id: quantity}`` (0 releases).
+
+    Each changed hold runs for a full TTL from now. Raises OutOfStockError
+    when an increase cannot be covered; call it inside the transaction that
+    changes the cart lines, after writing them (their row locks keep two
+    requests from adjusting the same hold at once), so that error rolls the
+    whole change back.
+    """
+    before = read_counters(quantities, cart)
+    deltas = {
+        pid: quantity - before[pid][3]
+        for pid, quantity in quantities.items()
+        if pid in before and quantity != before[pid][3]
+    }
+    if not deltas:
+        return
+    if adjust_reserved(deltas) != len(deltas):
+        raise OutOfStockError([
+            product for product in Product.objects.filter(id__in=[pid for pid, delta in deltas.items() if delta > 0])
+            .only('id', 'name', 'is_active')
+            if not product.is_active or before[product.id][0] - before[product.id][1] < deltas[product.id]
+        ])
+    bump_sold_out_changes(before, deltas)
+
+    expires_at = timezone.now() + get_ttl()
+    upserts = [
+        StockReservation(cart=cart, product_id=pid, quantity=quantities[pid], expires_at=expires_at)
+        for pid in deltas
+        if quantities[pid] > 0
+    ]
+    if upserts:
+        StockReservation.objects.bulk_create(
+            upserts, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity', 'expires_at'],
+        )
+    released = [pid for pid in deltas if quantities[pid] == 0]
+    if released:
+        StockReservation.objects.filter(cart=cart, product_id__in=released).delete()
+
+
+def release_expired(batch_size=500, now=None):
+    """Hand back up to ``batch_size`` expired holds; returns how many were released"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Holds a checkout has locked are skipped; it is about to consume them
+        expired = list(
+            StockReservation.objects.select_for_update(skip_locked=True)
+            .filter(expires_at__lte=now)
+            .order_by('expires_at')
+            .values_list('id', 'product_id', 'quantity')[:batch_size]
+        )
+        if not expired:
+            return 0
+        deltas = {}
+        for reservation_id, pid, quantity in expired:
+            deltas[pid] = deltas.get(pid, 0) - quantity
+        before = read_counters(deltas)
+        StockReservation.objects.filter(id__in=[row[0] for row in expired]).delete()
+        adjust_reserved(deltas)
+        bump_sold_out_changes(before, deltas)
+    return len(expired)
+
+
+def release_all_expired(batch_size=500):
+    """Release expired holds batch by batch until none are left"""
+    total = 0
+    now = timezone.now()
+    while True:
+        released = release_expired(batch_size, now)
+        total += released
+        if released < batch_size:
+            return total
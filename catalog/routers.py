@@ -0,0 +1,140 @@
+"""
+Read-replica routing for catalog browsing.
+
+Views decorated with ``@replica_reads`` (home, product listings, product
+detail) pick one alias from CATALOG_READ_REPLICAS per request: round-robin,
+or with CATALOG_REPLICA_SELECTION = 'least_loaded' the replica with the
+fewest such requests in flight in this process. While the view runs,
+ReplicaRouter sends reads of the catalog models in REPLICA_MODELS there.
+Sessions, users, carts and orders, every write, reads inside a transaction
+and reads after the request has written all stay on ``default``.
+
+Replicas lag the primary. Pages that catalog.caching is about to store for
+every anonymous visitor are rendered inside ``primary_reads()``, so a
+replica's stale copy is never cached past the replica's lag. And
+ReplicaStickinessMiddleware gives a browser that has just written (any POST:
+add to cart, checkout, login, ...) a cookie that keeps its reads on the
+primary for CATALOG_REPLICA_STICKY_SECONDS, so it sees its own changes on
+the next pages.
+"""
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_MODELS = {'catalog.Category', 'catalog.Product'}
+
+STICKY_COOKIE = 'catalog_primary'
+
+_current = ContextVar('catalog_replica', default=None)
+_primary_only = ContextVar('catalog_primary_only', default=False)
+
+_lock = threading.Lock()
+_turns = itertools.count()
+_in_flight = Counter()
+
+
+def get_replicas():
+    return getattr(settings, 'CATALOG_READ_REPLICAS', [])
+
+
+def choose_replica(replicas):
+    """Pick a replica for one request and count it in flight until release_replica()"""
+    with _lock:
+        start = next(_turns) % len(replicas)
+        rotated = replicas[start:] + replicas[:start]
+        if getattr(settings, 'CATALOG_REPLICA_SELECTION', 'round_robin') == 'least_loaded':
+            # min() keeps the first of equally loaded replicas, so ties still rotate
+            alias = min(rotated, key=lambda alias: _in_flight[alias])
+        else:
+            alias = rotated[0]
+        _in_flight[alias] += 1
+    return alias
+
+
+def release_replica(alias):
+    with _lock:
+        _in_flight[alias] -= 1
+
+
+class ReplicaReads:
+    """The replica a request reads from, until it writes"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.wrote = False
+
+
+@contextmanager
+def primary_reads():
+    """Keep ``@replica_reads`` views called inside the block on the primary"""
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+@contextmanager
+def reading_from_replica(request):
+    """Route the catalog reads made inside the block to a replica, unless ``request`` must see the primary"""
+    replicas = get_replicas()
+    if (
+        not replicas or _primary_only.get()
+        or request.method not in ('GET', 'HEAD') or STICKY_COOKIE in request.COOKIES
+    ):
+        yield None
+        return
+    reads = ReplicaReads(choose_replica(replicas))
+    token = _current.set(reads)
+    try:
+        yield reads
+    finally:
+        _current.reset(token)
+        release_replica(reads.alias)
+
+
+def replica_reads(view_func):
+    """Serve the catalog reads of a read-only view from a replica; works on sync and async views"""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            with reading_from_replica(request):
+                return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with reading_from_replica(request):
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        reads = _current.get()
+        if reads is None or reads.wrote or model._meta.label not in REPLICA_MODELS:
+            return None
+        # Uncommitted rows (ATOMIC_REQUESTS, tests) are only on the primary
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return reads.alias
+
+    def db_for_write(self, model, **hints):
+        reads = _current.get()
+        if reads is not None:
+            reads.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
@@ -0,0 +1,250 @@
+"""
+Full-text product search.
+
+Products are indexed into a side table that holds the product name, description
+and category name. SQLite uses an FTS5 virtual table, PostgreSQL a tsvector
+column with a GIN index. Any other database falls back to icontains scans.
+
+The index is kept up to date from the Product/Category signals in
+``catalog.signals`` and can be rebuilt with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+FTS_TABLE = 'catalog_product_fts'
+TSVECTOR_TABLE = 'catalog_product_search'
+
+# Column weights used for relevance: a hit in the name counts more than a
+# hit in the category name, which counts more than one in the description.
+NAME_WEIGHT = 10.0
+CATEGORY_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search string into lowercase word tokens"""
+    return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+class BaseSearchBackend:
+    """Interface shared by all search backends"""
+
+    def __init__(self, using):
+        self.using = using
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def index_products(self, products):
+        """Add or refresh the index entries for the given products"""
+        raise NotImplementedError
+
+    def remove_products(self, product_ids):
+        """Drop the index entries for the given product ids"""
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Rebuild the whole index from the Product table"""
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        """Filter ``queryset`` to products matching ``query``, best match first"""
+        raise NotImplementedError
+
+    def index_product(self, product):
+        self.index_products([product])
+
+    def remove_product(self, product_id):
+        self.remove_products([product_id])
+
+    def _rows(self, products):
+        # The category name is looked up by the INSERT itself, so indexing a
+        # product never loads its category
+        return [
+            (product.pk, product.name, product.description, product.category_id)
+            for product in products
+        ]
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Unindexed fallback that scans name and description with icontains"""
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        for token in tokens:
+            queryset = queryset.filter(
+                Q(name__icontains=token) |
+                Q(description__icontains=token) |
+                Q(category__name__icontains=token)
+            )
+        return queryset
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """SQLite FTS5 inverted index ranked with bm25"""
+
+    def index_products(self, products):
+        rows = self._rows(products)
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(row[0],) for row in rows],
+            )
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) '
+                f'SELECT %s, %s, %s, c.name FROM catalog_category c WHERE c.id = %s',
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(product_id,) for product_id in product_ids],
+            )
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) '
+                f'SELECT p.id, p.name, p.description, c.name '
+                f'FROM catalog_product p JOIN catalog_category c ON c.id = p.category_id'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+    def match_expression(self, query):
+        # Quote every token so FTS5 operators in user input are taken
+        # literally, and prefix-match so results appear while typing.
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT bm25({FTS_TABLE}, %s, %s, %s) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+                (NAME_WEIGHT, DESCRIPTION_WEIGHT, CATEGORY_WEIGHT, match),
+                output_field=FloatField(),
+            )
+        ).order_by('search_rank', '-created_at', '-id')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """PostgreSQL tsvector index with a GIN index, ranked with ts_rank"""
+
+    config = 'english'
+
+    def _document_sql(self):
+        return (
+            f"setweight(to_tsvector('{self.config}', coalesce(%s, '')), 'A') || "
+            f"setweight(to_tsvector('{self.config}', coalesce(%s, '')), 'B') || "
+            f"setweight(to_tsvector('{self.config}', coalesce(%s, '')), 'D')"
+        )
+
+    def index_products(self, products):
+        rows = self._rows(products)
+        if not rows:
+            return
+        document = self._document_sql() % ('%s', 'c.name', '%s')
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {TSVECTOR_TABLE} (product_id, document) '
+                f'SELECT %s, {document} FROM catalog_category c WHERE c.id = %s '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {TSVECTOR_TABLE} WHERE product_id = ANY(%s)',
+                (list(product_ids),),
+            )
+
+    def rebuild(self):
+        document = self._document_sql() % ('p.name', 'c.name', 'p.description')
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {TSVECTOR_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {TSVECTOR_TABLE} (product_id, document) '
+                f'SELECT p.id, {document} '
+                f'FROM catalog_product p JOIN catalog_category c ON c.id = p.category_id'
+            )
+
+    def tsquery_expression(self, query):
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    def search(self, queryset, query):
+        tsquery = self.tsquery_expression(query)
+        if not tsquery:
+            return queryset
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT product_id FROM {TSVECTOR_TABLE} "
+                f"WHERE document @@ to_tsquery('{self.config}', %s)",
+                (tsquery,),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT -ts_rank(document, to_tsquery('{self.config}', %s)) "
+                f"FROM {TSVECTOR_TABLE} WHERE product_id = \"{table}\".\"id\"",
+                (tsquery,),
+                output_field=FloatField(),
+            )
+        ).order_by('search_rank', '-created_at', '-id')
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=None):
+    """
+    Return the search backend for a database alias.
+
+    ``settings.CATALOG_SEARCH_BACKEND`` may name a backend class by dotted
+    path; otherwise one is picked from the database vendor.
+    """
+    if using is None:
+        using = router.db_for_read(Product)
+    backend_path = getattr(settings, 'CATALOG_SEARCH_BACKEND', None)
+    if backend_path:
+        backend_class = import_string(backend_path)
+    else:
+        backend_class = VENDOR_BACKENDS.get(connections[using].vendor, SimpleSearchBackend)
+    return backend_class(using)
+
+
+def search_products(queryset, query):
+    """Filter and rank a Product queryset by a free-text query"""
+    return get_search_backend(queryset.db).search(queryset, query)
@@ -0,0 +1,122 @@
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+
+from . import tasks
+from .caching import bump_for_products, bump_product_pages
+from .jobs import enqueue
+from .models import CartItem, OrderItem, Product, StockReservation
+from .orders import build_summary
+
+
+class OutOfStockError(Exception):
+    """Raised when a cart asks for more units than a product has in stock"""
+
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products) or 'some items in your cart'
+        super().__init__(f'Not enough stock for: {names}')
+
+
+def place_order(cart, order):
+    """
+    Turn ``cart`` into ``order`` in a single transaction.
+
+    ``order`` is an unsaved Order with its user and shipping details set.
+    Products are locked in id order so concurrent checkouts cannot deadlock,
+    stock is decremented with one conditional UPDATE and all order items are
+    inserted with one bulk_create, so the query count does not grow with the
+    number of cart lines. Confirmation email and stock alerts are queued as
+    jobs (catalog.tasks) rather than sent here. The cart's stock holds
+    (catalog.reservations) are consumed by the same UPDATE; lines whose hold
+    expired are filled from unreserved stock. Raises OutOfStockError and rolls back if any line
+    cannot be filled.
+    """
+    with transaction.atomic():
+        quantities = dict(
+            CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')
+        )
+        # Locking the holds keeps the expiry sweeper from releasing them meanwhile
+        held = dict(
+            StockReservation.objects.select_for_update()
+            .filter(cart=cart, product_id__in=quantities).values_list('product_id', 'quantity')
+        )
+        products = list(
+            Product.objects.select_for_update()
+            .filter(id__in=quantities)
+            .order_by('id')
+            .only('id', 'name', 'price', 'stock', 'reserved', 'is_active', 'category_id', 'image', 'image_renditions')
+        )
+
+        short = [
+            product for product in products
+            if not product.is_active
+            or product.stock - product.reserved + held.get(product.id, 0) < quantities[product.id]
+        ]
+        if short or len(products) != len(quantities):
+            raise OutOfStockError(short)
+
+        updated = Product.objects.filter(
+            Q(is_active=True),
+            Q(*[
+                Q(id=pid, stock__gte=F('reserved') + qty - held.get(pid, 0))
+                for pid, qty in quantities.items()
+            ], _connector=Q.OR),
+        ).update(
+            stock=Case(
+                *[When(id=pid, then=F('stock') - qty) for pid, qty in quantities.items()],
+                default=F('stock'),
+                output_field=PositiveIntegerField(),
+            ),
+            reserved=Case(
+                *[When(id=pid, then=F('reserved') - qty) for pid, qty in held.items()],
+                default=F('reserved'),
+                output_field=PositiveIntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        if updated != len(quantities):
+            raise OutOfStockError(products)
+
+        order.total_amount = sum(product.price * quantities[product.id] for product in products)
+        order.items_summary = build_summary([(product, product.name, quantities[product.id]) for product in products])
+        order.save()
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=product,
+                product_name=product.name,
+                price=product.price,
+                quantity=quantities[product.id],
+            )
+            for product in products
+        ])
+
+        StockReservation.objects.filter(cart=cart, product_id__in=held).delete()
+        cart.delete()
+
+        # Queued in this transaction, so they only run if the order commits
+        enqueue(tasks.send_order_confirmation, order_id=order.pk)
+        # Only the order that takes a product to the threshold alerts, not every later one
+        threshold = tasks.low_stock_threshold()
+        crossed = sorted(
+            product.id for product in products
+            if product.stock - quantities[product.id] <= threshold < product.stock
+        )
+        if crossed:
+            enqueue(tasks.alert_low_stock, product_ids=crossed)
+
+        # The products' own pages show how many are available. Listings only
+        # show whether a product is in stock, so they are only invalidated
+        # for products this order sells out.
+        sold_out = {
+            product.category_id for product in products
+            if product.stock - product.reserved - quantities[product.id] + held.get(product.id, 0) <= 0
+            < product.stock - product.reserved
+        }
+        transaction.on_commit(lambda: bump_product_pages(quantities))
+        if sold_out:
+            transaction.on_commit(lambda: bump_for_products(sold_out))
+
+    return order
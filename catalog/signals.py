@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import analytics, images
+from .caching import bump, bump_carts, bump_for_products, bump_product_pages, forget_product_category
+from .jobs import enqueue
+from .middleware import install_query_hook
+from .models import Cart, Category, Order, Product
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, using=None, **kwargs):
+    """Keep the search index in step with product edits"""
+    if raw:
+        return
+    get_search_backend(using).index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def refresh_cart_totals(sender, instance, created=False, raw=False, using=None, **kwargs):
+    """A price change alters the stored subtotal of every cart holding the product"""
+    if raw or created:
+        return
+    Cart.objects.using(using).filter(items__product=instance).update_totals()
+
+
+@receiver(post_save, sender=Product)
+def queue_image_renditions(sender, instance, raw=False, **kwargs):
+    """Start resizing a newly uploaded image as soon as the product is committed"""
+    if raw or not instance.image or images.is_current(instance):
+        return
+    transaction.on_commit(lambda: images.schedule(instance))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using=None, **kwargs):
+    get_search_backend(using).remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, using=None, **kwargs):
+    """Renaming a category changes the indexed text of all its products"""
+    if raw or created:
+        return
+    products = Product.objects.using(using).filter(category=instance).only('id', 'name', 'description', 'category_id')
+    get_search_backend(using).index_products(products.iterator(chunk_size=1000))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_pages(sender, instance, **kwargs):
+    # The product may have moved category
+    forget_product_category(instance.pk)
+    bump_for_products([instance.category_id])
+    bump_product_pages([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_pages(sender, instance, **kwargs):
+    bump('categories', f'category:{instance.pk}')
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def invalidate_cart_summaries(sender, instance, created=True, raw=False, using=None, **kwargs):
+    """A cart created or checked out elsewhere changes the user's navbar summary"""
+    # post_delete sends no ``created``; changes to a saved cart go through update_totals()
+    if raw or not created:
+        return
+    transaction.on_commit(lambda: bump_carts([instance.user_id]), using=using)
+
+
+@receiver(post_save, sender=Order)
+def queue_sales_rollup(sender, instance, raw=False, **kwargs):
+    """New orders and status changes reach the sales rollups through the job queue"""
+    if raw:
+        return
+    enqueue(analytics.sync_order, order_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_from_sales_rollups(sender, instance, **kwargs):
+    # Runs before the cascade removes the order's items
+    if instance.in_sales_rollups:
+        analytics.add_to_rollups(analytics.order_rows(instance, -1))
+
+
+@receiver(connection_created)
+def track_connection_queries(sender, connection, **kwargs):
+    """Let QueryStats see queries on connections opened by any thread"""
+    install_query_hook(connection)
@@ -0,0 +1,60 @@
+"""
+Static files storage that fingerprints and precompresses at build time.
+
+collectstatic with CompressedManifestStaticFilesStorage stores each file
+under a content-hashed name (``css/shophub.3c2f1e0a9b7d.css``, listed in
+``staticfiles.json``) and writes a ``.gz`` copy and, when the optional
+``brotli`` package is installed, a ``.br`` copy beside every hashed text
+file, so StaticFilesMiddleware never compresses per request.
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.xml', '.html', '.ico', '.ttf')
+
+# Smaller files gain nothing worth the extra lookup
+MIN_COMPRESS_SIZE = 256
+
+
+def encoders():
+    """``(suffix, compress)`` for each encoding available here"""
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self.compress(name)
+
+    def compress(self, name):
+        """Write the compressed copies of ``name`` that are worth keeping; returns their names"""
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return []
+
+        written = []
+        for suffix, compress in encoders():
+            # Hashed names are content-addressed: an existing copy is current
+            if self.exists(name + suffix):
+                written.append(name + suffix)
+                continue
+            compressed = compress(data)
+            if len(compressed) < len(data) * 0.95:
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written.append(name + suffix)
+        return written
@@ -0,0 +1,49 @@
+"""
+Background tasks run by the job queue (catalog.jobs) instead of in the request.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, mail_admins, send_mail
+from django.template.loader import render_to_string
+
+from .jobs import task
+from .models import Order, Product
+
+
+@task
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').prefetch_related('items').filter(pk=order_id).first()
+    if order is None or not order.user.email:
+        return
+    send_mail(
+        f'Your ShopHub order {order.order_number}',
+        render_to_string('catalog/emails/order_confirmation.txt', {'order': order}),
+        None,
+        [order.user.email],
+    )
+
+
+def low_stock_threshold():
+    return getattr(settings, 'CATALOG_LOW_STOCK_THRESHOLD', 5)
+
+
+@task
+def alert_low_stock(product_ids):
+    """Tell the admins which products an order just took down to the low-stock threshold"""
+    # Restocked since the order was placed: no longer worth an alert
+    products = list(
+        Product.objects.filter(id__in=product_ids, is_active=True, stock__lte=low_stock_threshold())
+        .order_by('stock').only('id', 'name', 'stock')
+    )
+    if products:
+        lines = '\n'.join(f'#{product.id} {product.name}: {product.stock} left' for product in products)
+        mail_admins(f'{len(products)} product(s) low on stock', lines)
+
+
+@task
+def send_contact_message(name, email, subject, message):
+    EmailMessage(
+        f'[Contact] {subject}',
+        f'From: {name} <{email}>\n\n{message}',
+        to=[getattr(settings, 'CATALOG_CONTACT_EMAIL', settings.DEFAULT_FROM_EMAIL)],
+        reply_to=[email],
+    ).send()
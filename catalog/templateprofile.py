@@ -0,0 +1,115 @@
+"""
+Per-request template render timings.
+
+While a TemplateProfile block is active, every template render, ``{% block %}``
+and ``{% include %}`` is timed. Each entry records its call count, its
+inclusive time, and its own time (inclusive minus whatever rendered nested
+inside it), so the expensive part of a page shows up even when it is buried
+under ``base.html``. TemplateProfileMiddleware turns this on per request when
+``CATALOG_TEMPLATE_PROFILE`` is set.
+
+Timing hooks are patched into the template classes the first time a profile
+starts. While no profile is active they cost one ContextVar lookup per render.
+"""
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.template.base import Template
+from django.template.loader_tags import BlockNode, IncludeNode
+
+_active_profiles = ContextVar('catalog_template_profiles', default=())
+
+
+def _timed(kind, name_of, render):
+    @wraps(render)
+    def wrapper(self, context, *args, **kwargs):
+        profiles = _active_profiles.get()
+        if not profiles:
+            return render(self, context, *args, **kwargs)
+        name = name_of(self, context)
+        for profile in profiles:
+            profile._enter()
+        start = time.perf_counter()
+        try:
+            return render(self, context, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            for profile in profiles:
+                profile._exit(kind, name, elapsed)
+    wrapper.profiled = True
+    return wrapper
+
+
+def _template_name(template, context):
+    return template.origin.template_name or template.name or '<string>'
+
+
+def _block_name(node, context):
+    origin = getattr(node, 'origin', None)
+    return f'{origin.template_name if origin else "?"}:{node.name}'
+
+
+def _include_name(node, context):
+    template = node.template.resolve(context)
+    return getattr(template, 'name', None) or str(template)
+
+
+def install():
+    """Wrap the template render methods with timing hooks (once)"""
+    for cls, method, kind, name_of in (
+        (Template, '_render', 'template', _template_name),
+        (BlockNode, 'render', 'block', _block_name),
+        (IncludeNode, 'render', 'include', _include_name),
+    ):
+        # Checked on the method rather than a module flag: the test runner
+        # swaps Template._render out and back in around the test run
+        current = getattr(cls, method)
+        if not getattr(current, 'profiled', False):
+            setattr(cls, method, _timed(kind, name_of, current))
+
+
+class TemplateProfile:
+    """
+    Collect render timings of the templates rendered while the block is active::
+
+        with TemplateProfile() as profile:
+            client.get('/')
+        profile.entries[('template', 'catalog/base.html')]  # [calls, total, own]
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.duration = 0.0
+        self._children = []
+        self._token = None
+
+    def __enter__(self):
+        install()
+        self._token = _active_profiles.set((*_active_profiles.get(), self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_profiles.reset(self._token)
+
+    def _enter(self):
+        self._children.append(0.0)
+
+    def _exit(self, kind, name, elapsed):
+        nested = self._children.pop()
+        if self._children:
+            self._children[-1] += elapsed
+        else:
+            self.duration += elapsed
+        entry = self.entries.setdefault((kind, name), [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += elapsed - nested
+
+    @property
+    def rows(self):
+        """``(kind, name, calls, total, own)`` tuples, most own time first"""
+        return sorted(
+            ((kind, name, calls, total, own) for (kind, name), (calls, total, own) in self.entries.items()),
+            key=lambda row: row[4], reverse=True,
+        )
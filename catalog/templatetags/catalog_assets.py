@@ -0,0 +1,21 @@
+from django import template
+
+from ..assets import asset_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def vendor_asset(name):
+    """
+    URL of a third-party asset listed in catalog.assets.VENDOR_ASSETS.
+
+    Usage::
+
+        {% load catalog_assets %}
+        <link href="{% vendor_asset 'bootstrap.css' %}" rel="stylesheet">
+
+    Points at the self-hosted copy once ``manage.py build_static`` has
+    downloaded it, and at the pinned CDN URL until then.
+    """
+    return asset_url(name)
@@ -0,0 +1,125 @@
+from django import template
+from django.middleware.csrf import get_token
+from django.utils.safestring import mark_safe
+
+from ..caching import (
+    FRAGMENT_SCOPES, get_cache, get_timeout, get_versions, make_key, record, restore_csrf, strip_csrf,
+)
+
+register = template.Library()
+
+PRODUCT_CARD_TEMPLATE = 'catalog/includes/product_card.html'
+
+# Card layout -> words of the product description shown on the card
+CARD_DESCRIPTION_WORDS = {
+    'listing': 20,
+    # The home page's featured grid is denser
+    'featured': 15,
+}
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        vary_on = [value.resolve(context) for value in self.vary_on]
+        scopes = FRAGMENT_SCOPES[name](*vary_on) if name in FRAGMENT_SCOPES else []
+        key = make_key('fragment', name, vary_on, scopes)
+        cache = get_cache()
+
+        content = cache.get(key)
+        if content is None:
+            record(f'fragment:{name}', False)
+            content = self.nodelist.render(context)
+            cache.set(key, strip_csrf(content), get_timeout())
+            return content
+
+        record(f'fragment:{name}', True)
+        return mark_safe(restore_csrf(content, context.get('request')))
+
+
+@register.tag
+def cachefragment(parser, token):
+    """
+    Cache the enclosed template fragment, versioned by catalog signals.
+
+    Usage::
+
+        {% load catalog_cache %}
+        {% cachefragment "product_card" product.pk product.updated_at %}
+            ...
+        {% endcachefragment %}
+
+    The first argument names the fragment; its scopes are looked up in
+    catalog.caching.FRAGMENT_SCOPES. Remaining arguments vary the key.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires at least a fragment name.")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return CacheFragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, layout='listing'):
+    """
+    Render a listing's product cards, each cached as a "product_card" fragment.
+
+    Usage::
+
+        {% load catalog_cache %}
+        {% product_cards page_obj "listing" %}
+
+    ``layout`` picks the description length from CARD_DESCRIPTION_WORDS.
+
+    Same output as a ``{% cachefragment %}`` around an include of
+    catalog/includes/product_card.html per product, but the cached cards are
+    read with one ``get_many`` and the missing ones rendered from the one
+    compiled card template and stored with one ``set_many``, so a page costs
+    a handful of cache round trips however many cards it has.
+    """
+    products = list(products)
+    if not products:
+        return ''
+    words = CARD_DESCRIPTION_WORDS[layout]
+    cache = get_cache()
+    scopes = FRAGMENT_SCOPES['product_card']()
+    versions = get_versions(scopes)
+    keys = [
+        make_key('fragment', 'product_card', [product.pk, product.updated_at, words], scopes, versions)
+        for product in products
+    ]
+    found = cache.get_many(keys)
+    request = context.get('request')
+    token = None
+    card = None
+
+    html = []
+    missing = {}
+    for product, key in zip(products, keys):
+        content = found.get(key)
+        if content is None:
+            card = card or context.template.engine.get_template(PRODUCT_CARD_TEMPLATE)
+            with context.push(product=product, words=words):
+                content = card.render(context)
+            missing[key] = strip_csrf(content)
+        else:
+            # One token for the whole grid, as {% csrf_token %} does within a page
+            token = token or get_token(request)
+            content = restore_csrf(content, request, token)
+        html.append(content)
+
+    if missing:
+        cache.set_many(missing, get_timeout())
+    record('fragment:product_card', True, len(products) - len(missing))
+    record('fragment:product_card', False, len(missing))
+    return mark_safe(''.join(html))
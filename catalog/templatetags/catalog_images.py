@@ -0,0 +1,40 @@
+from django import template
+from django.utils.html import format_html
+
+from ..images import SIZES, is_current, rendition_url, schedule, srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, size='card', css_class='', style=''):
+    """
+    Render a responsive ``<picture>`` for a product image.
+
+    Usage::
+
+        {% load catalog_images %}
+        {% product_image product "card" css_class="card-img-top" %}
+
+    ``size`` picks the ``sizes`` attribute from catalog.images.SIZES. Until
+    the product's renditions exist the original image is used and the
+    renditions are queued in the background.
+    """
+    if not is_current(product):
+        schedule(product)
+        return format_html(
+            '<img src="{}" class="{}" style="{}" alt="{}" loading="lazy" decoding="async">',
+            product.image.url, css_class, style, product.name,
+        )
+
+    renditions = product.image_renditions
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" style="{}" alt="{}" '
+        'loading="lazy" decoding="async">'
+        '</picture>',
+        srcset(product, 'webp'), SIZES[size],
+        rendition_url(product, renditions['widths'][-1], 'jpeg'), srcset(product, 'jpeg'), SIZES[size],
+        renditions['width'], renditions['height'], css_class, style, product.name,
+    )
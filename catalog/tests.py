@@ -1,3 +1,1698 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+
+from . import api_urls, urls as catalog_urls
+from .assets import VENDOR_ASSETS, VendorError, asset_url, vendor
+from .middleware import QueryStats, ReplicaStickinessMiddleware, StaticFilesMiddleware, fingerprint
+from .templateprofile import TemplateProfile
+from .models import Cart, CartItem, Category, Job, Order, OrderItem, Product, SalesRollup, StockReservation
+from .caching import bump, get_stats
+from .cart import add_item, remove_item, set_item_quantity
+from .datagen import SyntheticDataGenerator
+from .facets import compute_facets
+from .images import process_product, rendition_name
+from .jobs import claim, enqueue, requeue_stale, run_pending, task
+from .ordernumbers import MAX_SEQUENCE, OrderNumberGenerator, parse
+from .pagination import EstimatedCountPaginator, KeysetPaginator, decode_cursor, encode_cursor
+from .reservations import release_all_expired
+from .routers import STICKY_COOKIE, choose_replica, release_replica
+from .search import get_search_backend, search_products
+from .services import OutOfStockError, place_order
+
+
+def new_order(user):
+    """An unsaved Order with shipping details, ready for place_order()"""
+    return Order(
+        user=user, shipping_address='1 Main St', shipping_city='Springfield', shipping_state='IL',
+        shipping_zip_code='62701', shipping_country='US', phone_number='555-0100',
+    )
+
+
+def seed_catalog(categories=10, products_per_category=50, orders=15, lines_per_order=5, cart_lines=20):
+    """Create a catalog large enough for N+1 queries to stand out"""
+    Category.objects.bulk_create(
+        Category(name=f'Category {i}', description=f'Things of kind {i}') for i in range(categories)
+    )
+    category_list = list(Category.objects.all())
+    Product.objects.bulk_create(
+        Product(
+            name=f'Product {c}-{i}',
+            category=category,
+            price=Decimal('9.99') + i,
+            description=f'A sturdy widget number {i} in {category.name}',
+            stock=100,
+        )
+        for c, category in enumerate(category_list)
+        for i in range(products_per_category)
+    )
+    get_search_backend().rebuild()
+    product_list = list(Product.objects.order_by('id'))
+
+    user = User.objects.create_user('shopper', 'shopper@example.com', 'secret-pass')
+    cart = Cart.objects.create(user=user)
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, product=product, quantity=2) for product in product_list[:cart_lines]
+    )
+    cart.update_totals()
+
+    for n in range(orders):
+        order = Order.objects.create(
+            user=user, total_amount=Decimal('50.00'), shipping_address='1 Main St',
+            shipping_city='Springfield', shipping_state='IL', shipping_zip_code='62701',
+            shipping_country='US', phone_number='555-0100',
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, product_name=product.name, price=product.price, quantity=1)
+            for product in product_list[n * lines_per_order:(n + 1) * lines_per_order]
+        )
+    return user, cart
+
+
+class QueryStatsTests(TestCase):
+    def test_fingerprint_ignores_parameters(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 1 AND name = 'a'"),
+            fingerprint("SELECT * FROM t WHERE id = 22 AND name = 'bb'"),
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+        )
+
+    def test_records_count_and_duplicates(self):
+        with QueryStats() as stats:
+            list(Category.objects.filter(id=1))
+            list(Category.objects.filter(id=2))
+            list(Product.objects.all()[:1])
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(list(stats.duplicates.values()), [2])
+
+    @override_settings(QUERY_STATS_HEADERS=True)
+    def test_middleware_sets_headers(self):
+        response = self.client.get(reverse('catalog:about'))
+        self.assertEqual(response['X-DB-Query-Count'], '0')
+        self.assertIn('X-DB-Time-Ms', response)
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every catalog URL must render within a fixed number of queries.
+
+    The budgets hold regardless of catalog size, so an N+1 introduced in a
+    view or template fails here. Add a budget when adding a URL.
+    """
+
+    # url name -> (method, maximum queries, logged in)
+    BUDGETS = {
+        'home': ('get', 2, False),
+        'product_list': ('get', 3, False),
+        # One more the first time a product is shown: its category is looked up for the page cache key
+        'product_detail': ('get', 3, False),
+        'category_products': ('get', 3, False),
+        'register': ('get', 0, False),
+        'login': ('get', 0, False),
+        'logout': ('get', 4, True),
+        'cart': ('get', 4, True),
+        'add_to_cart': ('post', 18, True),
+        'update_cart_item': ('post', 14, True),
+        'remove_from_cart': ('post', 14, True),
+        'checkout': ('get', 4, True),
+        'order_confirmation': ('get', 4, True),
+        'order_history': ('get', 5, True),
+        'order_detail': ('get', 4, True),
+        'reorder': ('post', 18, True),
+        'about': ('get', 0, False),
+        'contact': ('get', 0, False),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog()
+        cls.product = Product.objects.order_by('-id').first()
+        cls.order = Order.objects.order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def url_for(self, name):
+        kwargs = {}
+        if name in ('product_detail', 'add_to_cart'):
+            kwargs = {'product_id': self.product.id}
+        elif name == 'category_products':
+            kwargs = {'category_id': self.product.category_id}
+        elif name in ('update_cart_item', 'remove_from_cart'):
+            kwargs = {'item_id': self.cart.items.order_by('id').first().id}
+        elif name in ('order_confirmation', 'order_detail', 'reorder'):
+            kwargs = {'order_id': self.order.id}
+        return reverse(f'catalog:{name}', kwargs=kwargs)
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in catalog_urls.urlpatterns}
+        self.assertEqual(names, set(self.BUDGETS))
+
+    def test_query_budgets(self):
+        for name, (method, budget, logged_in) in self.BUDGETS.items():
+            with self.subTest(name):
+                if logged_in:
+                    self.client.force_login(self.user)
+                    # Warm the session so the cart badge is already cached
+                    self.client.get(self.url_for('about'))
+                else:
+                    self.client.logout()
+                url = self.url_for(name)
+                data = {'quantity': 1} if method == 'post' else None
+                with QueryStats() as stats:
+                    response = getattr(self.client, method)(url, data)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(
+                    stats.count, budget,
+                    f'{name} ran {stats.count} queries:\n' + '\n'.join(sql for sql, _ in stats.queries),
+                )
+                self.assertEqual(stats.duplicates, {}, f'{name} repeated queries')
+
+    def test_search_stays_within_budget(self):
+        with QueryStats() as stats:
+            response = self.client.get(reverse('catalog:product_list'), {'search_query': 'widget 7'})
+        self.assertContains(response, 'Product ')
+        self.assertLessEqual(stats.count, self.BUDGETS['product_list'][1])
+
+
+class SearchBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.kitchen = Category.objects.create(name='Kitchen')
+        cls.garden = Category.objects.create(name='Garden')
+        cls.in_description = Product.objects.create(
+            name='Steel pot', category=cls.kitchen, price=Decimal('20.00'), description='Pairs with any kettle',
+        )
+        cls.in_name = Product.objects.create(
+            name='Copper kettle', category=cls.kitchen, price=Decimal('30.00'), description='Boils water',
+        )
+        cls.hose = Product.objects.create(
+            name='Hose', category=cls.garden, price=Decimal('15.00'), description='Twenty metres',
+        )
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query))
+
+    def indexed_ids(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM catalog_product_fts ORDER BY rowid')
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_name_hits_rank_above_description_hits(self):
+        self.assertEqual(self.search('kettle'), [self.in_name, self.in_description])
+        self.assertEqual(self.search('ket'), [self.in_name, self.in_description])
+
+    def test_saving_a_product_reindexes_it_without_loading_its_category(self):
+        product = Product.objects.get(pk=self.hose.pk)
+        product.name = 'Sprinkler'
+        with QueryStats() as stats:
+            product.save()
+        self.assertFalse([sql for sql, elapsed in stats.queries if sql.startswith('SELECT') and 'catalog_category' in sql])
+        self.assertEqual(self.search('sprinkler'), [product])
+        self.assertEqual(self.search('hose'), [])
+        self.assertEqual(self.search('garden'), [product])
+
+    def test_category_rename_reindexes_its_products(self):
+        self.garden.name = 'Outdoors'
+        self.garden.save()
+        self.assertEqual(self.search('outdoors'), [self.hose])
+        self.assertEqual(self.search('garden'), [])
+
+    def test_category_delete_unindexes_its_products(self):
+        self.kitchen.delete()
+        self.assertEqual(self.indexed_ids(), [self.hose.pk])
+
+    def test_rebuild_command_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM catalog_product_fts')
+        self.assertEqual(self.search('kettle'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 products', out.getvalue())
+        self.assertEqual(self.indexed_ids(), sorted(product.pk for product in (self.in_description, self.in_name, self.hose)))
+        self.assertEqual(self.search('kettle'), [self.in_name, self.in_description])
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(categories=2, products_per_category=25, orders=0, cart_lines=0)
+
+    def walk(self, queryset):
+        paginator = KeysetPaginator(queryset, 10)
+        page = paginator.get_page()
+        pages = [page]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append(page)
+        return paginator, pages
+
+    def test_walks_every_row_once_in_order(self):
+        queryset = Product.objects.all()
+        paginator, pages = self.walk(queryset)
+        seen = [product.id for page in pages for product in page]
+        self.assertEqual(seen, list(queryset.order_by('-created_at', '-id').values_list('id', flat=True)))
+        self.assertEqual(paginator.count, 50)
+        self.assertEqual((pages[-1].start_index(), pages[-1].end_index()), (41, 50))
+
+    def test_previous_cursor_returns_previous_page(self):
+        paginator, pages = self.walk(Product.objects.all())
+        previous = paginator.get_page(pages[2].previous_cursor)
+        self.assertEqual(list(previous), list(pages[1]))
+        self.assertEqual(previous.start_index(), 11)
+
+    def test_search_results_paginate_by_relevance(self):
+        queryset = search_products(Product.objects.all(), 'widget')
+        paginator, pages = self.walk(queryset)
+        self.assertEqual(sum(len(page) for page in pages), 50)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), 10)
+        self.assertEqual(list(paginator.get_page('not-a-cursor')), list(paginator.get_page()))
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        paginator, pages = self.walk(Product.objects.all())
+        first = list(pages[0])
+        created_at, pk = decode_cursor(pages[1].next_cursor)['v']
+        for values in ([created_at, 'x'], [created_at, {'id': pk}], ['yesterday', pk], [None, pk], [created_at, True]):
+            with self.subTest(values=values):
+                cursor = encode_cursor({'d': 'n', 'v': values, 'i': 20})
+                self.assertEqual(list(paginator.get_page(cursor)), first)
+        cursor = encode_cursor({'d': 'n', 'v': [created_at, pk], 'i': 'twenty'})
+        self.assertEqual(list(paginator.get_page(cursor)), first)
+
+    def test_search_cursor_coerces_the_rank(self):
+        paginator, pages = self.walk(search_products(Product.objects.all(), 'widget'))
+        rank, created_at, pk = decode_cursor(pages[0].next_cursor)['v']
+        as_text = encode_cursor({'d': 'n', 'v': [str(rank), created_at, pk], 'i': 10})
+        self.assertEqual(list(paginator.get_page(as_text)), list(pages[1]))
+        tampered = encode_cursor({'d': 'n', 'v': ['1) OR (1', created_at, pk], 'i': 10})
+        self.assertEqual(list(paginator.get_page(tampered)), list(pages[0]))
+
+    def test_deep_page_seeks_to_the_cursor(self):
+        paginator, pages = self.walk(Product.objects.filter(is_active=True))
+        for cursor in (pages[-2].next_cursor, pages[-1].previous_cursor):
+            with QueryStats() as stats:
+                paginator.get_page(cursor)
+            self.assertEqual(stats.count, 1)
+            sql, params = stats.queries[0][0], stats.params[0]
+            self.assertNotIn('OFFSET', sql)
+            with connection.cursor() as db:
+                db.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in db.fetchall()]
+            self.assertTrue(plan[0].startswith('SEARCH catalog_product USING INDEX'), plan)
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=10, orders=0, cart_lines=0)
+        cls.product = Product.objects.order_by('-id').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        url = reverse('catalog:product_detail', args=[self.product.id])
+        self.assertEqual(self.client.get(url)['X-Catalog-Cache'], 'miss')
+        with QueryStats() as stats:
+            response = self.client.get(url)
+        self.assertEqual(response['X-Catalog-Cache'], 'hit')
+        self.assertEqual(stats.count, 0)
+        self.assertEqual(get_stats()['page:product_detail'], (1, 1))
+
+    def test_product_change_invalidates_pages(self):
+        url = reverse('catalog:home')
+        self.client.get(url)
+        self.product.name = 'Renamed gadget'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Catalog-Cache'], 'miss')
+        self.assertContains(response, 'Renamed gadget')
+
+    def test_checkout_only_invalidates_pages_of_products_bought(self):
+        bought, other = Product.objects.filter(category=self.product.category).order_by('id')[:2]
+        home = reverse('catalog:home')
+        pages = [reverse('catalog:product_detail', args=[product.id]) for product in (bought, other)]
+        for url in (home, *pages):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(add_item(self.user, bought, 2), new_order(self.user))
+        self.assertEqual(self.client.get(home)['X-Catalog-Cache'], 'hit')
+        self.assertEqual(self.client.get(pages[1])['X-Catalog-Cache'], 'hit')
+        response = self.client.get(pages[0])
+        self.assertEqual(response['X-Catalog-Cache'], 'miss')
+        self.assertContains(response, f'({bought.stock - 2} available)')
+
+        # Selling a product out does reach the listings
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(add_item(self.user, other, other.stock), new_order(self.user))
+        self.assertEqual(self.client.get(home)['X-Catalog-Cache'], 'miss')
+
+    def test_category_rename_invalidates_cards(self):
+        url = reverse('catalog:category_products', args=[self.product.category_id])
+        self.client.get(url)
+        category = self.product.category
+        category.name = 'Gizmos'
+        category.save()
+        self.assertContains(self.client.get(url), 'Gizmos')
+
+    def test_cached_pages_get_a_fresh_csrf_token(self):
+        url = reverse('catalog:home')
+        Client().get(url)
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(url)
+        self.assertEqual(response['X-Catalog-Cache'], 'hit')
+        self.assertNotContains(response, '__CATALOG_CSRF_TOKEN__')
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = client.post(
+            reverse('catalog:add_to_cart', args=[self.product.id]),
+            {'quantity': 1, 'csrfmiddlewaretoken': token},
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_logged_in_users_bypass_page_cache(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('catalog:home'))
+        self.assertNotIn('X-Catalog-Cache', response)
+        self.assertContains(response, self.user.username)
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(categories=3, products_per_category=30, orders=0, cart_lines=0)
+        cls.categories = list(Category.objects.all())
+        Product.objects.filter(category=cls.categories[0], price__lt=15).update(stock=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_come_from_one_query(self):
+        with QueryStats() as stats:
+            facets = compute_facets(Product.objects.all(), self.categories)
+        self.assertEqual(stats.count, 1)
+        self.assertEqual([facet.count for facet in facets.categories], [30, 30, 30])
+        self.assertEqual(sum(bucket.count for bucket in facets.price_buckets), 90)
+        self.assertEqual(facets.in_stock, Product.objects.filter(stock__gt=0).count())
+        self.assertEqual(facets.total, 90)
+
+    def test_selected_category_narrows_price_and_stock_counts(self):
+        category = self.categories[0]
+        facets = compute_facets(Product.objects.all(), self.categories, category.id, in_stock_only=True)
+        expected = Product.objects.filter(category=category, stock__gt=0)
+        self.assertEqual(facets.total, expected.count())
+        self.assertEqual(facets.price_buckets[0].count, expected.filter(price__lt=25).count())
+        # Other categories keep their counts so they remain selectable
+        self.assertEqual(facets.categories[1].count, 30)
+
+    def test_product_list_filters_by_facets(self):
+        response = self.client.get(reverse('catalog:product_list'), {'in_stock': 'on', 'min_price': '25'})
+        expected = Product.objects.filter(stock__gt=0, price__gte=25).count()
+        self.assertEqual(response.context['facets'].total, expected)
+        self.assertContains(response, f'of {expected} products')
+
+    def test_bucket_links_match_bucket_counts_at_boundaries(self):
+        category = self.categories[0]
+        Product.objects.create(name='Boundary widget', category=category, price=Decimal('25.00'), stock=5)
+        Product.objects.create(name='Just under widget', category=category, price=Decimal('24.99'), stock=5)
+        response = self.client.get(reverse('catalog:product_list'))
+        for bucket in response.context['facets'].price_buckets[:2]:
+            link = self.client.get(reverse('catalog:product_list'), {
+                'min_price': bucket.min_price, 'max_price': bucket.max_filter_price,
+            })
+            self.assertEqual(link.context['facets'].total, bucket.count, bucket.label)
+        self.assertContains(response, f'max_price={response.context["facets"].price_buckets[0].max_filter_price}')
+        self.assertEqual(response.context['facets'].price_buckets[0].label, '$0 - $24.99')
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_catalog_views_use_indexes(self):
+        # No ANALYZE here: with statistics for these tiny tables SQLite rightly prefers scans
+        call_command('explain_queries', stdout=StringIO())
+
+    def test_full_scans_are_detected(self):
+        from .management.commands.explain_queries import SQLITE_INDEX_WALK_RE, SQLITE_SCAN_RE
+        self.assertEqual(SQLITE_SCAN_RE.match('SCAN catalog_order').group(1), 'catalog_order')
+        self.assertIsNone(SQLITE_SCAN_RE.match('SCAN catalog_product USING INDEX product_active_created_idx'))
+        self.assertIsNone(SQLITE_SCAN_RE.match('SCAN catalog_product_fts VIRTUAL TABLE INDEX 0:M3'))
+        self.assertEqual(
+            SQLITE_INDEX_WALK_RE.match('SCAN catalog_product USING INDEX product_active_created_idx').group(1),
+            'catalog_product',
+        )
+
+
+class OrderNumberTests(TestCase):
+    def test_numbers_are_unique_and_ordered_across_threads(self):
+        generator = OrderNumberGenerator(node_id=7)
+        results = []
+
+        def generate():
+            numbers = [generator.next_number() for _ in range(2000)]
+            results.append(numbers)
+
+        threads = [threading.Thread(target=generate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        numbers = [number for numbers in results for number in numbers]
+        self.assertEqual(len(set(numbers)), 8000)
+        for numbers in results:
+            self.assertEqual(numbers, sorted(numbers))
+
+    def test_clock_going_backwards_and_sequence_overflow(self):
+        now = [1_800_000_000_000]
+        generator = OrderNumberGenerator(node_id=3, clock=lambda: now[0])
+        first = generator.next_number()
+        now[0] -= 5000
+        numbers = [generator.next_number() for _ in range(MAX_SEQUENCE + 2)]
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertLess(first, numbers[0])
+        self.assertEqual(parse(first), (1_800_000_000_000, 3, 0))
+        self.assertEqual(parse(numbers[-1]), (1_800_000_000_001, 3, 1))
+
+    def test_node_ids_keep_processes_apart(self):
+        clock = lambda: 1_800_000_000_000
+        a = OrderNumberGenerator(node_id=1, clock=clock).next_number()
+        b = OrderNumberGenerator(node_id=2, clock=clock).next_number()
+        self.assertNotEqual(a, b)
+        with self.assertRaises(ValueError):
+            OrderNumberGenerator(node_id=1 << 16)
+
+    def test_orders_get_a_number_on_save(self):
+        user = User.objects.create_user('buyer', password='x')
+        fields = dict(
+            user=user, total_amount=Decimal('1.00'), shipping_address='1 Way', shipping_city='A',
+            shipping_state='B', shipping_zip_code='1', shipping_country='US', phone_number='1',
+        )
+        first = Order.objects.create(**fields)
+        second = Order.objects.create(**fields)
+        self.assertEqual(len(first.order_number), 15)
+        self.assertLess(first.order_number, second.order_number)
+
+
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, CATALOG_IMAGE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), 'teal').save(buffer, 'PNG')
+        category = Category.objects.create(name='Cameras')
+        self.product = Product.objects.create(
+            name='Camera', category=category, price=Decimal('99.00'), description='x', stock=1,
+            image=SimpleUploadedFile('camera.png', buffer.getvalue(), content_type='image/png'),
+        )
+
+    def test_renditions_are_content_addressed(self):
+        self.assertTrue(process_product(self.product.pk))
+        self.product.refresh_from_db()
+        renditions = self.product.image_renditions
+        self.assertEqual(renditions['widths'], [160, 320, 640, 960])
+        self.assertEqual((renditions['width'], renditions['height']), (1200, 800))
+        for fmt in ('webp', 'jpeg'):
+            name = rendition_name(renditions['hash'], 320, fmt)
+            with default_storage.open(name) as rendition, Image.open(rendition) as image:
+                self.assertEqual(image.size, (320, 213))
+        # Already built: nothing to do
+        self.assertFalse(process_product(self.product.pk))
+
+    def test_template_falls_back_to_original_until_renditions_exist(self):
+        template = Template('{% load catalog_images %}{% product_image product "card" css_class="card-img-top" %}')
+        html = template.render(Context({'product': self.product}))
+        self.assertIn(f'src="{self.product.image.url}"', html)
+        self.assertNotIn('srcset', html)
+
+        # Rendering queued the renditions (inline here); the next render uses them
+        self.product.refresh_from_db()
+        html = template.render(Context({'product': self.product}))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn('-960w.jpeg 960w', html)
+        self.assertIn('class="card-img-top"', html)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """Outside a test transaction the read views run their queries on worker threads"""
+
+    def setUp(self):
+        seed_catalog(categories=3, products_per_category=5, orders=0, cart_lines=0)
+        self.addCleanup(cache.clear)
+        self.product = Product.objects.first()
+
+    def test_concurrent_queries_are_counted_and_rendered(self):
+        urls = [
+            reverse('catalog:home'),
+            reverse('catalog:product_list'),
+            reverse('catalog:product_detail', args=[self.product.id]),
+            reverse('catalog:category_products', args=[self.product.category_id]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                with QueryStats() as stats:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, self.product.name)
+                self.assertGreaterEqual(stats.count, 2)
+
+    def test_missing_objects_are_404(self):
+        self.assertEqual(self.client.get(reverse('catalog:product_detail', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('catalog:category_products', args=[0])).status_code, 404)
+
+
+class APITests(TestCase):
+    # url name -> maximum queries for a logged-in request, session write included
+    BUDGETS = {
+        'category_list': 3,
+        'product_list': 3,
+        'product_detail': 3,
+        'cart': 7,
+        'cart_items': 19,
+        'cart_item': 17,
+        'cart_batch': 17,
+        'order_list': 3,
+        'order_detail': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=3, products_per_category=30, orders=3, cart_lines=5)
+        cls.product = Product.objects.order_by('-id').first()
+        cls.order = Order.objects.order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def send(self, method, name, data=None, **kwargs):
+        body = json.dumps(data) if data is not None else ''
+        return getattr(self.client, method)(reverse(f'api:{name}', kwargs=kwargs), body, content_type='application/json')
+
+    def test_every_url_has_a_budget(self):
+        self.assertEqual({pattern.name for pattern in api_urls.urlpatterns}, set(self.BUDGETS))
+
+    def test_read_budgets(self):
+        urls = {
+            'category_list': reverse('api:category_list'),
+            'product_list': reverse('api:product_list'),
+            'product_detail': reverse('api:product_detail', args=[self.product.id]),
+            'cart': reverse('api:cart'),
+            'order_list': reverse('api:order_list'),
+            'order_detail': reverse('api:order_detail', args=[self.order.id]),
+        }
+        for name, url in urls.items():
+            with self.subTest(name):
+                with QueryStats() as stats:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(stats.count, self.BUDGETS[name])
+                self.assertEqual(stats.duplicates, {})
+
+    def test_unchanged_resources_return_304(self):
+        url = reverse('api:product_detail', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['category']['id'], self.product.category_id)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.product.price += 1
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_product_etag_follows_holds(self):
+        url = reverse('api:product_detail', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        Product.objects.filter(pk=self.product.pk).update(reserved=1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_list_etag_follows_product_changes(self):
+        url = reverse('api:product_list')
+        etag = self.client.get(url, {'in_stock': 'on'})['ETag']
+        self.assertEqual(self.client.get(url, {'in_stock': 'on'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.filter(pk=self.product.pk).update(updated_at=timezone.now())
+        self.assertEqual(self.client.get(url, {'in_stock': 'on'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_product_search_and_pagination(self):
+        response = self.client.get(reverse('api:product_list'), {'q': 'widget 7'})
+        names = [product['name'] for product in response.json()['results']]
+        self.assertTrue(names and all('Product' in name for name in names))
+
+        first = self.client.get(reverse('api:product_list')).json()
+        second = self.client.get(reverse('api:product_list'), {'cursor': first['next']}).json()
+        self.assertEqual(len(first['results']), 24)
+        self.assertFalse({p['id'] for p in first['results']} & {p['id'] for p in second['results']})
+        self.assertEqual(self.client.get(reverse('api:product_list'), {'min_price': 'x'}).status_code, 400)
+
+    def test_cart_operations(self):
+        product = Product.objects.exclude(cartitem__cart=self.cart).first()
+        with QueryStats() as stats:
+            response = self.send('post', 'cart_items', {'product': product.id, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(stats.count, self.BUDGETS['cart_items'])
+        self.assertEqual(response.json()['item_count'], 12)
+
+        item_id = next(item['id'] for item in response.json()['items'] if item['product'] == product.id)
+        with QueryStats() as stats:
+            response = self.send('patch', 'cart_item', {'quantity': 5}, item_id=item_id)
+        self.assertLessEqual(stats.count, self.BUDGETS['cart_item'])
+        self.assertEqual(response.json()['item_count'], 15)
+
+        self.assertEqual(self.send('patch', 'cart_item', {'quantity': -1}, item_id=item_id).status_code, 400)
+        self.assertEqual(self.send('delete', 'cart_item', item_id=item_id).json()['item_count'], 10)
+        self.assertEqual(self.send('delete', 'cart_item', item_id=item_id).status_code, 404)
+
+    def test_add_rejects_malformed_product_ids(self):
+        for product in ('abc', [1], True, None, {'id': 1}):
+            with self.subTest(product=product):
+                response = self.send('post', 'cart_items', {'product': product, 'quantity': 1})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], 'Expected {"product": <product id>}')
+        self.assertEqual(self.send('post', 'cart_items', {'product': 10 ** 9}).status_code, 404)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api:cart')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('api:order_list')).status_code, 401)
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=30, orders=1, cart_lines=3)
+        cls.in_cart = list(cls.cart.items.order_by('product_id').values_list('product_id', flat=True))
+        cls.others = list(Product.objects.exclude(id__in=cls.in_cart).order_by('id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def batch(self, operations):
+        return self.client.post(
+            reverse('api:cart_batch'), json.dumps({'operations': operations}), content_type='application/json',
+        )
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        counts = []
+        for size in (2, 40):
+            operations = [{'op': 'add', 'product': product_id, 'quantity': 1} for product_id in self.others[:size]]
+            with QueryStats() as stats:
+                response = self.batch(operations)
+            self.assertEqual(response.status_code, 200)
+            counts.append(stats.count)
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], APITests.BUDGETS['cart_batch'])
+
+    def test_operations_apply_in_order(self):
+        first, second, third = self.in_cart
+        new = self.others[0]
+        response = self.batch([
+            {'op': 'add', 'product': first, 'quantity': 3},
+            {'op': 'set', 'product': second, 'quantity': 7},
+            {'op': 'remove', 'product': third},
+            {'op': 'add', 'product': new},
+            {'op': 'add', 'product': new, 'quantity': 2},
+            {'op': 'set', 'product': first, 'quantity': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {second: 7, new: 3})
+        self.assertEqual(response.json()['item_count'], 10)
+
+    def test_invalid_batch_changes_nothing(self):
+        before = self.quantities()
+        Product.objects.filter(pk=self.others[1]).update(is_active=False)
+        response = self.batch([
+            {'op': 'add', 'product': self.others[0]},
+            {'op': 'add', 'product': self.others[1]},
+            {'op': 'set', 'product': self.in_cart[0], 'quantity': -2},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['operations'], [{'index': 2, 'error': 'quantity must be a non-negative integer'}])
+        response = self.batch([{'op': 'add', 'product': self.others[0]}, {'op': 'add', 'product': self.others[1]}])
+        self.assertEqual([error['index'] for error in response.json()['operations']], [1])
+        self.assertEqual(self.quantities(), before)
+
+    def test_reorder_adds_order_lines_to_cart(self):
+        order = Order.objects.get(user=self.user)
+        lines = dict(order.items.values_list('product_id', 'quantity'))
+        before = self.quantities()
+        response = self.client.post(reverse('catalog:reorder', args=[order.id]))
+        self.assertRedirects(response, reverse('catalog:cart'), fetch_redirect_response=False)
+        after = self.quantities()
+        for product_id, quantity in lines.items():
+            self.assertEqual(after[product_id], before.get(product_id, 0) + quantity)
+
+
+class PlaceOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=20, orders=0, cart_lines=20)
+
+    def test_out_of_stock_rolls_back_everything(self):
+        short = self.cart.items.order_by('-product_id').first().product
+        Product.objects.filter(pk=short.pk).update(stock=1)
+        stock_before = dict(Product.objects.values_list('id', 'stock'))
+
+        with self.assertRaises(OutOfStockError) as raised:
+            place_order(self.cart, new_order(self.user))
+
+        self.assertEqual([product.pk for product in raised.exception.products], [short.pk])
+        self.assertEqual(dict(Product.objects.values_list('id', 'stock')), stock_before)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 20)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_query_count_does_not_grow_with_cart_lines(self):
+        other = User.objects.create_user('small-cart')
+        small = Cart.objects.create(user=other)
+        CartItem.objects.bulk_create(
+            CartItem(cart=small, product=product, quantity=1) for product in Product.objects.order_by('-id')[:2]
+        )
+        with QueryStats() as few:
+            place_order(small, new_order(other))
+        with QueryStats() as many:
+            order = place_order(self.cart, new_order(self.user))
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(many.count, few.count)
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Flash sale')
+        cls.product = Product.objects.create(
+            name='Console', category=category, price=Decimal('299.00'), description='x', stock=3,
+        )
+        cls.buyers = [User.objects.create_user(f'buyer{i}', password='secret-pass') for i in range(2)]
+
+    def add(self, user, quantity):
+        return add_item(user, self.product, quantity)
+
+    def refresh(self):
+        self.product.refresh_from_db()
+        return self.product
+
+    def test_holds_reduce_availability(self):
+        cart = self.add(self.buyers[0], 2)
+        self.assertEqual((self.refresh().reserved, self.product.available), (2, 1))
+        with self.assertRaises(OutOfStockError):
+            self.add(self.buyers[1], 2)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.buyers[1]).exists())
+
+        set_item_quantity(cart.items.get(), 3)
+        self.assertFalse(self.refresh().is_in_stock)
+        remove_item(cart.items.select_related('cart').get())
+        self.assertEqual((self.refresh().reserved, StockReservation.objects.count()), (0, 0))
+
+    def test_checkout_consumes_the_hold(self):
+        cart = self.add(self.buyers[0], 2)
+        self.add(self.buyers[1], 1)
+        order = Order(
+            user=self.buyers[0], shipping_address='1 Main St', shipping_city='Springfield',
+            shipping_state='IL', shipping_zip_code='62701', shipping_country='US', phone_number='555-0100',
+        )
+        place_order(cart, order)
+        self.assertEqual((self.refresh().stock, self.product.reserved), (1, 1))
+        self.assertEqual(StockReservation.objects.get().cart.user, self.buyers[1])
+
+    def test_sweeper_releases_expired_holds(self):
+        cart = self.add(self.buyers[0], 3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_all_expired(batch_size=1), 1)
+        self.assertEqual(self.refresh().available, 3)
+
+        # The line stays in the cart; checkout fills it from unreserved stock
+        self.add(self.buyers[1], 1)
+        order = Order(
+            user=self.buyers[0], shipping_address='1 Main St', shipping_city='Springfield',
+            shipping_state='IL', shipping_zip_code='62701', shipping_country='US', phone_number='555-0100',
+        )
+        with self.assertRaises(OutOfStockError):
+            place_order(cart, order)
+
+    def test_cart_page_limits_quantity_to_what_is_free(self):
+        self.add(self.buyers[1], 1)
+        self.add(self.buyers[0], 1)
+        self.client.force_login(self.buyers[0])
+        self.assertContains(self.client.get(reverse('catalog:cart')), 'max="2"')
+        response = self.client.post(reverse('catalog:add_to_cart', args=[self.product.id]), {'quantity': 2})
+        self.assertRedirects(response, reverse('catalog:product_detail', args=[self.product.id]), fetch_redirect_response=False)
+
+    def test_full_save_keeps_the_counter(self):
+        self.add(self.buyers[0], 2)
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=stale.pk).update(reserved=1)
+        stale.price += 1
+        stale.save()
+        self.assertEqual(self.refresh().reserved, 1)
+
+
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=1, products_per_category=5, orders=0, cart_lines=2)
+        cls.products = list(Product.objects.order_by('id'))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def summary(self):
+        with QueryStats() as stats:
+            response = self.client.get(reverse('catalog:about'))
+        cart_reads = [sql for sql, elapsed in stats.queries if sql.startswith('SELECT') and 'catalog_cart' in sql]
+        return response.context['cart_summary'], len(cart_reads)
+
+    def test_summary_is_read_once_per_change(self):
+        self.assertEqual(self.summary(), ({'item_count': 4, 'subtotal': '41.96'}, 1))
+        self.assertEqual(self.summary(), ({'item_count': 4, 'subtotal': '41.96'}, 0))
+
+    def test_change_on_another_device_refreshes_the_summary(self):
+        self.summary()
+        with self.captureOnCommitCallbacks(execute=True):
+            add_item(self.user, self.products[4], 1)
+        self.assertEqual(self.summary(), ({'item_count': 5, 'subtotal': '55.95'}, 1))
+
+    def test_admin_price_change_refreshes_the_summary(self):
+        self.summary()
+        product = self.products[0]
+        product.price = Decimal('1.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.summary()[0], {'item_count': 4, 'subtotal': '23.98'})
+
+    def test_checkout_on_another_device_clears_the_summary(self):
+        self.summary()
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.cart, new_order(self.user))
+        self.assertEqual(self.summary(), (None, 1))
+
+    def test_update_totals_recomputes_stored_totals(self):
+        CartItem.objects.filter(cart=self.cart, product=self.products[0]).update(quantity=5)
+        CartItem.objects.create(cart=self.cart, product=self.products[3], quantity=1)
+        self.assertEqual(Cart.objects.filter(user=self.user).update_totals(), 1)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (8, Decimal('84.92')))
+
+        CartItem.objects.filter(cart=self.cart).delete()
+        self.cart.update_totals()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (0, Decimal('0')))
+        self.assertEqual(Cart.objects.none().update_totals(), 0)
+
+
+class GuestCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=1, products_per_category=5, orders=0, cart_lines=1)
+        cls.products = list(Product.objects.order_by('id'))
+
+    def setUp(self):
+        cache.clear()
+
+    def add(self, product, quantity):
+        return self.client.post(reverse('catalog:add_to_cart', args=[product.id]), {'quantity': quantity})
+
+    def test_guest_cart_writes_nothing_to_the_database(self):
+        with QueryStats() as stats:
+            self.add(self.products[1], 2)
+            self.add(self.products[2], 1)
+            self.client.post(reverse('catalog:update_cart_item', args=[self.products[1].id]), {'quantity': 3})
+            self.client.post(reverse('catalog:remove_from_cart', args=[self.products[2].id]))
+            response = self.client.get(reverse('catalog:cart'))
+        self.assertEqual([item.quantity for item in response.context['cart_items']], [3])
+        self.assertEqual(response.context['cart'].item_count, 3)
+        self.assertContains(response, '<span class="cart-badge">3</span>')
+        self.assertFalse([sql for sql, elapsed in stats.queries if not sql.lstrip().upper().startswith('SELECT')])
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_guest_cart_rejects_more_than_available(self):
+        response = self.add(self.products[1], 101)
+        self.assertRedirects(response, reverse('catalog:product_detail', args=[self.products[1].id]), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('catalog:cart')).context['cart_items'], [])
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies['guest_cart'] = f'{self.products[1].id}:5'
+        self.assertEqual(self.client.get(reverse('catalog:cart')).context['cart_items'], [])
+
+    def test_login_merges_into_the_user_cart(self):
+        in_cart = self.cart.items.get().product
+        self.add(in_cart, 1)
+        self.add(self.products[3], 2)
+        response = self.client.post(
+            reverse('catalog:login') + '?next=' + reverse('catalog:checkout'),
+            {'username': 'shopper', 'password': 'secret-pass'},
+        )
+        self.assertRedirects(response, reverse('catalog:checkout'), fetch_redirect_response=False)
+        self.assertEqual(response.cookies['guest_cart'].value, '')
+        self.assertEqual(
+            dict(self.cart.items.values_list('product_id', 'quantity')), {in_cart.id: 3, self.products[3].id: 2},
+        )
+        self.assertEqual(Product.objects.get(pk=self.products[3].pk).reserved, 2)
+
+    def test_login_merge_skips_lines_sold_out_since(self):
+        self.add(self.products[1], 2)
+        self.add(self.products[2], 1)
+        self.add(self.products[3], 1)
+        Product.objects.filter(pk__in=[self.products[1].pk, self.products[2].pk]).update(stock=0)
+        response = self.client.post(reverse('catalog:login'), {'username': 'shopper', 'password': 'secret-pass'}, follow=True)
+        self.assertContains(response, 'Some items from your cart are no longer available.')
+        quantities = dict(self.cart.items.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities[self.products[3].id], 1)
+        self.assertNotIn(self.products[1].id, quantities)
+        self.assertNotIn(self.products[2].id, quantities)
+
+    def test_pages_with_a_guest_cart_skip_the_page_cache(self):
+        self.client.get(reverse('catalog:about'))
+        self.add(self.products[1], 1)
+        response = self.client.get(reverse('catalog:about'))
+        self.assertNotIn('X-Catalog-Cache', response)
+        self.assertContains(response, '<span class="cart-badge">1</span>')
+
+
+calls = []
+
+
+@task(name='tests.flaky', max_attempts=2)
+def flaky(fail=False):
+    calls.append(fail)
+    if fail:
+        raise RuntimeError('downstream is down')
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=1, products_per_category=5, orders=0, cart_lines=2)
+        User.objects.filter(pk=cls.user.pk).update(email='shopper@example.com')
+
+    def setUp(self):
+        calls.clear()
+
+    def test_checkout_queues_its_side_effects(self):
+        Product.objects.filter(pk=self.cart.items.first().product_id).update(stock=6)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('catalog:checkout'), {
+            'shipping_address': '1 Main St', 'shipping_city': 'Springfield', 'shipping_state': 'IL',
+            'shipping_zip_code': '62701', 'shipping_country': 'US', 'phone_number': '555-0100',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(sorted(Job.objects.values_list('task', flat=True)), [
+            'catalog.analytics.sync_order', 'catalog.tasks.alert_low_stock', 'catalog.tasks.send_order_confirmation',
+        ])
+
+        with self.settings(ADMINS=[('Ops', 'ops@example.com')]):
+            self.assertEqual(run_pending(), (3, 0))
+        order = Order.objects.get()
+        self.assertEqual(
+            sorted(message.subject for message in mail.outbox),
+            sorted(['[Django] 1 product(s) low on stock', f'Your ShopHub order {order.order_number}']),
+        )
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {'done'})
+
+    def test_low_stock_alert_only_when_crossing_the_threshold(self):
+        low, plenty = self.cart.items.order_by('product_id').values_list('product_id', flat=True)
+        Product.objects.filter(pk=low).update(stock=4)
+        place_order(self.cart, new_order(self.user))
+        self.assertFalse(Job.objects.filter(task='catalog.tasks.alert_low_stock').exists())
+
+        Product.objects.filter(pk=plenty).update(stock=7)
+        place_order(add_item(self.user, Product.objects.get(pk=plenty), 2), new_order(self.user))
+        self.assertEqual(
+            Job.objects.get(task='catalog.tasks.alert_low_stock').payload, {'product_ids': [plenty]},
+        )
+
+    def test_contact_form_queues_the_email(self):
+        self.client.post(reverse('catalog:contact'), {
+            'name': 'Ada', 'email': 'ada@example.com', 'subject': 'Hi', 'message': 'Where is my order?',
+        })
+        self.assertEqual(len(mail.outbox), 0)
+        run_pending()
+        self.assertEqual(mail.outbox[0].reply_to, ['ada@example.com'])
+
+    def test_failures_are_retried_with_backoff(self):
+        job = enqueue(flaky, fail=True)
+        self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('downstream is down', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, calls), ('failed', 2, [True, True]))
+
+    def test_abandoned_jobs_are_requeued(self):
+        job = enqueue(flaky)
+        self.assertEqual(claim('lost-worker'), [job.pk])
+        self.assertEqual(claim('other-worker'), [])
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(requeue_stale(lease=300), 1)
+        self.assertEqual(run_pending(), (1, 0))
+
+    def test_eager_mode_runs_after_commit(self):
+        with self.settings(CATALOG_JOBS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            enqueue(flaky)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [False])
+
+
+class JobWorkerTests(TransactionTestCase):
+    def test_worker_drains_the_queue_on_a_thread_pool(self):
+        jobs = [enqueue(flaky) for _ in range(5)] + [enqueue(flaky, fail=True)]
+        out = StringIO()
+        # One thread: the in-memory test database can't take concurrent writes
+        call_command('run_jobs', '--once', '--workers', '1', '--batch-size', '4', stdout=out)
+        self.assertIn('Ran 6 jobs (1 failed).', out.getvalue())
+        self.assertEqual(Job.objects.filter(status='done').count(), 5)
+        self.assertEqual(Job.objects.get(pk=jobs[-1].pk).status, 'queued')
+
+
+    def test_forked_workers_forget_the_parents_connection(self):
+        from .management.commands.run_jobs import forget_inherited_connections
+        Job.objects.exists()
+        inherited = connection.connection
+        forget_inherited_connections()
+        self.assertIsNone(connection.connection)
+        # The parent's session is left open, and the worker reconnects on its own
+        inherited.execute('SELECT 1')
+        self.assertFalse(Job.objects.exists())
+        self.assertIsNot(connection.connection, inherited)
+        inherited.close()
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=6, orders=4, lines_per_order=3, cart_lines=0)
+        cls.admin = User.objects.create_superuser('boss', 'boss@example.com', 'secret-pass')
+
+    def setUp(self):
+        run_pending()
+
+    def rollups(self):
+        return {
+            (row.dimension, row.key): (row.orders, row.units, row.revenue)
+            for row in SalesRollup.objects.filter(date=timezone.localdate())
+        }
+
+    def test_orders_are_rolled_up_incrementally(self):
+        items = OrderItem.objects.all()
+        self.assertEqual(self.rollups()[('all', 0)], (4, items.count(), sum(item.total_price for item in items)))
+        product_id = items.first().product_id
+        self.assertEqual(self.rollups()[('product', product_id)][:2], (1, 1))
+        self.assertEqual(sum(orders for (dimension, key), (orders, units, revenue) in self.rollups().items() if dimension == 'category'), 4)
+
+    def test_cancelling_takes_the_order_out_once(self):
+        order = Order.objects.order_by('id').first()
+        before = self.rollups()[('all', 0)]
+        order.status = 'cancelled'
+        order.save()
+        order.save()
+        run_pending()
+        self.assertEqual(self.rollups()[('all', 0)][0], before[0] - 1)
+
+        order.status = 'processing'
+        order.save()
+        run_pending()
+        self.assertEqual(self.rollups()[('all', 0)], before)
+
+        order.delete()
+        self.assertEqual(self.rollups()[('all', 0)][0], before[0] - 1)
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        Order.objects.filter(pk=Order.objects.order_by('id').first().pk).update(status='cancelled')
+        Job.objects.all().delete()
+        expected_orders = self.rollups()[('all', 0)][0] - 1
+        out = StringIO()
+        call_command('rebuild_sales_rollups', '--chunk-days', '1', stdout=out)
+        self.assertIn('Rebuilt 1 days', out.getvalue())
+        self.assertEqual(self.rollups()[('all', 0)][0], expected_orders)
+        self.assertEqual(Order.objects.filter(in_sales_rollups=False).count(), 1)
+
+        incremental = self.rollups()
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_dashboard_reads_only_the_rollups(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:catalog_order_sales')
+        with QueryStats() as stats:
+            response = self.client.get(url, {'days': '7'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['totals']['orders'], 4)
+        self.assertEqual(len(response.context['series']), 7)
+        self.assertFalse([sql for sql, elapsed in stats.queries if 'catalog_orderitem' in sql])
+        self.assertLessEqual(stats.count, 10)
+        self.assertContains(self.client.get(reverse('admin:catalog_order_changelist')), url)
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=20, orders=4, lines_per_order=3, cart_lines=5)
+        cls.admin = User.objects.create_superuser('boss', 'boss@example.com', 'secret-pass')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self):
+        products = list(Product.objects.order_by('id'))
+        for n in range(5):
+            user = User.objects.create_user(f'extra{n}', f'extra{n}@example.com', 'secret-pass')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=n + 1) for product in products[:4])
+            cart.update_totals()
+            order = Order.objects.create(
+                user=user, total_amount=Decimal('20.00'), shipping_address='1 Main St', shipping_city='Springfield',
+                shipping_state='IL', shipping_zip_code='62701', shipping_country='US', phone_number='555-0100',
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, product_name=product.name, price=product.price, quantity=2)
+                for product in products[:4]
+            )
+
+    def changelist_queries(self, name):
+        with QueryStats() as stats:
+            response = self.client.get(reverse(f'admin:catalog_{name}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return stats.count
+
+    def test_query_count_does_not_grow_with_rows(self):
+        names = ['cart', 'cartitem', 'order', 'orderitem', 'product', 'job']
+        before = {name: self.changelist_queries(name) for name in names}
+        self.add_rows()
+        self.assertEqual({name: self.changelist_queries(name) for name in names}, before)
+
+    def test_totals_are_sortable(self):
+        self.add_rows()
+        # total_price is the 4th column of CartItemAdmin and the 5th of OrderItemAdmin
+        response = self.client.get(reverse('admin:catalog_cartitem_changelist'), {'o': '-4'})
+        totals = [item.line_total for item in response.context['cl'].result_list]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        self.assertEqual(totals[0], max(item.total_price for item in CartItem.objects.select_related('product')))
+
+        response = self.client.get(reverse('admin:catalog_orderitem_changelist'), {'o': '5'})
+        totals = [item.line_total for item in response.context['cl'].result_list]
+        self.assertEqual(totals, sorted(totals))
+
+        response = self.client.get(reverse('admin:catalog_cart_changelist'), {'o': '-3'})
+        totals = [cart.subtotal for cart in response.context['cl'].result_list]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+    def test_estimated_count_past_the_limit(self):
+        class SmallLimit(EstimatedCountPaginator):
+            exact_limit = 5
+
+        products = Product.objects.order_by('id')
+        self.assertEqual(EstimatedCountPaginator(products, 10).count, products.count())
+        with QueryStats() as stats:
+            count = SmallLimit(products, 10).count
+        self.assertGreaterEqual(count, products.count())
+        self.assertFalse([sql for sql, elapsed in stats.queries if 'LIMIT' not in sql and 'MAX(' not in sql])
+        self.assertEqual(SmallLimit(products.filter(name__startswith='Product'), 10).count, 6)
+        self.assertEqual(SmallLimit(products.filter(price__lt=Decimal('12')), 10).count, 6)
+        self.assertEqual(SmallLimit(products.filter(price__lt=Decimal('11')), 10).count, 4)
+
+
+class TransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=5, orders=2, lines_per_order=2, cart_lines=3)
+        cls.admin = User.objects.create_superuser('boss', 'boss@example.com', 'secret-pass')
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_data', *args, stdout=out)
+        return out.getvalue()
+
+    def import_file(self, content, *args):
+        fd, path = tempfile.mkstemp(suffix='.jsonl' if content.startswith('{') else '.csv')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            file.write(content)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_exports_stream_every_row(self):
+        rows = list(csv.DictReader(StringIO(self.export('products', '--chunk-size', '3'))))
+        self.assertEqual(len(rows), Product.objects.count())
+        self.assertEqual(rows[0]['category'], Product.objects.order_by('id').first().category.name)
+
+        lines = self.export('order_items', '--format', 'jsonl').splitlines()
+        self.assertEqual(len(lines), OrderItem.objects.count())
+        self.assertEqual(set(json.loads(lines[0])), {'id', 'order_number', 'product_id', 'product_name', 'price', 'quantity'})
+        self.assertEqual(len(self.export('orders', '--format', 'jsonl').splitlines()), Order.objects.count())
+
+    def test_import_from_stdin_leaves_it_open(self):
+        stdin = StringIO('name,category,price,description\nLunar Kettle,Kitchen,30,Boils\n')
+        saved, sys.stdin = sys.stdin, stdin
+        try:
+            call_command('import_products', '-', stdout=StringIO())
+        finally:
+            sys.stdin = saved
+        self.assertFalse(stdin.closed)
+        self.assertTrue(Product.objects.filter(name='Lunar Kettle').exists())
+
+    def test_import_upserts_in_batches(self):
+        rows = list(csv.DictReader(StringIO(self.export('products'))))
+        in_cart = self.cart.items.first().product_id
+        for row in rows:
+            if int(row['id']) == in_cart:
+                row['price'] = '1.00'
+        rows.append({'id': '', 'name': 'Lunar Kettle', 'category': 'Kitchen', 'price': '30', 'description': 'Boils', 'stock': '4', 'is_active': '0'})
+        rows.append({'id': '', 'name': 'Broken', 'category': 'Kitchen', 'price': '-1', 'description': 'x'})
+        rows.append({'id': '999999', 'name': 'Ghost', 'category': 'Kitchen', 'price': '1', 'description': 'x'})
+        out = StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+        stdout, stderr = self.import_file(out.getvalue(), '--batch-size', '4')
+        self.assertIn('Imported 11 products (1 created, 10 updated, 2 invalid)', stdout)
+        self.assertEqual(stdout.count(' rows: '), 4)
+        self.assertIn('price:', stderr)
+        self.assertIn('No product with id 999999', stderr)
+
+        kettle = Product.objects.get(name='Lunar Kettle')
+        self.assertEqual((kettle.category.name, kettle.stock, kettle.is_active), ('Kitchen', 4, False))
+        self.assertEqual(Product.objects.get(id=in_cart).price, Decimal('1.00'))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.subtotal, sum(item.total_price for item in self.cart.items.select_related('product')))
+        self.assertEqual(list(search_products(Product.objects.all(), 'lunar kettle')), [kettle])
+
+    def test_jsonl_import_reports_bad_lines(self):
+        stdout, stderr = self.import_file(
+            '{"name": "Tea Tin", "category": "Category 0", "price": "4.50", "description": "Tin", "is_active": true}\n'
+            'not json\n\n'
+            '{"name": "Tea Tin", "category": "Category 0", "price": "4.50"}\n'
+        )
+        self.assertIn('(1 created, 0 updated, 2 invalid)', stdout)
+        self.assertIn('Line 2: Not a JSON object', stderr)
+        self.assertIn('Line 4: description:', stderr)
+        self.assertTrue(Product.objects.get(name='Tea Tin').is_active)
+        self.assertEqual(Category.objects.filter(name='Category 0').count(), 1)
+
+    def test_admin_action_streams_selected_rows(self):
+        self.client.force_login(self.admin)
+        selected = list(Order.objects.values_list('pk', flat=True)[:1])
+        response = self.client.post(reverse('admin:catalog_order_changelist'), {
+            'action': 'export_csv', '_selected_action': selected,
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['id']) for row in rows], selected)
+
+
+class SyntheticDataTests(TestCase):
+    def test_populate_data_scale_creates_consistent_rows(self):
+        out = StringIO()
+        call_command(
+            'populate_data', '--scale', '60', '--users', '6', '--orders', '25', '--carts', '4',
+            '--batch-size', '10', '--seed', '1', stdout=out,
+        )
+        self.assertIn('Synthetic data created successfully!', out.getvalue())
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Order.objects.count(), 25)
+        self.assertEqual(Cart.objects.count(), 4)
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.total_amount, sum(item.price * item.quantity for item in order.items.all()))
+        for cart in Cart.objects.prefetch_related('items__product'):
+            items = cart.items.all()
+            self.assertTrue(items)
+            self.assertEqual(cart.item_count, sum(item.quantity for item in items))
+            self.assertEqual(cart.subtotal, sum(item.product.price * item.quantity for item in items))
+
+
+class OrderReadModelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=10, orders=3, lines_per_order=4, cart_lines=5)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def checkout(self):
+        order = Order(
+            user=self.user, shipping_address='1 Main St', shipping_city='Springfield',
+            shipping_state='IL', shipping_zip_code='62701', shipping_country='US', phone_number='555-0100',
+        )
+        return place_order(self.cart, order)
+
+    def test_checkout_stores_the_summary(self):
+        order = self.checkout()
+        order.refresh_from_db()
+        self.assertEqual(order.items_summary['lines'], 5)
+        self.assertEqual(order.items_summary['units'], 10)
+        self.assertEqual(
+            [line['product_id'] for line in order.items_summary['preview']],
+            list(order.items.order_by('product_id').values_list('product_id', flat=True)[:3]),
+        )
+
+    def test_history_reads_only_orders(self):
+        self.checkout()
+        out = StringIO()
+        call_command('backfill_order_summaries', '--batch-size', '2', stdout=out)
+        self.assertIn('Backfilled 3 order summaries', out.getvalue())
+        self.assertFalse(Order.objects.filter(items_summary={}).exists())
+
+        with QueryStats() as stats:
+            response = self.client.get(reverse('catalog:order_history'))
+        self.assertFalse([sql for sql, elapsed in stats.queries if 'catalog_orderitem' in sql])
+        self.assertContains(response, '+2 more items')
+        self.assertContains(response, '5 lines, 10 units')
+
+    def test_generated_orders_store_the_summary(self):
+        generator = SyntheticDataGenerator(products=20, users=3, orders=5, carts=0, seed=1)
+        generator.run()
+        generated = Order.objects.filter(order_number__startswith=f'S{generator.run_tag}')
+        self.assertEqual(generated.count(), 5)
+        self.assertFalse(generated.filter(items_summary={}).exists())
+        for order in generated:
+            self.assertEqual(order.items_summary['lines'], order.items.count())
+
+    def test_generated_orders_are_in_sales_rollups(self):
+        SyntheticDataGenerator(products=20, users=3, orders=5, carts=0, seed=1).run()
+        counted = Order.objects.exclude(status='cancelled').filter(created_at__gte=timezone.now() - timedelta(days=366))
+        self.assertEqual(
+            SalesRollup.objects.filter(dimension='all').aggregate(total=Sum('orders'))['total'],
+            counted.count(),
+        )
+        self.assertFalse(counted.filter(in_sales_rollups=False).exists())
+
+    def test_history_summarises_old_orders_in_one_query(self):
+        with QueryStats() as stats:
+            response = self.client.get(reverse('catalog:order_history'))
+        self.assertEqual(len([sql for sql, elapsed in stats.queries if 'catalog_orderitem' in sql]), 1)
+        self.assertContains(response, '+1 more item<')
+        self.assertEqual(response.context['page_obj'].object_list[0].items_summary['lines'], 4)
+
+    def test_detail_query_count_does_not_grow_with_lines(self):
+        small = Order.objects.order_by('id').first()
+        large = self.checkout()
+        OrderItem.objects.bulk_create(
+            OrderItem(order=large, product=product, product_name=product.name, price=product.price, quantity=1)
+            for product in Product.objects.order_by('-id')[:10]
+        )
+        self.client.get(reverse('catalog:order_history'))
+        counts = []
+        for order in (small, large):
+            with QueryStats() as stats:
+                response = self.client.get(reverse('catalog:order_detail', args=[order.id]))
+            self.assertEqual(response.status_code, 200)
+            counts.append(stats.count)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.client.get(reverse('catalog:order_detail', args=[999999])).status_code, 404)
+
+
+class TemplateProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.cart = seed_catalog(categories=2, products_per_category=10, orders=0, cart_lines=0)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_profile_times_templates_blocks_and_includes(self):
+        with TemplateProfile() as profile:
+            self.client.get(reverse('catalog:product_list'))
+        self.assertEqual(profile.entries[('template', 'catalog/includes/product_card.html')][0], 12)
+        self.assertEqual(profile.entries[('template', 'catalog/base.html')][0], 1)
+        self.assertIn(('block', 'catalog/base.html:content'), profile.entries)
+        self.assertIn(('include', 'catalog/includes/pagination.html'), profile.entries)
+        page = profile.entries[('template', 'catalog/product_list.html')]
+        self.assertAlmostEqual(page[1], profile.duration)
+        self.assertAlmostEqual(sum(own for kind, name, calls, total, own in profile.rows), profile.duration)
+
+    @override_settings(CATALOG_TEMPLATE_PROFILE=True)
+    def test_middleware_sends_server_timing(self):
+        with self.assertLogs('catalog.templateprofile', 'INFO') as logs:
+            response = self.client.get(reverse('catalog:home'))
+        self.assertRegex(response['Server-Timing'], r'^tpl;desc="templates";dur=[\d.]+, tpl1;')
+        self.assertIn('catalog/base.html', logs.output[0])
+
+    def test_cards_are_rendered_once_and_read_back_in_one_call(self):
+        url = reverse('catalog:category_products', args=[Category.objects.first().id])
+        first = self.client.get(url).content.decode()
+        with TemplateProfile() as profile:
+            second = self.client.get(url).content.decode()
+        self.assertNotIn(('template', 'catalog/includes/product_card.html'), profile.entries)
+        self.assertEqual(get_stats()['fragment:product_card'], (10, 10))
+        strip = lambda html: re.sub(r'(name="csrfmiddlewaretoken" value=")[^"]+', r'\1', html)
+        self.assertEqual(strip(first), strip(second))
+        self.assertEqual(second.count('class="card product-card h-100"'), 10)
+        self.assertEqual(len(set(re.findall(r'name="csrfmiddlewaretoken" value="([^"]+)"', second))), 1)
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_connections_are_tuned_on_connect(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite profile')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_BUSY_TIMEOUT)
+            cursor.execute('PRAGMA synchronous')
+            synchronous = ['OFF', 'NORMAL', 'FULL', 'EXTRA'][cursor.fetchone()[0]]
+            self.assertEqual(synchronous, settings.SQLITE_SYNCHRONOUS.upper())
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], settings.DB_CONN_MAX_AGE)
+
+
+@override_settings(CATALOG_READ_REPLICAS=['replica1'], CATALOG_CONCURRENT_QUERIES=False)
+class ReplicaRouterTests(TransactionTestCase):
+    """A second SQLite file stands in for the replica, holding different products"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        connections.settings['replica1'] = {
+            **connections['default'].settings_dict, 'NAME': os.path.join(cls.directory, 'replica.sqlite3'),
+        }
+        # Added after the runner set up its databases, so allowed only from here
+        cls.databases = {'default', 'replica1'}
+        call_command('migrate', database='replica1', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+        del cls.databases
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Widgets')
+        product = Product.objects.create(name='Primary widget', category=category, price=Decimal('5.00'), stock=10)
+        # The same rows as replicated, apart from the name
+        Category.objects.using('replica1').bulk_create([category])
+        product.name = 'Replica widget'
+        Product.objects.using('replica1').bulk_create([product])
+        self.user = User.objects.create_user('shopper', password='pass')
+        self.client.force_login(self.user)
+
+    def test_browsing_reads_catalog_from_replica(self):
+        product = Product.objects.get()
+        for url in (
+            reverse('catalog:home'),
+            reverse('catalog:product_list'),
+            reverse('catalog:product_detail', args=[product.id]),
+            reverse('catalog:category_products', args=[product.category_id]),
+        ):
+            response = self.client.get(url)
+            self.assertContains(response, 'Replica widget')
+            self.assertNotContains(response, 'Primary widget')
+
+    def test_writes_keep_reads_on_primary(self):
+        product = Product.objects.get()
+        response = self.client.post(reverse('catalog:add_to_cart', args=[product.id]), {'quantity': 1})
+        self.assertEqual(CartItem.objects.get().product, product)
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 10)
+
+        self.assertContains(self.client.get(reverse('catalog:product_list')), 'Primary widget')
+        self.assertContains(self.client.get(reverse('catalog:cart')), 'Primary widget')
+        del self.client.cookies[STICKY_COOKIE]
+        self.assertContains(self.client.get(reverse('catalog:product_list')), 'Replica widget')
+
+    def test_stickiness_middleware_is_async_capable(self):
+        async def app(request):
+            return HttpResponse('app')
+
+        middleware = ReplicaStickinessMiddleware(app)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().post('/'))
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 10)
+        self.assertNotIn(STICKY_COOKIE, async_to_sync(middleware)(RequestFactory().get('/')).cookies)
+
+    def test_cached_pages_are_rendered_from_primary(self):
+        # The replica is behind: it still has the old name
+        anonymous = Client()
+        bump('products')
+        response = anonymous.get(reverse('catalog:product_list'))
+        self.assertEqual(response['X-Catalog-Cache'], 'miss')
+        self.assertContains(response, 'Primary widget')
+        self.assertNotContains(response, 'Replica widget')
+        response = anonymous.get(reverse('catalog:product_list'))
+        self.assertEqual(response['X-Catalog-Cache'], 'hit')
+        self.assertContains(response, 'Primary widget')
+
+    def test_recent_write_bypasses_page_cache(self):
+        anonymous = Client()
+        anonymous.get(reverse('catalog:home'))
+        self.assertEqual(anonymous.get(reverse('catalog:home'))['X-Catalog-Cache'], 'hit')
+        anonymous.cookies[STICKY_COOKIE] = '1'
+        response = anonymous.get(reverse('catalog:home'))
+        self.assertNotIn('X-Catalog-Cache', response)
+        self.assertContains(response, 'Primary widget')
+
+    def test_replica_selection(self):
+        replicas = ['replica1', 'replica2']
+        picked = [choose_replica(replicas) for _ in range(4)]
+        self.assertEqual(sorted(picked), ['replica1', 'replica1', 'replica2', 'replica2'])
+        self.assertNotEqual(picked[0], picked[1])
+        for alias in picked:
+            release_replica(alias)
+
+        with self.settings(CATALOG_REPLICA_SELECTION='least_loaded'):
+            busy = choose_replica(replicas)
+            for _ in range(3):
+                other = choose_replica(replicas)
+                self.assertNotEqual(other, busy)
+                release_replica(other)
+            release_replica(busy)
+
+
+class StaticAssetTests(TestCase):
+    def setUp(self):
+        self.static_dir = tempfile.mkdtemp()
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_dir)
+        self.addCleanup(shutil.rmtree, self.static_root)
+        settings_override = override_settings(
+            STATICFILES_DIRS=[self.static_dir, settings.BASE_DIR / 'static'],
+            STATIC_ROOT=self.static_root,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        asset_url.cache_clear()
+        self.addCleanup(asset_url.cache_clear)
+
+    def fake_fetch(self, url):
+        if url.endswith('bootstrap-icons.css'):
+            return b'.bi { background: url("./fonts/bootstrap-icons.woff2?abc123") }\n' * 50
+        if url.endswith(('.woff', '.woff2')):
+            return os.urandom(2048)
+        return b'/* bootstrap */ .btn { color: red }\n' * 50 + b'/*# sourceMappingURL=bootstrap.min.css.map */'
+
+    def test_vendor_downloads_once_and_locks_digests(self):
+        self.assertTrue(asset_url('bootstrap.css').startswith('https://cdn.jsdelivr.net/'))
+        self.assertEqual(len(vendor(fetch=self.fake_fetch)), len(VENDOR_ASSETS))
+        self.assertEqual(asset_url('bootstrap.css'), '/static/vendor/bootstrap/bootstrap.min.css')
+        with open(os.path.join(self.static_dir, 'vendor/bootstrap/bootstrap.min.css'), 'rb') as f:
+            self.assertNotIn(b'sourceMappingURL', f.read())
+        with open(os.path.join(self.static_dir, 'vendor/vendor.lock.json')) as f:
+            self.assertTrue(json.load(f)['vendor/bootstrap/bootstrap.min.css'].startswith('sha384-'))
+
+        self.assertEqual(vendor(fetch=self.fake_fetch), [])
+        with self.assertRaises(VendorError):
+            vendor(refresh=True, fetch=lambda url: b'tampered')
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'catalog.storage.CompressedManifestStaticFilesStorage'},
+    })
+    def test_build_hashes_compresses_and_serves_immutable(self):
+        vendor(fetch=self.fake_fetch)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.static_root, 'staticfiles.json')) as f:
+            paths = json.load(f)['paths']
+        css = paths['css/shophub.css']
+        self.assertRegex(css, r'^css/shophub\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, css + '.gz')))
+        with open(os.path.join(self.static_root, paths['vendor/bootstrap-icons/bootstrap-icons.css'])) as f:
+            self.assertIn(paths['vendor/bootstrap-icons/fonts/bootstrap-icons.woff2'].split('/')[-1], f.read())
+
+        client = Client()
+        page = client.get(reverse('catalog:home')).content.decode()
+        self.assertIn(f'/static/{css}', page)
+        self.assertIn(f'/static/{paths["vendor/bootstrap/bootstrap.bundle.min.js"]}', page)
+        self.assertNotIn('cdn.jsdelivr.net', page)
+
+        response = client.get(f'/static/{css}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Type'], 'text/css; charset=utf-8')
+        with open(os.path.join(self.static_root, css), 'rb') as f:
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), f.read())
+
+        response = client.get('/static/css/shophub.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(client.get('/static/../manage.py').status_code, 404)
+
+    def test_static_files_middleware_is_async_capable(self):
+        with open(os.path.join(self.static_root, 'robots.txt'), 'w') as f:
+            f.write('User-agent: *\n')
+
+        async def app(request):
+            return HttpResponse('app')
+
+        middleware = StaticFilesMiddleware(app)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/static/robots.txt'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(async_to_sync(middleware)(RequestFactory().get('/')).content, b'app')
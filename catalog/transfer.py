@@ -0,0 +1,239 @@
+"""
+Bulk export and import of catalog and order data as CSV or JSON Lines.
+
+Exports read the table with ``values_list(...).iterator(chunk_size=...)`` and
+yield one line per row, so a dump of any size streams to a file
+(``manage.py export_data``) or to the browser (the admin export actions)
+without being held in memory.
+
+``import_products()`` (``manage.py import_products``) reads a product file
+row by row, validates each row with ProductImportForm and writes the valid
+ones a batch per transaction with one ``INSERT ... ON CONFLICT (id) DO
+UPDATE``: rows with an id update that product, rows without one create a new
+product. Categories are matched by name and created when missing. The
+signals that bulk writes skip are made up for per batch (search index, cart
+totals) and once at the end (page caches).
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .caching import bump, bump_for_products
+from .datagen import batched
+from .forms import ProductImportForm
+from .models import Cart, Category, Order, OrderItem, Product
+from .search import get_search_backend
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+# Dataset -> (model, {column: field path})
+EXPORTS = {
+    'products': (Product, {
+        'id': 'id',
+        'name': 'name',
+        'category': 'category__name',
+        'price': 'price',
+        'description': 'description',
+        'stock': 'stock',
+        'is_active': 'is_active',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }),
+    'orders': (Order, {
+        'id': 'id',
+        'order_number': 'order_number',
+        'user': 'user__username',
+        'status': 'status',
+        'total_amount': 'total_amount',
+        'shipping_address': 'shipping_address',
+        'shipping_city': 'shipping_city',
+        'shipping_state': 'shipping_state',
+        'shipping_zip_code': 'shipping_zip_code',
+        'shipping_country': 'shipping_country',
+        'phone_number': 'phone_number',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }),
+    'order_items': (OrderItem, {
+        'id': 'id',
+        'order_number': 'order__order_number',
+        'product_id': 'product_id',
+        'product_name': 'product_name',
+        'price': 'price',
+        'quantity': 'quantity',
+    }),
+}
+
+PRODUCT_UPDATE_FIELDS = ['name', 'category', 'price', 'description', 'stock', 'is_active', 'updated_at']
+
+
+class Echo:
+    """File-like object for csv.writer that hands each line back instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(dataset, queryset=None, chunk_size=2000):
+    """Yield the dataset's rows as tuples in column order, ``chunk_size`` rows per fetch"""
+    model, columns = EXPORTS[dataset]
+    if queryset is None:
+        queryset = model._default_manager.all()
+    return queryset.order_by('pk').values_list(*columns.values()).iterator(chunk_size=chunk_size)
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_lines(dataset, format='csv', queryset=None, chunk_size=2000):
+    """Yield the dataset as CSV (with a header row) or JSON Lines, a line at a time"""
+    columns = list(EXPORTS[dataset][1])
+    rows = export_rows(dataset, queryset, chunk_size)
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([csv_value(value) for value in row])
+    elif format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+    else:
+        raise ValueError(f'Unknown export format {format!r}')
+
+
+def export_response(dataset, format='csv', queryset=None, chunk_size=2000):
+    """A StreamingHttpResponse downloading the export as an attachment"""
+    content_type, extension = FORMATS[format]
+    response = StreamingHttpResponse(
+        export_lines(dataset, format, queryset, chunk_size),
+        content_type=f'{content_type}; charset=utf-8',
+    )
+    filename = f'{dataset}-{timezone.localdate().isoformat()}.{extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def read_rows(file, format='csv'):
+    """Yield ``(line_number, row)`` from an open file; ``row`` is None for unparseable lines"""
+    if format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'jsonl':
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f'Unknown import format {format!r}')
+
+
+class ImportReport:
+    """Running totals of an import; only the first ``max_errors`` errors are kept"""
+
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.invalid = 0
+        self.errors = []
+        self.category_ids = set()
+        self.new_categories = 0
+
+    def error(self, line_number, message):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, message))
+
+
+def row_errors(form):
+    return '; '.join(f'{field}: {" ".join(errors)}' for field, errors in form.errors.items())
+
+
+def import_products(file, format='csv', batch_size=1000, progress=None, max_errors=100):
+    """
+    Validate and upsert the products in ``file``, a transaction per
+    ``batch_size`` rows; ``progress(report)`` is called after each batch.
+    Returns the ImportReport.
+    """
+    report = ImportReport(max_errors)
+    categories = {}
+    for category in Category.objects.order_by('-id'):
+        categories[category.name] = category
+
+    for batch in batched(read_rows(file, format), batch_size):
+        valid = {}
+        report.processed += len(batch)
+        for line_number, row in batch:
+            if row is None:
+                report.error(line_number, 'Not a JSON object')
+                continue
+            form = ProductImportForm(row)
+            if not form.is_valid():
+                report.error(line_number, row_errors(form))
+                continue
+            # A later row for the same product wins, as if applied in order
+            key = form.cleaned_data['id'] or ('new', line_number)
+            valid[key] = (line_number, form.cleaned_data)
+        save_products(list(valid.values()), categories, report)
+        if progress:
+            progress(report)
+
+    if report.new_categories:
+        bump('categories')
+    if report.category_ids:
+        bump_for_products(report.category_ids)
+    return report
+
+
+def save_products(rows, categories, report):
+    """Write one batch of cleaned rows; ``categories`` maps names to Category and is extended"""
+    with transaction.atomic():
+        ids = [data['id'] for line_number, data in rows if data['id']]
+        existing = set(Product.objects.filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+
+        missing = {data['category'] for line_number, data in rows} - categories.keys()
+        if missing:
+            for category in Category.objects.bulk_create(Category(name=name) for name in missing):
+                categories[category.name] = category
+            report.new_categories += len(missing)
+
+        products = []
+        for line_number, data in rows:
+            if data['id'] and data['id'] not in existing:
+                report.error(line_number, f'id: No product with id {data["id"]}.')
+                continue
+            products.append(Product(
+                id=data['id'], name=data['name'], category=categories[data['category']], price=data['price'],
+                description=data['description'], stock=data['stock'], is_active=data['is_active'],
+            ))
+        if not products:
+            return
+        Product.objects.bulk_create(
+            products, update_conflicts=True, unique_fields=['id'], update_fields=PRODUCT_UPDATE_FIELDS,
+        )
+        get_search_backend().index_products(products)
+        updated = [product.pk for product in products if product.pk in existing]
+        if updated:
+            # Price changes alter the stored subtotals of carts holding these products
+            Cart.objects.filter(items__product_id__in=updated).update_totals()
+        report.updated += len(updated)
+        report.created += len(products) - len(updated)
+        report.category_ids.update(product.category_id for product in products)
@@ -26,6 +26,7 @@ urlpatterns = [
     path('order-confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
     path('orders/', views.order_history, name='order_history'),
     path('order/<int:order_id>/', views.order_detail, name='order_detail'),
+    path('order/<int:order_id>/reorder/', views.reorder, name='reorder'),
     
     # Other pages
     path('about/', views.about, name='about'),
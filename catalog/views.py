@@ -1,70 +1,137 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db.models import F, Subquery
+from django.http import Http404, JsonResponse
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator
-from .models import Product, Category, Cart, CartItem, Order, OrderItem
+from .models import Product, Category, Cart, CartItem, Order
 from .forms import UserRegistrationForm, CheckoutForm, ProductSearchForm, CartItemForm, ContactForm
+from .caching import cache_anonymous_page, product_category
+from .cart import (
+    GuestCart, add_item, apply_cart_operations, merge_guest_cart, remove_item, set_item_quantity, store_cart_summary,
+)
+from . import tasks
+from .concurrency import run_concurrently
+from .facets import compute_facets
+from .jobs import enqueue
+from .orders import fill_summaries, with_items
+from .pagination import KeysetPaginator
+from .routers import replica_reads
+from .search import search_products
+from .services import OutOfStockError, place_order
 
-def home(request):
+# The storefront read views are async: independent queries run concurrently
+# (see catalog.concurrency) and templates render off the event loop, since
+# the context processors and template tags touch the session and cache.
+arender = sync_to_async(render)
+
+
+def get_or_none(queryset, **lookups):
+    try:
+        return queryset.get(**lookups)
+    except queryset.model.DoesNotExist:
+        return None
+
+
+@cache_anonymous_page(['products', 'categories'])
+@replica_reads
+async def home(request):
     """Home page with featured products and categories"""
-    featured_products = Product.objects.filter(is_active=True)[:6]
-    categories = Category.objects.all()[:6]
+    featured_products, categories = await run_concurrently(
+        lambda: list(Product.objects.filter(is_active=True).select_related('category')[:6]),
+        lambda: list(Category.objects.all()[:6]),
+    )
     
     context = {
         'featured_products': featured_products,
         'categories': categories,
     }
-    return render(request, 'catalog/home.html', context)
+    return await arender(request, 'catalog/home.html', context)
 
-def product_list(request):
+@cache_anonymous_page(['products', 'categories'])
+@replica_reads
+async def product_list(request):
     """Product listing page with search and filtering"""
-    products = Product.objects.filter(is_active=True)
-    search_form = ProductSearchForm(request.GET)
+    categories = [category async for category in Category.objects.all()]
+    products = Product.objects.filter(is_active=True).select_related('category')
+    search_form = ProductSearchForm(request.GET, categories=categories)
+    category_id = None
+    in_stock = False
     
     if search_form.is_valid():
         search_query = search_form.cleaned_data.get('search_query')
         category = search_form.cleaned_data.get('category')
         min_price = search_form.cleaned_data.get('min_price')
         max_price = search_form.cleaned_data.get('max_price')
+        in_stock = search_form.cleaned_data.get('in_stock')
         
         if search_query:
-            products = products.filter(
-                Q(name__icontains=search_query) | 
-                Q(description__icontains=search_query)
-            )
-        
-        if category:
-            products = products.filter(category__name=category)
+            products = search_products(products, search_query)
         
         if min_price:
             products = products.filter(price__gte=min_price)
         
         if max_price:
             products = products.filter(price__lte=max_price)
+        
+        if category:
+            category_id = next((c.id for c in categories if c.name == category), 0)
+    
+    # Facet counts come from the results before the category and stock
+    # filters, so the other options can still show how many they'd match
+    facet_products = products
     
-    # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    
+    if in_stock:
+        products = products.filter(stock__gt=F('reserved'))
+    
+    # Pagination; the facet total doubles as the page count
+    paginator = KeysetPaginator(products, 12, count=False)
+    cursor = request.GET.get('cursor')
+    facets, page_obj = await run_concurrently(
+        lambda: compute_facets(facet_products, categories, category_id, in_stock),
+        lambda: paginator.get_page(cursor),
+    )
+    paginator.count = facets.total
     
     context = {
         'page_obj': page_obj,
         'search_form': search_form,
-        'categories': Category.objects.all(),
+        'categories': categories,
+        'facets': facets,
     }
-    return render(request, 'catalog/product_list.html', context)
+    return await arender(request, 'catalog/product_list.html', context)
+
+def product_page_scopes(product_id):
+    """
+    A product page is versioned by the product and, since it lists related
+    products, its category, so edits elsewhere in the catalog and checkouts
+    of other products leave it cached.
+    """
+    return ['categories', f'category:{product_category(product_id)}', f'product:{product_id}']
+
 
-def product_detail(request, product_id):
+@cache_anonymous_page(product_page_scopes)
+@replica_reads
+async def product_detail(request, product_id):
     """Product detail page"""
-    product = get_object_or_404(Product, id=product_id, is_active=True)
-    related_products = Product.objects.filter(
-        category=product.category, 
-        is_active=True
-    ).exclude(id=product.id)[:4]
+    # Related products select the category through a subquery so they don't
+    # have to wait for the product itself
+    category_id = Product.objects.filter(id=product_id).values('category_id')[:1]
+    product, related_products = await run_concurrently(
+        lambda: get_or_none(Product.objects.select_related('category'), id=product_id, is_active=True),
+        lambda: list(
+            Product.objects.filter(category_id=Subquery(category_id), is_active=True)
+            .select_related('category').exclude(id=product_id)[:4]
+        ),
+    )
+    if product is None:
+        raise Http404('No Product matches the given query.')
     
     cart_form = CartItemForm()
     
@@ -73,22 +140,28 @@ def product_detail(request, product_id):
         'related_products': related_products,
         'cart_form': cart_form,
     }
-    return render(request, 'catalog/product_detail.html', context)
+    return await arender(request, 'catalog/product_detail.html', context)
 
-def category_products(request, category_id):
+@cache_anonymous_page(lambda category_id: ['categories', f'category:{category_id}'])
+@replica_reads
+async def category_products(request, category_id):
     """Products filtered by category"""
-    category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category, is_active=True)
-    
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    products = Product.objects.filter(category_id=category_id, is_active=True).select_related('category')
+    paginator = KeysetPaginator(products, 12)
+    cursor = request.GET.get('cursor')
+    category, page_obj, _ = await run_concurrently(
+        lambda: get_or_none(Category.objects.all(), id=category_id),
+        lambda: paginator.get_page(cursor),
+        lambda: paginator.count,
+    )
+    if category is None:
+        raise Http404('No Category matches the given query.')
     
     context = {
         'category': category,
         'page_obj': page_obj,
     }
-    return render(request, 'catalog/category_products.html', context)
+    return await arender(request, 'catalog/category_products.html', context)
 
 def register(request):
     """User registration"""
@@ -113,13 +186,21 @@ def user_login(request):
         if user is not None:
             login(request, user)
             messages.success(request, f'Welcome back, {user.username}!')
-            return redirect('catalog:home')
+            next_url = request.POST.get('next') or request.GET.get('next')
+            if not url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+                next_url = 'catalog:home'
+            response = redirect(next_url)
+            if merge_guest_cart(request, response):
+                messages.warning(request, 'Some items from your cart are no longer available.')
+            return response
         else:
             messages.error(request, 'Invalid username or password.')
     
     return render(request, 'catalog/login.html')
 
-@login_required
+# Anonymous visitors' carts live in a signed cookie (catalog.cart.GuestCart);
+# the cart views below serve them without touching the cart tables.
+
 def add_to_cart(request, product_id):
     """Add product to cart"""
     if request.method == 'POST':
@@ -128,35 +209,37 @@ def add_to_cart(request, product_id):
         
         if form.is_valid():
             quantity = form.cleaned_data['quantity']
-            
-            # Get or create cart for user
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            
-            # Check if product already in cart
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart, 
-                product=product,
-                defaults={'quantity': quantity}
-            )
-            
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
+            guest_cart = None if request.user.is_authenticated else GuestCart.from_request(request)
+            try:
+                if guest_cart is not None:
+                    guest_cart.add(product, quantity)
+                else:
+                    store_cart_summary(request, add_item(request.user, product, quantity))
+            except OutOfStockError:
+                messages.error(request, f'Sorry, there are not enough {product.name} left in stock.')
+                return redirect('catalog:product_detail', product_id=product_id)
             
             messages.success(request, f'{product.name} added to cart!')
-            return redirect('catalog:cart')
+            response = redirect('catalog:cart')
+            if guest_cart is not None:
+                guest_cart.save(response)
+            return response
     
     return redirect('catalog:product_detail', product_id=product_id)
 
-@login_required
 def cart_view(request):
     """View shopping cart"""
+    if not request.user.is_authenticated:
+        guest_cart = GuestCart.from_request(request)
+        cart_items = guest_cart.items()
+        return render(request, 'catalog/cart.html', {'cart': guest_cart, 'cart_items': cart_items})
     try:
         cart = Cart.objects.get(user=request.user)
-        cart_items = cart.items.all()
+        cart_items = cart.items.select_related('product__category')
     except Cart.DoesNotExist:
         cart = None
         cart_items = []
+    store_cart_summary(request, cart)
     
     context = {
         'cart': cart,
@@ -164,30 +247,57 @@ def cart_view(request):
     }
     return render(request, 'catalog/cart.html', context)
 
-@login_required
+def update_guest_cart(request, product_id, quantity, success_message):
+    """Set a GuestCart line's quantity; lines are addressed by product id"""
+    guest_cart = GuestCart.from_request(request)
+    if product_id not in guest_cart.lines:
+        raise Http404('No such cart item.')
+    product = Product.objects.filter(id=product_id).only('id', 'name', 'stock', 'reserved').first()
+    try:
+        if product is None:
+            guest_cart.lines.pop(product_id)
+            guest_cart.changed = True
+        else:
+            guest_cart.set(product, quantity)
+    except OutOfStockError as exc:
+        messages.error(request, f'{exc}.')
+        return redirect('catalog:cart')
+    messages.success(request, success_message)
+    response = redirect('catalog:cart')
+    guest_cart.save(response)
+    return response
+
 @require_POST
 def update_cart_item(request, item_id):
     """Update cart item quantity"""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     quantity = int(request.POST.get('quantity', 1))
+    if not request.user.is_authenticated:
+        message = 'Cart updated successfully!' if quantity > 0 else 'Item removed from cart!'
+        return update_guest_cart(request, item_id, quantity, message)
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart'), id=item_id, cart__user=request.user)
     
+    try:
+        set_item_quantity(cart_item, quantity)
+    except OutOfStockError as exc:
+        messages.error(request, f'{exc}.')
+        return redirect('catalog:cart')
     if quantity > 0:
-        cart_item.quantity = quantity
-        cart_item.save()
         messages.success(request, 'Cart updated successfully!')
     else:
-        cart_item.delete()
         messages.success(request, 'Item removed from cart!')
+    store_cart_summary(request, cart_item.cart)
     
     return redirect('catalog:cart')
 
-@login_required
 @require_POST
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+    if not request.user.is_authenticated:
+        return update_guest_cart(request, item_id, 0, 'Item removed from cart!')
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart', 'product'), id=item_id, cart__user=request.user)
     product_name = cart_item.product.name
-    cart_item.delete()
+    remove_item(cart_item)
+    store_cart_summary(request, cart_item.cart)
     messages.success(request, f'{product_name} removed from cart!')
     return redirect('catalog:cart')
 
@@ -196,7 +306,7 @@ def checkout(request):
     """Checkout process"""
     try:
         cart = Cart.objects.get(user=request.user)
-        if not cart.items.exists():
+        if not cart.item_count:
             messages.warning(request, 'Your cart is empty!')
             return redirect('catalog:cart')
     except Cart.DoesNotExist:
@@ -206,29 +316,14 @@ def checkout(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            # Create order
             order = form.save(commit=False)
             order.user = request.user
-            order.total_amount = cart.total_price
-            order.save()
-            
-            # Create order items
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    product_name=cart_item.product.name,
-                    price=cart_item.product.price,
-                    quantity=cart_item.quantity
-                )
-                
-                # Update product stock
-                product = cart_item.product
-                product.stock -= cart_item.quantity
-                product.save()
-            
-            # Clear cart
-            cart.delete()
+            try:
+                place_order(cart, order)
+            except OutOfStockError as exc:
+                messages.error(request, f'{exc}. Please update your cart.')
+                return redirect('catalog:cart')
+            store_cart_summary(request, None)
             
             messages.success(request, f'Order placed successfully! Order number: {order.order_number}')
             return redirect('catalog:order_confirmation', order_id=order.id)
@@ -238,33 +333,52 @@ def checkout(request):
     context = {
         'form': form,
         'cart': cart,
+        'cart_items': cart.items.select_related('product'),
     }
     return render(request, 'catalog/checkout.html', context)
 
 @login_required
 def order_confirmation(request, order_id):
     """Order confirmation page"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.prefetch_related('items'), id=order_id, user=request.user)
     return render(request, 'catalog/order_confirmation.html', {'order': order})
 
 @login_required
 def order_history(request):
-    """User's order history"""
+    """User's order history; line counts and previews come from the stored summaries"""
     orders = Order.objects.filter(user=request.user).order_by('-created_at')
     
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(orders, 10, count=False)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    fill_summaries(page_obj.object_list)
     
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'catalog/order_history.html', context)
 
+@login_required
+@require_POST
+def reorder(request, order_id):
+    """Put every line of a past order back in the cart"""
+    order = get_object_or_404(Order.objects.only('id'), id=order_id, user=request.user)
+    operations = [('add', product_id, quantity) for product_id, quantity in order.items.values_list('product_id', 'quantity')]
+    try:
+        cart, skipped = apply_cart_operations(request.user, operations, skip_unavailable=True)
+    except OutOfStockError as exc:
+        messages.error(request, f'{exc}. Nothing was added to your cart.')
+        return redirect('catalog:order_detail', order_id=order.id)
+    store_cart_summary(request, cart)
+    
+    if skipped:
+        messages.warning(request, f'{len(skipped)} item(s) from this order are no longer available.')
+    messages.success(request, 'Items from your order were added to your cart.')
+    return redirect('catalog:cart')
+
 @login_required
 def order_detail(request, order_id):
     """Order detail view"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(with_items(Order.objects.filter(user=request.user)), id=order_id)
     return render(request, 'catalog/order_detail.html', {'order': order})
 
 def contact(request):
@@ -272,7 +386,7 @@ def contact(request):
     if request.method == 'POST':
         form = ContactForm(request.POST)
         if form.is_valid():
-            # Here you would typically send an email
+            enqueue(tasks.send_contact_message, **form.cleaned_data)
             messages.success(request, 'Thank you for your message! We will get back to you soon.')
             return redirect('catalog:contact')
     else:
@@ -280,6 +394,7 @@ def contact(request):
     
     return render(request, 'catalog/contact.html', {'form': form})
 
+@cache_anonymous_page([])
 def about(request):
     """About page"""
     return render(request, 'catalog/about.html')